@@ -0,0 +1,127 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compares the default GIFWriter against the OptimizedGIFWriter (OUTPUT_GIF_OPTIMIZE: True) on the bundled gree_*.yaml motions.
+Each motion is rendered once, headless, and the same frames are then encoded by each writer.
+Reports output size, encode time, and color error of the decoded gif's opaque pixels.
+
+Run from the repository root:
+    python AnimatedDrawings/examples/gif_writer_benchmark.py [gree_walk gree_dab ...]
+"""
+
+import os
+os.environ.setdefault('PYOPENGL_PLATFORM', 'osmesa')  # must be set before OpenGL is imported
+
+import sys
+import time
+import tempfile
+import types
+from pathlib import Path
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+import numpy.typing as npt
+import yaml
+from PIL import Image, ImageSequence
+
+from animated_drawings.controller.video_render_controller import GIFWriter, OptimizedGIFWriter, VideoWriter
+
+MVC_CFG_DIR = Path(__file__).parent / 'config' / 'mvc'
+
+
+class _FrameCollector(VideoWriter):
+    """ Keeps every rendered frame in memory, so each writer being compared can be fed the same frames """
+
+    def __init__(self) -> None:
+        self.frames: List[npt.NDArray[np.uint8]] = []
+
+    def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
+        self.frames.append(frame.copy())  # frame is only valid until process_frame returns
+
+    def cleanup(self) -> None:
+        pass
+
+
+def render_frames(mvc_cfg_p: Path) -> Tuple[List[npt.NDArray[np.uint8]], float]:
+    """ Renders the motion described by the mvc config and returns its BGRA frames and the time between them """
+    from animated_drawings.config import Config
+    from animated_drawings.view.view import View
+    from animated_drawings.model.scene import Scene
+    from animated_drawings.controller.controller import Controller
+
+    with open(mvc_cfg_p, 'r') as f:
+        mvc_cfg = yaml.safe_load(f)
+    mvc_cfg['controller']['OUTPUT_VIDEO_PATH'] = str(Path(tempfile.gettempdir(), 'gif_writer_benchmark.gif'))
+
+    cfg = Config(mvc_cfg)
+    view = View.create_view(cfg.view)
+    scene = Scene(cfg.scene)
+    controller = Controller.create_controller(cfg.controller, scene, view)
+
+    # the controller made its own writer for OUTPUT_VIDEO_PATH. Release it before collecting frames in its place
+    controller.video_writer.cleanup()  # type: ignore
+    collector = _FrameCollector()
+    controller.video_writer = collector  # type: ignore
+    controller.run()
+
+    return collector.frames, controller.delta_t  # type: ignore
+
+
+def encode(writer_cls: Type[GIFWriter], frames: List[npt.NDArray[np.uint8]], delta_t: float, output_p: Path) -> float:
+    """ Writes frames to output_p with writer_cls and returns the time it took, in seconds """
+    controller = types.SimpleNamespace(cfg=types.SimpleNamespace(output_video_path=str(output_p)), delta_t=delta_t)
+    start_time = time.time()
+    writer = writer_cls(controller)  # type: ignore
+    for frame in frames:
+        writer.process_frame(frame)
+    writer.cleanup()
+    return time.time() - start_time
+
+
+def color_error(frames: List[npt.NDArray[np.uint8]], gif_p: Path) -> Tuple[float, int]:
+    """ Returns the mean and max absolute RGB difference between the source frames and the decoded gif, over opaque pixels """
+    decoded = [np.asarray(f.convert('RGBA')) for f in ImageSequence.Iterator(Image.open(gif_p))]
+    durations = [f.info['duration'] for f in ImageSequence.Iterator(Image.open(gif_p))]
+
+    # identical consecutive frames are merged by the writers. Expand them again, based upon their durations
+    frame_duration = durations[0] if len(set(durations)) == 1 else min(durations)
+    expanded = [d for d, duration in zip(decoded, durations) for _ in range(max(1, round(duration / frame_duration)))]
+
+    total, count, max_err = 0.0, 0, 0
+    for src, dec in zip(frames, expanded):
+        opaque = src[:, :, 3] != 0
+        diff = np.abs(src[opaque][:, [2, 1, 0]].astype(np.int32) - dec[opaque][:, :3].astype(np.int32))
+        total += float(diff.sum())
+        count += diff.size
+        max_err = max(max_err, int(diff.max(initial=0)))
+    return total / max(count, 1), max_err
+
+
+def benchmark(frames: List[npt.NDArray[np.uint8]], delta_t: float, output_dir: Path, name: str) -> Dict[str, Dict[str, float]]:
+    """ Encodes frames with each writer and returns, per writer, output bytes, encode seconds, and color error """
+    results: Dict[str, Dict[str, float]] = {}
+    for writer_cls in (GIFWriter, OptimizedGIFWriter):
+        output_p = output_dir / f'{name}_{writer_cls.__name__}.gif'
+        seconds = encode(writer_cls, frames, delta_t, output_p)
+        mean_err, max_err = color_error(frames, output_p)
+        results[writer_cls.__name__] = {'bytes': output_p.stat().st_size, 'seconds': seconds, 'mean_err': mean_err, 'max_err': max_err}
+    return results
+
+
+def print_results(name: str, frame_count: int, results: Dict[str, Dict[str, float]]) -> None:
+    base = results['GIFWriter']
+    for writer_name, r in results.items():
+        print(f'{name:<16} {frame_count:>6} {writer_name:<20} {int(r["bytes"]):>10} {r["bytes"] / base["bytes"]:>7.2f}x '
+              f'{r["seconds"]:>8.2f}s {r["mean_err"]:>8.2f} {int(r["max_err"]):>7}')
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(p.stem for p in MVC_CFG_DIR.glob('gree_*.yaml'))
+
+    print(f'{"motion":<16} {"frames":>6} {"writer":<20} {"bytes":>10} {"size":>8} {"encode":>9} {"mean err":>8} {"max err":>7}')
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name in names:
+            frames, delta_t = render_frames(MVC_CFG_DIR / f'{name}.yaml')
+            print_results(name, len(frames), benchmark(frames, delta_t, Path(output_dir), name))
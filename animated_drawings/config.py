@@ -14,16 +14,24 @@ from animated_drawings.utils import resolve_ad_filepath
 
 class Config():
 
-    def __init__(self, user_mvc_cfg_fn: str) -> None:
+    def __init__(self, user_mvc_cfg: Union[str, dict]) -> None:
+        """
+        user_mvc_cfg is either the filepath of a user mvc config file or an already-loaded, in-memory mvc config dictionary.
+        In-memory configs let callers point each render job at its own character files and output path without writing a config to disk.
+        """
         # get the base mvc config
         with open(resource_filename(__name__, "mvc_base_cfg.yaml"), 'r') as f:
             base_cfg = defaultdict(dict, yaml.load(f, Loader=yaml.FullLoader) or {})  # pyright: ignore[reportUnknownMemberType])
 
-        # search for the user-specified mvc config
-        user_mvc_cfg_p: Path = resolve_ad_filepath(user_mvc_cfg_fn, 'user mvc config')
-        logging.info(f'Using user-specified mvc config file located at {user_mvc_cfg_p.resolve()}')
-        with open(str(user_mvc_cfg_p), 'r') as f:
-            user_cfg = defaultdict(dict, yaml.load(f, Loader=yaml.FullLoader) or {})  # pyright: ignore[reportUnknownMemberType]
+        if isinstance(user_mvc_cfg, dict):
+            logging.info('Using in-memory user mvc config')
+            user_cfg = defaultdict(dict, user_mvc_cfg)
+        else:
+            # search for the user-specified mvc config
+            user_mvc_cfg_p: Path = resolve_ad_filepath(user_mvc_cfg, 'user mvc config')
+            logging.info(f'Using user-specified mvc config file located at {user_mvc_cfg_p.resolve()}')
+            with open(str(user_mvc_cfg_p), 'r') as f:
+                user_cfg = defaultdict(dict, yaml.load(f, Loader=yaml.FullLoader) or {})  # pyright: ignore[reportUnknownMemberType]
 
         # overlay user specified mvc options onto base mvc, use to generate subconfig classes
         self.view: ViewConfig = ViewConfig({**base_cfg['view'], **user_cfg['view']})
@@ -178,6 +186,15 @@ class ViewConfig():
             logging.critical(msg)
             assert False, msg
 
+        # set whether the mesa context should outlive the view, to be reused by the next view in this process
+        try:
+            self.keep_context: bool = view_cfg['KEEP_CONTEXT']
+            assert isinstance(self.keep_context, bool), 'value is not bool type'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in KEEP_CONTEXT config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
         # set the position of the view camera
         try:
             self.camera_pos: list[Union[float, int]] = view_cfg['CAMERA_POS']
@@ -245,6 +262,15 @@ class ControllerConfig():
             logging.critical(msg)
             assert False, msg
 
+        # set whether to write smaller, optimized gifs (only use in video_render mode with .gif)
+        try:
+            self.output_gif_optimize: bool = controller_cfg['OUTPUT_GIF_OPTIMIZE']
+            assert isinstance(self.output_gif_optimize, bool), 'value is not bool type'
+        except (AssertionError, ValueError) as e:
+            msg = f'Error in OUTPUT_GIF_OPTIMIZE config parameter: {e}'
+            logging.critical(msg)
+            assert False, msg
+
 
 class CharacterConfig():
 
@@ -255,6 +281,7 @@ class CharacterConfig():
 
     def __init__(self, char_cfg_fn: str) -> None:  # noqa: C901
         character_cfg_p = resolve_ad_filepath(char_cfg_fn, 'character cfg')
+        self.char_cfg_p: Path = character_cfg_p  # used to recognize the same character across scenes
         with open(str(character_cfg_p), 'r') as f:
             char_cfg = yaml.load(f, Loader=yaml.FullLoader)
 
@@ -0,0 +1,175 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+""" Atlas Render Controller Class Module """
+
+from __future__ import annotations
+import math
+import time
+import logging
+from typing import Callable, Deque, List, Optional, Tuple
+from collections import deque
+import numpy as np
+import numpy.typing as npt
+from tqdm import tqdm
+
+from animated_drawings.controller.controller import Controller
+from animated_drawings.controller.video_render_controller import VideoRenderController, VideoWriter
+from animated_drawings.model.scene import Scene
+from animated_drawings.model.animated_drawing import AnimatedDrawing
+from animated_drawings.view.mesa_view import MesaView
+from animated_drawings.config import ControllerConfig
+
+
+class AtlasTile():
+    """
+    One scene of an atlas render: the region of the framebuffer it is drawn into, and the video file its frames are written to.
+    Has the attributes video writers read from their controller, so it is passed to VideoWriter.create_video_writer in place of one.
+    """
+
+    def __init__(self, cfg: ControllerConfig, scene: Scene, viewport: Tuple[int, int, int, int]) -> None:
+        self.cfg: ControllerConfig = cfg
+        self.scene: Scene = scene
+
+        # (x, y, width, height) in pixels from the top left of the image read back from the framebuffer
+        self.viewport: Tuple[int, int, int, int] = viewport
+        self.video_width: int = viewport[2]
+        self.video_height: int = viewport[3]
+
+        self.frames_left_to_render: int
+        self.delta_t: float
+        self.frames_left_to_render, self.delta_t = VideoRenderController._get_frame_count_and_delta_t(scene)
+        self.frames_left_to_write: int = self.frames_left_to_render  # frames not yet sent to the video writer
+
+        self.video_writer: VideoWriter = VideoWriter.create_video_writer(self)  # type: ignore
+        self.video_written: bool = False
+
+
+class AtlasRenderController(VideoRenderController):
+    """
+    Renders several scenes at once, each into its own tile of a single framebuffer, and writes each tile to its own video file.
+    Every frame clears the framebuffer once, draws each scene into its tile, and reads the whole framebuffer back with a single call,
+    so the per-frame cost of clearing, reading back, and waiting on the GPU is paid once for all scenes rather than once per scene.
+    Scenes may have different numbers of frames; a tile stops being drawn once its scene has no frames left,
+    and its video file is finished right away rather than after the longest scene.
+    """
+
+    MAX_COLUMNS: int = 4  # tiles are laid out in rows of up to this many
+
+    def __init__(self, cfgs: List[ControllerConfig], scenes: List[Scene], view: MesaView,
+                 on_video_written: Optional[Callable[[str], None]] = None) -> None:
+        """
+        cfgs[i] is the controller config of scenes[i]. view's framebuffer must be the size of the atlas returned by get_atlas_size.
+        If given, on_video_written is called with each scene's output video path as soon as that video file has been written.
+        """
+        Controller.__init__(self, cfgs[0], scenes[0])
+
+        self.on_video_written: Optional[Callable[[str], None]] = on_video_written
+
+        self.view: MesaView = view
+
+        self.video_width: int
+        self.video_height: int
+        self.video_width, self.video_height = self.view.get_framebuffer_size()
+
+        columns, rows = self._get_atlas_layout(len(scenes))
+        tile_width, tile_height = self.video_width // columns, self.video_height // rows
+        self.tiles: List[AtlasTile] = []
+        for idx, (cfg, scene) in enumerate(zip(cfgs, scenes)):
+            column, row = idx % columns, idx // columns
+            viewport = (column * tile_width, row * tile_height, tile_width, tile_height)
+            self.tiles.append(AtlasTile(cfg, scene, viewport))
+
+        self.frames_left_to_render: int = max(tile.frames_left_to_render for tile in self.tiles)
+        self.frames_rendered: int = 0
+
+        self._initialize_pixel_buffers()
+        self.tiles_in_flight: Deque[List[AtlasTile]] = deque()  # tiles drawn in each of the frames in pbo_ids_in_flight, oldest first
+
+        self.progress_bar = tqdm(total=self.frames_left_to_render)
+
+    @staticmethod
+    def _get_atlas_layout(tile_count: int) -> Tuple[int, int]:
+        """ Return (columns, rows) of an atlas holding tile_count tiles. """
+        columns = min(tile_count, AtlasRenderController.MAX_COLUMNS)
+        return columns, math.ceil(tile_count / columns)
+
+    @staticmethod
+    def get_atlas_size(tile_count: int, tile_width: int, tile_height: int) -> Tuple[int, int]:
+        """ Return (width, height) of the framebuffer needed to hold tile_count tiles of the given size. """
+        columns, rows = AtlasRenderController._get_atlas_layout(tile_count)
+        return columns * tile_width, rows * tile_height
+
+    def _get_active_tiles(self) -> List[AtlasTile]:
+        return [tile for tile in self.tiles if tile.frames_left_to_render > 0]
+
+    def _prep_for_run_loop(self) -> None:
+        self.run_loop_start_time = time.time()
+
+        for tile in self.tiles:
+            for child in tile.scene.get_children():
+                if isinstance(child, AnimatedDrawing):
+                    child.precompute_frames()
+        logging.info(f'Precomputed character vertices in {time.time()-self.run_loop_start_time} seconds.')
+
+    def _update(self) -> None:
+        for tile in self._get_active_tiles():
+            tile.scene.update_transforms()
+
+    def _render(self) -> None:
+        for tile in self._get_active_tiles():
+            self.view.render(tile.scene, viewport=tile.viewport)
+
+    def _tick(self) -> None:
+        for tile in self._get_active_tiles():
+            tile.scene.progress_time(tile.delta_t)
+
+    def _finish_run_loop_iteration(self) -> None:
+        active_tiles = self._get_active_tiles()
+        for tile in active_tiles:
+            tile.frames_left_to_render -= 1
+
+        # must be queued before the readback, which may send the oldest frame in flight to the video writers
+        self.tiles_in_flight.append(active_tiles)
+        super()._finish_run_loop_iteration()
+
+    def _process_pixels(self, pixels: npt.NDArray[np.uint8]) -> None:
+        """ Sends each tile drawn in the frame to its video writer, as a view into the mapped pixel buffer. Rows run top to bottom, as does each tile's viewport y. """
+        for tile in self.tiles_in_flight.popleft():
+            x, y, width, height = tile.viewport
+            tile.video_writer.process_frame(pixels[y:y + height, x:x + width])
+            tile.frames_left_to_write -= 1
+            if tile.frames_left_to_write == 0:
+                self._finish_video(tile)
+
+    def _finish_video(self, tile: AtlasTile) -> None:
+        """ Called once all of a tile's frames have been sent to its video writer. Writes out its video file while the other tiles keep rendering. """
+        tile.video_writer.cleanup()
+        tile.video_written = True
+        if self.on_video_written is not None:
+            assert isinstance(tile.cfg.output_video_path, str)  # for static analysis
+            self.on_video_written(tile.cfg.output_video_path)
+
+    def _cleanup_after_run_loop(self) -> None:
+        while self.pbo_ids_in_flight:
+            self._write_frame_from_pbo(self.pbo_ids_in_flight.popleft())
+
+        logging.info(f'Rendered {self.frames_rendered} frames of {len(self.tiles)} scenes in {time.time()-self.run_loop_start_time} seconds.')
+
+        self._release_opengl_resources()
+
+        # most videos were written as their scenes finished. Only scenes without any frames are left
+        _time = time.time()
+        for tile in self.tiles:
+            if not tile.video_written:
+                self._finish_video(tile)
+        logging.info(f'Wrote remaining videos to file in in {time.time()-_time} seconds.')
+
+    def _release_scene_opengl_resources(self) -> None:
+        for tile in self.tiles:
+            tile.scene.release_opengl_resources()
+
+    def _cleanup_video_writers(self) -> None:
+        for tile in self.tiles:
+            tile.video_writer.cleanup()
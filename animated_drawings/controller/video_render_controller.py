@@ -6,8 +6,12 @@
 
 from __future__ import annotations
 import time
+import ctypes
 import logging
-from typing import List
+import queue
+import threading
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Tuple
+from collections import deque
 from pathlib import Path
 from abc import abstractmethod
 import numpy as np
@@ -28,6 +32,8 @@ NoneType = type(None)  # for type checking below
 class VideoRenderController(Controller):
     """ Video Render Controller is used to non-interactively generate a video file """
 
+    PBO_COUNT = 2  # pixel buffer objects frames are read back into. Up to PBO_COUNT-1 frames render before their pixels are copied out
+
     def __init__(self, cfg: ControllerConfig, scene: Scene, view: View) -> None:
         super().__init__(cfg, scene)
 
@@ -48,20 +54,55 @@ class VideoRenderController(Controller):
 
         self.video_writer: VideoWriter = VideoWriter.create_video_writer(self)
 
-        self.frame_data = np.empty([self.video_height, self.video_width, 4], dtype='uint8')  # 4 for RGBA
+        self._initialize_pixel_buffers()
 
         self.progress_bar = tqdm(total=self.frames_left_to_render)
 
+    def run(self) -> None:
+        try:
+            super().run()
+        except BaseException:
+            # the run loop stopped before _cleanup_after_run_loop. Stop the video writers anyway, so encoder threads don't wait for frames forever,
+            # and release this render's OpenGL objects, so a kept context doesn't carry them into the next render
+            try:
+                self._cleanup_video_writers()
+            except Exception:
+                logging.exception('Error cleaning up video writers after a failed render')
+            try:
+                self._release_opengl_resources()
+            except Exception:
+                logging.exception('Error releasing OpenGL resources after a failed render')
+            raise
+
+    def _initialize_pixel_buffers(self) -> None:
+        """
+        Frames are read back into a ring of pixel buffer objects. Where the driver can, reading into one returns without waiting
+        for the pixels, and frame N is only copied out of its buffer after frame N+1 has been rendered.
+        """
+        self.frame_nbytes: int = self.video_height * self.video_width * 4  # 4 for BGRA
+        self.pbo_ids: List[int] = [int(pbo_id) for pbo_id in np.atleast_1d(GL.glGenBuffers(self.PBO_COUNT))]
+        for pbo_id in self.pbo_ids:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo_id)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.frame_nbytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.pbo_ids_in_flight: Deque[int] = deque()  # buffers holding frames not yet sent to the video writer, oldest first
+        self.opengl_resources_released: bool = False
+
     def _set_frames_left_to_render_and_delta_t(self) -> None:
+        """ Uses the animated drawings within the scene to determine number of frames and frame time for output video. """
+        self.frames_left_to_render, self.delta_t = self._get_frame_count_and_delta_t(self.scene)
+
+    @staticmethod
+    def _get_frame_count_and_delta_t(scene: Scene) -> Tuple[int, float]:
         """
         Based upon the animated drawings within the scene, computes maximum number of frames in a BVH.
         Checks that all frame times within BVHs are equal, logs a warning if not.
-        Uses results to determine number of frames and frame time for output video.
+        Returns the number of frames and the frame time.
         """
 
         max_frames = 0
         frame_time: List[float] = []
-        for child in self.scene.get_children():
+        for child in scene.get_children():
             if not isinstance(child, AnimatedDrawing):
                 continue
             max_frames = max(max_frames, child.retargeter.bvh.frame_max_num)
@@ -71,12 +112,17 @@ class VideoRenderController(Controller):
             msg = f'frame time of BVH files don\'t match. Using first value: {frame_time[0]}'
             logging.warning(msg)
 
-        self.frames_left_to_render = max_frames
-        self.delta_t = frame_time[0]
+        return max_frames, frame_time[0]
 
     def _prep_for_run_loop(self) -> None:
         self.run_loop_start_time = time.time()
 
+        # every frame will be rendered, so deform the characters for all frames at once, before rendering starts
+        for child in self.scene.get_children():
+            if isinstance(child, AnimatedDrawing):
+                child.precompute_frames()
+        logging.info(f'Precomputed character vertices in {time.time()-self.run_loop_start_time} seconds.')
+
     def _is_run_over(self) -> bool:
         return self.frames_left_to_render == 0
 
@@ -96,24 +142,72 @@ class VideoRenderController(Controller):
         """ ignore all user input when rendering video file """
 
     def _finish_run_loop_iteration(self) -> None:
-        # get pixel values from the frame buffer, send them to the video writer
+        # start reading pixel values from the frame buffer into the next free pixel buffer
+        pbo_id = self.pbo_ids[self.frames_rendered % self.PBO_COUNT]
         GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
-        GL.glReadPixels(0, 0, self.video_width, self.video_height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, self.frame_data)
-        self.video_writer.process_frame(self.frame_data[::-1, :, :].copy())
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo_id)
+        GL.glReadPixels(0, 0, self.video_width, self.video_height, GL.GL_BGRA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self.pbo_ids_in_flight.append(pbo_id)
+
+        # once every buffer is in use, send the oldest frame to the video writer to free its buffer up
+        if len(self.pbo_ids_in_flight) == self.PBO_COUNT:
+            self._write_frame_from_pbo(self.pbo_ids_in_flight.popleft())
 
         # update our counts and progress_bar
         self.frames_left_to_render -= 1
         self.frames_rendered += 1
         self.progress_bar.update(1)
 
+    def _write_frame_from_pbo(self, pbo_id: int) -> None:
+        """ Copies a frame out of the pixel buffer and sends it to the video writer. """
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo_id)
+        ptr = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.frame_nbytes, GL.GL_MAP_READ_BIT)
+        pixels = np.ctypeslib.as_array((ctypes.c_ubyte * self.frame_nbytes).from_address(ptr))
+        self._process_pixels(pixels.reshape([self.video_height, self.video_width, 4]))
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+    def _process_pixels(self, pixels: npt.NDArray[np.uint8]) -> None:
+        """
+        Sends the frame to the video writer. pixels is the mapped pixel buffer. The view draws its rows top to bottom, so no flip is needed,
+        and it is passed without copying: the writer copies out what it keeps before process_frame returns.
+        """
+        self.video_writer.process_frame(pixels)
+
     def _cleanup_after_run_loop(self) -> None:
+        # send the frames still in the pixel buffers to the video writer
+        while self.pbo_ids_in_flight:
+            self._write_frame_from_pbo(self.pbo_ids_in_flight.popleft())
+
         logging.info(f'Rendered {self.frames_rendered} frames in {time.time()-self.run_loop_start_time} seconds.')
-        self.view.cleanup()
+
+        self._release_opengl_resources()
 
         _time = time.time()
-        self.video_writer.cleanup()
+        self._cleanup_video_writers()
         logging.info(f'Wrote video to file in in {time.time()-_time} seconds.')
 
+    def _release_opengl_resources(self) -> None:
+        """
+        Deletes the pixel buffers and the scene's buffers and textures, then cleans up the view.
+        The view may keep its OpenGL context alive for the next render, so nothing of this render should be left in it.
+        Called once the run loop is finished, or after it fails. Only releases them the first time it is called.
+        """
+        if self.opengl_resources_released:
+            return
+        self.opengl_resources_released = True
+
+        GL.glDeleteBuffers(self.PBO_COUNT, self.pbo_ids)
+        self._release_scene_opengl_resources()
+        self.view.cleanup()
+
+    def _release_scene_opengl_resources(self) -> None:
+        self.scene.release_opengl_resources()
+
+    def _cleanup_video_writers(self) -> None:
+        self.video_writer.cleanup()
+
 
 class VideoWriter():
     """ Wrapper to abstract the different backends necessary for writing different video filetypes """
@@ -123,7 +217,10 @@ class VideoWriter():
 
     @abstractmethod
     def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
-        """ Subclass must specify how to handle each frame of data received. """
+        """
+        Subclass must specify how to handle each frame of data received. frame is BGRA, with rows top to bottom.
+        It may be a view into memory that is reused once process_frame returns, so anything kept must be copied out of it.
+        """
         pass
 
     @abstractmethod
@@ -143,7 +240,9 @@ class VideoWriter():
         logging.info(msg)
         print(msg)
 
-        if output_p.suffix == '.gif':
+        if output_p.suffix == '.gif' and controller.cfg.output_gif_optimize:
+            return OptimizedGIFWriter(controller)
+        elif output_p.suffix == '.gif':
             return GIFWriter(controller)
         elif output_p.suffix == '.mp4':
             return MP4Writer(controller)
@@ -154,7 +253,13 @@ class VideoWriter():
 
 
 class GIFWriter(VideoWriter):
-    """ Video writer for creating transparent, animated GIFs with Pillow """
+    """
+    Video writer for creating transparent, animated GIFs with Pillow.
+    Frames are quantized and encoded on a background thread as they arrive, and written straight to the output file.
+    Encoding overlaps rendering, and memory use doesn't grow with the number of frames.
+    """
+
+    QUEUE_SIZE = 8  # max number of rendered frames waiting to be encoded. process_frame() blocks when it's reached
 
     def __init__(self, controller: VideoRenderController) -> None:
         assert isinstance(controller.cfg.output_video_path, str)  # for static analysis
@@ -166,19 +271,240 @@ class GIFWriter(VideoWriter):
             logging.warn(msg)
             self.duration = 20
 
-        self.frames: List[npt.NDArray[np.uint8]] = []
+        self.output_p.parent.mkdir(exist_ok=True, parents=True)
+        logging.info(f'VideoWriter will write to {self.output_p.resolve()}')
+
+        self._frame_queue: queue.Queue[Optional[npt.NDArray[np.uint8]]] = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._encode_error: Optional[Exception] = None
+        self._encode_thread: Optional[threading.Thread] = None  # started by the first frame, so a writer that never gets one holds no thread or file
 
     def process_frame(self, frame: npt.NDArray[np.uint8]) -> None:
-        """ Reorder channels and save frames as they arrive"""
-        self.frames.append(cv2.cvtColor(frame, cv2.COLOR_BGRA2RGBA).astype(np.uint8))
+        """ Send frames to the encoder thread as they arrive. Reordering the channels to RGBA is also what copies the frame out of the caller's memory """
+        self._check_encode_error()
+        if self._encode_thread is None:
+            self._encode_thread = threading.Thread(target=self._encode_frames, name='gif-encoder', daemon=True)
+            self._encode_thread.start()
+        self._frame_queue.put(cv2.cvtColor(frame, cv2.COLOR_BGRA2RGBA))
 
     def cleanup(self) -> None:
-        """ Write all frames to output path specified."""
+        """ Wait for the encoder thread to finish writing the remaining frames to output path specified. Safe to call more than once."""
+        if self._encode_thread is None:
+            return
+        self._frame_queue.put(None)
+        self._encode_thread.join()
+        self._encode_thread = None
+        self._check_encode_error()
+
+    def _check_encode_error(self) -> None:
+        if self._encode_error is not None:
+            msg = f'Error encoding .gif {self.output_p}: {self._encode_error}'
+            logging.critical(msg)
+            raise RuntimeError(msg) from self._encode_error
+
+    def _encode_frames(self) -> None:
+        """
+        Runs on the encoder thread. Each frame is held until the next one arrives,
+        so that a frame identical to the previous one can be dropped and its duration added to the previous one instead.
+        """
+        from PIL import GifImagePlugin
+
+        prev_frame: Optional[npt.NDArray[np.uint8]] = None
+        pending: Optional[Tuple[Any, Tuple[int, int], Dict[str, Any]]] = None  # encoded frame waiting to be written: image, offset, encoder info
+        frame_count = 0
+
+        with open(self.output_p, 'wb') as f:
+            while True:
+                frame = self._frame_queue.get()
+                if frame is None:
+                    break
+                if self._encode_error is not None:
+                    continue  # keep draining the queue so the render loop never blocks on it
+
+                try:
+                    if prev_frame is not None and np.array_equal(frame, prev_frame):
+                        pending[2]['duration'] += self.duration  # type: ignore
+                        continue
+
+                    if pending is not None:
+                        self._write_frame(f, *pending)
+
+                    im, transparency = self._quantize(frame)
+                    info: Dict[str, Any] = {'duration': self.duration, 'disposal': 2}
+                    if transparency is not None:
+                        info['transparency'] = transparency
+
+                    if frame_count == 0:
+                        # first frame is written whole, and its palette becomes the global color table
+                        header, _ = GifImagePlugin.getheader(im, info={**info, 'loop': 0})
+                        for chunk in header:
+                            f.write(chunk)
+                        pending = (im, (0, 0), info)
+                    else:
+                        # later frames only cover their non-transparent pixels, and carry their own color table
+                        bbox = self._get_bbox(im, transparency)
+                        pending = (im.crop(bbox), bbox[:2], {**info, 'include_color_table': True})
+
+                    prev_frame = frame
+                    frame_count += 1
+                except Exception as e:  # surfaced on the render thread by process_frame() or cleanup()
+                    self._encode_error = e
+
+            if self._encode_error is None and pending is not None:
+                self._write_frame(f, *pending)
+            f.write(b';')  # gif trailer
+
+    @staticmethod
+    def _write_frame(f: BinaryIO, im: Any, offset: Tuple[int, int], info: Dict[str, Any]) -> None:
+        from PIL import GifImagePlugin
+        for chunk in GifImagePlugin.getdata(im, offset, **info):
+            f.write(chunk)
+
+    @staticmethod
+    def _quantize(rgba: npt.NDArray[np.uint8]) -> Tuple[Any, Optional[int]]:
+        """ Quantize an RGBA frame to 256 colors. Returns the palette image and index of its transparent color, if any """
         from PIL import Image
-        self.output_p.parent.mkdir(exist_ok=True, parents=True)
-        logging.info(f'VideoWriter will write to {self.output_p.resolve()}')
-        ims = [Image.fromarray(a_frame) for a_frame in self.frames]
-        ims[0].save(self.output_p, save_all=True, append_images=ims[1:], duration=self.duration, disposal=2, loop=0)
+        im = Image.fromarray(rgba).convert('P', palette=Image.Palette.ADAPTIVE)
+
+        transparency: Optional[int] = None
+        if im.palette.mode == 'RGBA':
+            transparency = next((idx for rgba, idx in im.palette.colors.items() if rgba[3] == 0), None)
+
+        # gif color tables are RGB; transparency is handled by index instead
+        im.putpalette(im.getpalette('RGB'), 'RGB')
+        return im, transparency
+
+    @staticmethod
+    def _get_bbox(im: Any, transparency: Optional[int]) -> Tuple[int, int, int, int]:
+        """ Returns bounding box, (left, upper, right, lower), of the pixels that aren't transparent. """
+        if transparency is None:
+            return (0, 0, im.width, im.height)
+        return _get_mask_bbox(np.asarray(im) != transparency)
+
+
+class OptimizedGIFWriter(GIFWriter):
+    """
+    Streaming GIF writer that trades a little encode work for much smaller files. Used when OUTPUT_GIF_OPTIMIZE is set.
+        - One global palette, computed from the first frame's opaque pixels, is shared by all frames. Frames carry no color tables of their own.
+        - Each frame only covers the bounding box of pixels that differ from what's already on the canvas. Within it, pixels that don't differ
+          are written as transparent, so the canvas shows through.
+        - A frame is left on the canvas (disposal 1) if the next frame can be drawn over it. If the next frame turns some of its opaque pixels
+          transparent, which drawing over it can't do, the frame's box is grown to cover those pixels and it is cleared instead (disposal 2).
+    Pixels with an alpha of 0 are transparent, all others are opaque.
+    """
+
+    PALETTE_SIZE = 32  # colors in the global palette, at most 255. Fewer colors compress better
+    TRANSPARENT_IDX = 255  # palette index reserved for transparent pixels
+
+    def _encode_frames(self) -> None:
+        """
+        Runs on the encoder thread. As with GIFWriter, each frame is held until the next one arrives.
+        Knowing the next frame determines the held frame's disposal method, or lets it absorb the next frame if they're identical.
+        """
+        T = self.TRANSPARENT_IDX
+        palette_im: Any = None  # quantization target, built from the first frame
+        pending: Optional[Dict[str, Any]] = None  # frame waiting to be written: palette indices, canvas it's drawn onto, bbox, duration
+
+        with open(self.output_p, 'wb') as f:
+            while True:
+                rgba = self._frame_queue.get()
+                if rgba is None:
+                    break
+                if self._encode_error is not None:
+                    continue  # keep draining the queue so the render loop never blocks on it
+
+                try:
+                    if palette_im is None:
+                        palette_im = self._compute_palette(rgba)
+                        self._write_header(f, rgba.shape[1], rgba.shape[0], palette_im)
+
+                    idxs = self._quantize_to_palette(rgba, palette_im)
+
+                    # identical to the previous frame: show that one for longer
+                    if pending is not None and np.array_equal(idxs, pending['idxs']):
+                        pending['duration'] += self.duration
+                        continue
+
+                    # write the pending frame, and track what the canvas will look like once it's been disposed of
+                    canvas: npt.NDArray[np.uint8]
+                    if pending is None:
+                        canvas = np.full_like(idxs, T)
+                    else:
+                        vanishing = (idxs == T) & (pending['idxs'] != T)
+                        if not vanishing.any():
+                            self._write_delta_frame(f, pending, pending['bbox'], disposal=1)
+                            canvas = pending['idxs']
+                        else:
+                            left, upper, right, lower = bbox = _union_bbox(pending['bbox'], _get_mask_bbox(vanishing))
+                            self._write_delta_frame(f, pending, bbox, disposal=2)
+                            canvas = pending['idxs'].copy()
+                            canvas[upper:lower, left:right] = T
+
+                    pending = {'idxs': idxs, 'canvas': canvas, 'bbox': _get_mask_bbox(idxs != canvas), 'duration': self.duration}
+                except Exception as e:  # surfaced on the render thread by process_frame() or cleanup()
+                    self._encode_error = e
+
+            # clear the last frame entirely, so the canvas is empty when the animation loops
+            if self._encode_error is None and pending is not None:
+                bbox = _union_bbox(pending['bbox'], _get_mask_bbox(pending['idxs'] != T))
+                self._write_delta_frame(f, pending, bbox, disposal=2)
+            f.write(b';')  # gif trailer
+
+    def _compute_palette(self, rgba: npt.NDArray[np.uint8]) -> Any:
+        """ Returns a palette image holding PALETTE_SIZE colors, quantized from the frame's opaque pixels. """
+        from PIL import Image
+        opaque_rgb = rgba[rgba[:, :, 3] != 0][:, :3]
+        if not len(opaque_rgb):
+            opaque_rgb = rgba[:, :, :3].reshape([-1, 3])
+        return Image.fromarray(opaque_rgb.reshape([-1, 1, 3])).quantize(colors=self.PALETTE_SIZE, method=Image.Quantize.FASTOCTREE)
+
+    def _write_header(self, f: BinaryIO, width: int, height: int, palette_im: Any) -> None:
+        """ Writes the gif header, with the global color table: the palette's colors, padded to 256 entries, the last of which is transparent. """
+        from PIL import Image, GifImagePlugin
+        colors: List[int] = palette_im.getpalette('RGB')
+        colors = colors + colors[-3:] * (self.TRANSPARENT_IDX - len(colors) // 3) + [0, 0, 0]
+
+        canvas = Image.new('P', (width, height), self.TRANSPARENT_IDX)
+        canvas.putpalette(colors, 'RGB')
+        header, _ = GifImagePlugin.getheader(canvas, info={'loop': 0, 'duration': self.duration, 'transparency': self.TRANSPARENT_IDX})
+        for chunk in header:
+            f.write(chunk)
+
+    def _quantize_to_palette(self, rgba: npt.NDArray[np.uint8], palette_im: Any) -> npt.NDArray[np.uint8]:
+        """ Returns the frame as an array of global palette indices, with TRANSPARENT_IDX wherever alpha is 0. """
+        from PIL import Image
+        # no dithering: the noise it adds compresses poorly, and differs between otherwise identical regions of consecutive frames
+        im = Image.fromarray(np.ascontiguousarray(rgba[:, :, :3])).quantize(palette=palette_im, dither=Image.Dither.NONE)
+        idxs = np.array(im, dtype=np.uint8)
+        idxs[rgba[:, :, 3] == 0] = self.TRANSPARENT_IDX
+        return idxs
+
+    def _write_delta_frame(self, f: BinaryIO, frame: Dict[str, Any], bbox: Tuple[int, int, int, int], disposal: int) -> None:
+        """ Writes the part of the frame within bbox, to be disposed of by the given method """
+        from PIL import Image
+        left, upper, right, lower = bbox
+        idxs = frame['idxs'][upper:lower, left:right]
+
+        # pixels already showing the right color are left transparent, so the canvas shows through. The long runs of them compress well
+        unchanged = idxs == frame['canvas'][upper:lower, left:right]
+        idxs = np.where(unchanged, np.uint8(self.TRANSPARENT_IDX), idxs)
+
+        im = Image.fromarray(np.ascontiguousarray(idxs), 'P')
+        info = {'duration': frame['duration'], 'disposal': disposal, 'transparency': self.TRANSPARENT_IDX}
+        self._write_frame(f, im, (left, upper), info)
+
+
+def _union_bbox(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+    """ Returns the smallest bounding box, (left, upper, right, lower), containing both a and b """
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _get_mask_bbox(mask: npt.NDArray[np.bool_]) -> Tuple[int, int, int, int]:
+    """ Returns bounding box, (left, upper, right, lower), of the True pixels of mask. If there are none, a 1x1 box at the origin. """
+    cols = np.nonzero(mask.any(axis=0))[0]
+    if not len(cols):
+        return (0, 0, 1, 1)  # nothing to draw. A frame must still be written to keep the timing
+    rows = np.nonzero(mask.any(axis=1))[0]
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
 
 
 class MP4Writer(VideoWriter):
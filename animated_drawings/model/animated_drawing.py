@@ -4,11 +4,9 @@
 
 import logging
 import ctypes
-import heapq
 import math
 import time
-from typing import Dict, List, Tuple, Optional, TypedDict, DefaultDict
-from collections import defaultdict
+from typing import Dict, List, Tuple, Optional, TypedDict
 from pathlib import Path
 
 import cv2
@@ -19,6 +17,8 @@ from shapely import geometry
 from OpenGL import GL
 
 from scipy.spatial import Delaunay
+import scipy.sparse as sp
+from scipy.sparse import csgraph
 from animated_drawings.model.transform import Transform
 from animated_drawings.model.time_manager import TimeManager
 from animated_drawings.model.retargeter import Retargeter
@@ -187,6 +187,13 @@ class AnimatedDrawingRig(Transform):
             if isinstance(c, AnimatedDrawingsJoint):
                 self._set_global_orientations(c, bvh_orientations)
 
+    def _release_opengl_resources(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(1, [self.vbo])
+        self._is_opengl_initialized = False
+
     def _draw(self, **kwargs):
         if not kwargs['viewer_cfg'].draw_ad_rig:
             return
@@ -208,6 +215,248 @@ class AnimatedDrawingRig(Transform):
         GL.glEnable(GL.GL_DEPTH_TEST)
 
 
+class AnimatedDrawingCharacter():
+    """
+    The parts of an animated drawing that depend only upon the character, not upon the motion driving it:
+    the padded mask and texture, the mesh, the triangle->joint assignment, and the ARAP solver set up with the rig's rest pose.
+    Preparing these is the most expensive part of creating an AnimatedDrawing.
+    Create one and pass it to multiple AnimatedDrawings to render several motions of the same character without repeating that work.
+    """
+
+    def __init__(self, char_cfg: CharacterConfig):
+        self.char_cfg: CharacterConfig = char_cfg
+
+        self.img_dim: int = self.char_cfg.img_dim
+
+        # load mask and pad to square
+        self.mask: npt.NDArray[np.uint8] = self._load_mask()
+
+        # load texture and pad to square
+        self.txtr: npt.NDArray[np.uint8] = self._load_txtr()
+
+        # generate the mesh
+        self.mesh: AnimatedDrawingMesh
+        self._generate_mesh()
+
+        self.joint_to_tri_v_idx:  Dict[str, npt.NDArray[np.int32]]
+        self._initialize_joint_to_triangles_dict()
+
+        # initialize arap solver with original joint positions
+        self.arap = ARAP(AnimatedDrawingRig(self.char_cfg).get_joints_2D_positions(), self.mesh['triangles'], self.mesh['vertices'])
+
+    def _initialize_joint_to_triangles_dict(self) -> None:
+        """
+        Finds the closest joint bone (line segment between joint and parent) to each triangle centroid,
+        measuring distance as the length of the shortest 8-connected path through the character mask.
+        """
+        # joint locations, with y flipped to match image coordinates
+        joint_name_to_idx: List[str] = [joint['name'] for joint in self.char_cfg.skeleton]
+        joint_locs: Dict[str, List[float]] = {joint['name']: [joint['loc'][0], 1 - joint['loc'][1]] for joint in self.char_cfg.skeleton}
+
+        # seed generation: points along each bone, from the joint towards its parent
+        seed_joint_idxs: List[int] = []
+        seeds_xy: List[npt.NDArray[np.int32]] = []
+        for joint in self.char_cfg.skeleton:
+            if joint['parent'] is None:  # skip root joint
+                continue
+            joint_seeds_xy = (self.img_dim * np.linspace(joint_locs[joint['name']], joint_locs[joint['parent']], num=20, endpoint=False)).round()
+            seeds_xy.append(joint_seeds_xy.astype(np.int32))
+            seed_joint_idxs.extend([joint_name_to_idx.index(joint['name'])] * len(joint_seeds_xy))
+
+        start_time: float = time.time()
+        logging.info('Starting joint -> mask pixel search')
+        shortest_distance, closest_joint_idx = self._closest_bones_to_mask_pixels(np.concatenate(seeds_xy), np.array(seed_joint_idxs), len(joint_name_to_idx))
+        logging.info(f'Finished joint -> mask pixel search in {time.time() - start_time} seconds')
+
+        # look up the closest joint and distance at each triangle centroid
+        tris: npt.NDArray[np.int32] = np.array(self.mesh['triangles'])
+        centroids_xy = (self.mesh['vertices'][tris].mean(axis=1) * self.img_dim).round().astype(np.int32)
+        tri_closest_joint_idx = closest_joint_idx[centroids_xy[:, 0], centroids_xy[:, 1]]
+        tri_dist_to_bone = shortest_distance[centroids_xy[:, 0], centroids_xy[:, 1]]
+
+        # create map between joint name and triangles it is closest to, in the order joints are first encountered.
+        # triangles not reached from any bone (idx -1) go to the last joint.
+        joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
+        tri_closest_joint_idx[tri_closest_joint_idx == -1] = len(joint_name_to_idx) - 1
+        _, first_tri_idxs = np.unique(tri_closest_joint_idx, return_index=True)
+        for joint_idx in tri_closest_joint_idx[np.sort(first_tri_idxs)]:
+            tri_idxs = np.nonzero(tri_closest_joint_idx == joint_idx)[0]
+
+            # sort by distance, descending
+            tri_idxs = tri_idxs[np.argsort(-tri_dist_to_bone[tri_idxs], kind='stable')]
+
+            joint_to_tri_v_idx[joint_name_to_idx[joint_idx]] = tris[tri_idxs].flatten()
+
+        self.joint_to_tri_v_idx = joint_to_tri_v_idx
+
+    def _closest_bones_to_mask_pixels(self,
+                                      seeds_xy: npt.NDArray[np.int32],
+                                      seed_joint_idxs: npt.NDArray[np.int64],
+                                      joint_num: int
+                                      ) -> Tuple[npt.NDArray[np.int32], npt.NDArray[np.int8]]:
+        """
+        Labels each mask pixel with the joint whose seeds are closest to it, following 8-connected paths through the mask
+        (1 per horizontal/vertical step and 1.414 per diagonal step). Seeds start paths into the mask but aren't part of it.
+        Seeds may lie off the image, such as those of a joint placed off canvas. They only reach the mask pixels next to them, if any.
+
+        seeds_xy: ndarray [S, 2] pixel locations of the seeds
+        seed_joint_idxs: ndarray [S,] idx of the joint each seed belongs to
+        joint_num: number of joints
+
+        Returns the truncated distance from each pixel to its closest bone (1 << 12 if unreachable)
+        and the idx of that bone's joint (-1 if unreachable), each as an [img_dim, img_dim] ndarray.
+        """
+        # pad by one pixel, so seeds just off the image, which can still step onto its edge, have a node
+        dim = self.img_dim + 2
+        in_mask = np.zeros([dim, dim], dtype=bool)
+        in_mask[1:-1, 1:-1] = self.mask.astype(bool)
+        seeds_xy = seeds_xy + 1
+
+        # seeds further off the image have no neighbors within it, and reach nothing
+        on_padded_image = ((0 <= seeds_xy) & (seeds_xy < dim)).all(axis=1)
+        seeds_xy, seed_joint_idxs = seeds_xy[on_padded_image], seed_joint_idxs[on_padded_image]
+
+        # one graph node per padded pixel, followed by one node per seed. Edges lead from a node into neighboring mask pixels.
+        pixel_ids = np.arange(dim * dim).reshape([dim, dim])
+        seed_ids = dim * dim + np.arange(len(seeds_xy))
+        rows: List[npt.NDArray[np.int64]] = []
+        cols: List[npt.NDArray[np.int64]] = []
+        weights: List[npt.NDArray[np.float64]] = []
+        for dx, dy, weight in [(-1, -1, 1.414), (0, -1, 1.0), (1, -1, 1.414), (-1, 0, 1.0), (1, 0, 1.0), (-1, 1, 1.414), (0, 1, 1.0), (1, 1, 1.414)]:
+            # mask pixel -> neighboring mask pixel
+            src = in_mask[max(0, -dx):dim - max(0, dx), max(0, -dy):dim - max(0, dy)]
+            dst = in_mask[max(0, dx):dim - max(0, -dx), max(0, dy):dim - max(0, -dy)]
+            valid = src & dst
+            rows.append(pixel_ids[max(0, -dx):dim - max(0, dx), max(0, -dy):dim - max(0, dy)][valid])
+            cols.append(pixel_ids[max(0, dx):dim - max(0, -dx), max(0, dy):dim - max(0, -dy)][valid])
+            weights.append(np.full(int(valid.sum()), weight))
+
+            # seed -> neighboring mask pixel
+            n_x, n_y = seeds_xy[:, 0] + dx, seeds_xy[:, 1] + dy
+            n_valid = (0 <= n_x) & (n_x < dim) & (0 <= n_y) & (n_y < dim)
+            n_valid[n_valid] = in_mask[n_x[n_valid], n_y[n_valid]]
+            rows.append(seed_ids[n_valid])
+            cols.append(pixel_ids[n_x[n_valid], n_y[n_valid]])
+            weights.append(np.full(int(n_valid.sum()), weight))
+
+        node_num = dim * dim + len(seeds_xy)
+        graph = sp.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(node_num, node_num))
+
+        # distance from every pixel to the closest seed of each joint. Ties go to the lower joint idx
+        shortest_distance_f = np.full(dim * dim, np.inf)
+        closest_joint_idx = np.full(dim * dim, -1, dtype=np.int8)
+        for joint_idx in range(joint_num):
+            joint_seed_ids = seed_ids[seed_joint_idxs == joint_idx]
+            if not len(joint_seed_ids):
+                continue
+            dist = csgraph.dijkstra(graph, indices=joint_seed_ids, min_only=True)[:dim * dim]
+            closer = dist < shortest_distance_f
+            shortest_distance_f[closer] = dist[closer]
+            closest_joint_idx[closer] = joint_idx
+
+        shortest_distance = np.full(dim * dim, 1 << 12, dtype=np.int32)
+        reached = np.isfinite(shortest_distance_f)
+        shortest_distance[reached] = shortest_distance_f[reached]
+
+        return shortest_distance.reshape([dim, dim])[1:-1, 1:-1], closest_joint_idx.reshape([dim, dim])[1:-1, 1:-1]
+
+    def _load_mask(self) -> npt.NDArray[np.uint8]:
+        """ Load and perform preprocessing upon the mask """
+        mask_p: Path = self.char_cfg.mask_p
+        try:
+            _mask: npt.NDArray[np.uint8] = cv2.imread(str(mask_p), cv2.IMREAD_GRAYSCALE).astype(np.uint8)
+            if _mask.shape[0] != self.char_cfg.img_height:
+                raise AssertionError('height in character config and mask height do not match')
+            if _mask.shape[1] != self.char_cfg.img_width:
+                raise AssertionError('width in character config and mask height do not match')
+        except Exception as e:
+            msg = f'Error loading mask {mask_p}: {str(e)}'
+            logging.critical(msg)
+            assert False, msg
+
+        _mask = np.rot90(_mask, 3, )  # rotate to upright
+
+        # pad to square
+        mask = np.zeros([self.img_dim, self.img_dim], _mask.dtype)
+        mask[0:_mask.shape[0], 0:_mask.shape[1]] = _mask
+
+        return mask
+
+    def _load_txtr(self) -> npt.NDArray[np.uint8]:
+        """ Load and perform preprocessing upon the drawing image """
+        txtr_p: Path = self.char_cfg.txtr_p
+        try:
+            _txtr: npt.NDArray[np.uint8] = cv2.imread(str(txtr_p), cv2.IMREAD_IGNORE_ORIENTATION | cv2.IMREAD_UNCHANGED).astype(np.uint8)
+            _txtr = cv2.cvtColor(_txtr, cv2.COLOR_BGRA2RGBA).astype(np.uint8)
+            if _txtr.shape[-1] != 4:
+                raise AssertionError('texture must be RGBA')
+            if _txtr.shape[0] != self.char_cfg.img_height:
+                raise AssertionError('height in character config and txtr height do not match')
+            if _txtr.shape[1] != self.char_cfg.img_width:
+                raise AssertionError('width in character config and txtr height do not match')
+        except Exception as e:
+            msg = f'Error loading texture {txtr_p}: {str(e)}'
+            logging.critical(msg)
+            assert False, msg
+
+        _txtr = np.rot90(_txtr, 3, )  # rotate to upright
+
+        # pad to square
+        txtr = np.zeros([self.img_dim, self.img_dim, _txtr.shape[-1]], _txtr.dtype)
+        txtr[0:_txtr.shape[0], 0:_txtr.shape[1], :] = _txtr
+
+        txtr[np.where(self.mask == 0)][:, 3] = 0  # make pixels outside mask transparent
+
+        return txtr
+
+    def _generate_mesh(self) -> None:
+        try:
+            contours: List[npt.NDArray[np.float64]] = measure.find_contours(self.mask, 128)
+        except Exception as e:
+            msg = f'Error finding contours for character mesh: {str(e)}'
+            logging.critical(msg)
+            assert False, msg
+
+        # if multiple distinct polygons are in the mask, use largest and discard the rest
+        if len(contours) > 1:
+            msg = f'{len(contours)} separate polygons found in mask. Using largest.'
+            logging.info(msg)
+            contours.sort(key=len, reverse=True)
+
+        outside_vertices: npt.NDArray[np.float64] = measure.approximate_polygon(contours[0], tolerance=0.25)
+        character_outline = geometry.Polygon(contours[0])
+
+        # add some internal vertices to ensure a good mesh is created
+        inside_vertices_xy: List[Tuple[np.float32, np.float32]] = []
+        _x = np.linspace(0, self.img_dim, 40)
+        _y = np.linspace(0, self.img_dim, 40)
+        xv, yv = np.meshgrid(_x, _y)
+        for x, y in zip(xv.flatten(), yv.flatten()):
+            if character_outline.contains(geometry.Point(x, y)):
+                inside_vertices_xy.append((x, y))
+        inside_vertices: npt.NDArray[np.float64] = np.array(inside_vertices_xy)
+
+        vertices: npt.NDArray[np.float32] = np.concatenate([outside_vertices, inside_vertices]).astype(np.float32)
+
+        """
+        Create a convex hull containing the character.
+        Then remove unnecessary edges by discarding triangles whose centroid
+        falls outside the character's outline.
+        """
+        convex_hull_triangles = Delaunay(vertices)
+        triangles: List[npt.NDArray[np.int32]] = []
+        for _triangle in convex_hull_triangles.simplices:
+            tri_vertices = np.array(
+                [vertices[_triangle[0]], vertices[_triangle[1]], vertices[_triangle[2]]])
+            tri_centroid = geometry.Point(np.mean(tri_vertices, 0))
+            if character_outline.contains(tri_centroid):
+                triangles.append(_triangle)
+
+        vertices /= self.img_dim  # scale vertices so they lie between 0-1
+
+        self.mesh = {'vertices': vertices, 'triangles': triangles}
+
+
 class AnimatedDrawing(Transform, TimeManager):
     """
     The drawn character to be animated.
@@ -219,9 +468,11 @@ class AnimatedDrawing(Transform, TimeManager):
 
     After initializing the object, the retarger must be initialized by calling initialize_retarger_bvh().
     Afterwars, only the update() method needs to be called.
+
+    The mask, texture, mesh and ARAP solver come from an AnimatedDrawingCharacter. If one isn't passed in, it is created from char_cfg.
     """
 
-    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig):
+    def __init__(self, char_cfg: CharacterConfig, retarget_cfg: RetargetConfig, motion_cfg: MotionConfig, character: Optional[AnimatedDrawingCharacter] = None):
         super().__init__()
 
         self.char_cfg: CharacterConfig = char_cfg
@@ -230,15 +481,14 @@ class AnimatedDrawing(Transform, TimeManager):
 
         self.img_dim: int = self.char_cfg.img_dim
 
-        # load mask and pad to square
-        self.mask: npt.NDArray[np.uint8] = self._load_mask()
-
-        # load texture and pad to square
-        self.txtr: npt.NDArray[np.uint8] = self._load_txtr()
+        # prepare the mask, texture, mesh and arap solver, unless they were already prepared for this character
+        if character is None:
+            character = AnimatedDrawingCharacter(self.char_cfg)
+        self.character: AnimatedDrawingCharacter = character
 
-        # generate the mesh
-        self.mesh: AnimatedDrawingMesh
-        self._generate_mesh()
+        self.mask: npt.NDArray[np.uint8] = self.character.mask
+        self.txtr: npt.NDArray[np.uint8] = self.character.txtr
+        self.mesh: AnimatedDrawingMesh = self.character.mesh
 
         self.rig = AnimatedDrawingRig(self.char_cfg)
         self.add_child(self.rig)
@@ -246,16 +496,17 @@ class AnimatedDrawing(Transform, TimeManager):
         # perform runtime checks for character pose, modify retarget config accordingly
         self._modify_retargeting_cfg_for_character()
 
-        self.joint_to_tri_v_idx:  Dict[str, npt.NDArray[np.int32]]
-        self._initialize_joint_to_triangles_dict()
+        self.joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = self.character.joint_to_tri_v_idx
 
         self.indices: npt.NDArray[np.int32] = np.stack(self.mesh['triangles']).flatten()  # order in which to render triangles
 
         self.retargeter: Retargeter
         self._initialize_retargeter_bvh(motion_cfg, retarget_cfg)
 
-        # initialize arap solver with original joint positions
-        self.arap = ARAP(self.rig.get_joints_2D_positions(), self.mesh['triangles'], self.mesh['vertices'])
+        self.arap: ARAP = self.character.arap
+
+        # mesh vertex xy positions for every frame of the motion, [F, V, 2]. Set by precompute_frames()
+        self._precomputed_vertices_xy: Optional[npt.NDArray[np.float32]] = None
 
         self.vertices: npt.NDArray[np.float32]
         self._initialize_vertices()
@@ -371,18 +622,22 @@ class AnimatedDrawing(Transform, TimeManager):
         """
 
         # get retargeted motion data
+        frame_idx: int = self.retargeter.get_frame_idx(self.get_time())
         frame_orientations: Dict[str, float]
         joint_depths: Dict[str, float]
         root_position: npt.NDArray[np.float32]
-        frame_orientations, joint_depths, root_position = self.retargeter.get_retargeted_frame_data(self.get_time())
+        frame_orientations, joint_depths, root_position = self.retargeter.get_retargeted_frame_data_by_idx(frame_idx)
 
         # update the rig's root position and reorient all of its joints
         self.rig.root_joint.set_position(root_position)
         self.rig.set_global_orientations(frame_orientations)
 
-        # using new joint positions, calculate new mesh vertex xy positions
-        control_points: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions() - root_position[:2]
-        self.vertices[:, :2] = self.arap.solve(control_points) + root_position[:2]
+        # using new joint positions, calculate new mesh vertex xy positions, unless they've already been computed for this frame
+        if self._precomputed_vertices_xy is not None:
+            self.vertices[:, :2] = self._precomputed_vertices_xy[frame_idx]
+        else:
+            control_points: npt.NDArray[np.float32] = self.rig.get_joints_2D_positions() - root_position[:2]
+            self.vertices[:, :2] = self.arap.solve(control_points) + root_position[:2]
 
         # use the z position of the rig's root joint for all mesh vertices
         self.vertices[:, 2] = self.rig.root_joint.get_world_position()[2]
@@ -392,6 +647,34 @@ class AnimatedDrawing(Transform, TimeManager):
         # using joint depths, determine the correct order in which to render the character
         self._set_draw_indices(joint_depths)
 
+    def precompute_frames(self, batch_size: int = 64) -> None:
+        """
+        Computes the mesh vertex xy positions for every frame of the motion up front.
+        The rig's joint positions are found for each frame, then ARAP is solved for batch_size frames at a time.
+        Afterwards, update() looks up the current frame's vertex positions instead of solving ARAP itself.
+        Useful when every frame is going to be rendered, such as when writing a video.
+        """
+        frame_num: int = self.retargeter.bvh.frame_max_num
+
+        control_points: List[npt.NDArray[np.float32]] = []
+        root_positions: List[npt.NDArray[np.float32]] = []
+        for frame_idx in range(frame_num):
+            frame_orientations, _, root_position = self.retargeter.get_retargeted_frame_data_by_idx(frame_idx)
+            self.rig.root_joint.set_position(root_position)
+            self.rig.set_global_orientations(frame_orientations)
+            control_points.append(self.rig.get_joints_2D_positions() - root_position[:2])
+            root_positions.append(root_position[:2])
+
+        vertices_xy = np.empty([frame_num, self.vertices.shape[0], 2], dtype=np.float32)
+        for start_idx in range(0, frame_num, batch_size):
+            end_idx = min(start_idx + batch_size, frame_num)
+            batch_root_positions = np.stack(root_positions[start_idx:end_idx])[:, None, :]
+            vertices_xy[start_idx:end_idx] = self.arap.solve_batch(np.stack(control_points[start_idx:end_idx])) + batch_root_positions
+        self._precomputed_vertices_xy = vertices_xy
+
+        # return the rig and mesh to the current frame
+        self.update()
+
     def _set_draw_indices(self, joint_depths: Dict[str, float]):
 
         # sort segmentation groups by decreasing depth_driver's distance to camera
@@ -409,174 +692,6 @@ class AnimatedDrawing(Transform, TimeManager):
                 indices.append(self.joint_to_tri_v_idx.get(joint_name, np.array([], dtype=np.int32)))
         self.indices = np.hstack(indices)
 
-    def _initialize_joint_to_triangles_dict(self) -> None:  # noqa: C901
-        """
-        Uses BFS to find and return the closest joint bone (line segment between joint and parent) to each triangle centroid.
-        """
-        shortest_distance = np.full(self.mask.shape, 1 << 12, dtype=np.int32)  # to nearest joint
-        closest_joint_idx = np.full(self.mask.shape, -1, dtype=np.int8)  # track joint idx nearest each point
-
-        # temp dictionary to help with seed generation
-        joints_d: Dict[str, CharacterConfig.JointDict] = {}
-        for joint in self.char_cfg.skeleton:
-            joints_d[joint['name']] = joint
-            joints_d[joint['name']]['loc'][1] = 1 - joints_d[joint['name']]['loc'][1]
-
-        # store joint names and later reference by element location
-        joint_name_to_idx: List[str] = [joint['name'] for joint in self.char_cfg.skeleton]
-
-        # seed generation
-        heap: List[Tuple[float, Tuple[int, Tuple[int, int]]]] = []  # [(dist, (joint_idx, (x, y))]
-        for _, joint in joints_d.items():
-            if joint['parent'] is None:  # skip root joint
-                continue
-            joint_idx = joint_name_to_idx.index(joint['name'])
-            dist_joint_xy: List[float] = joint['loc']
-            prox_joint_xy: List[float] = joints_d[joint['parent']]['loc']
-            seeds_xy = (self.img_dim * np.linspace(dist_joint_xy, prox_joint_xy, num=20, endpoint=False)).round()
-            heap.extend([(0, (joint_idx, tuple(seed_xy.astype(np.int32)))) for seed_xy in seeds_xy])
-
-        # BFS search
-        start_time: float = time.time()
-        logging.info('Starting joint -> mask pixel BFS')
-        while heap:
-            distance, (joint_idx, (x, y)) = heapq.heappop(heap)
-            neighbors = [(x-1, y-1), (x, y-1), (x+1, y-1), (x-1, y), (x+1, y), (x-1, y+1), (x, y+1), (x+1, y+1)]
-            n_dist = [1.414, 1.0, 1.414, 1.0, 1.0, 1.414, 1.0, 1.414]
-            for (n_x, n_y), n_dist in zip(neighbors, n_dist):
-                n_distance = distance + n_dist
-                if not 0 <= n_x < self.img_dim or not 0 <= n_y < self.img_dim:
-                    continue  # neighbor is outside image bounds- ignore
-
-                if not self.mask[n_x, n_y]:
-                    continue  # outside character mask
-
-                if shortest_distance[n_x, n_y] <= n_distance:
-                    continue  # a closer joint exists
-
-                closest_joint_idx[n_x, n_y] = joint_idx
-                shortest_distance[n_x, n_y] = n_distance
-                heapq.heappush(heap, (n_distance, (joint_idx, (n_x, n_y))))
-        logging.info(f'Finished joint -> mask pixel BFS in {time.time() - start_time} seconds')
-
-        # create map between joint name and triangle centroids it is closest to
-        joint_to_tri_v_idx_and_dist: DefaultDict[str, List[Tuple[npt.NDArray[np.int32], np.int32]]] = defaultdict(list)
-        for tri_v_idx in self.mesh['triangles']:
-            tri_verts = np.array([self.mesh['vertices'][v_idx] for v_idx in tri_v_idx])
-            centroid_x, centroid_y = list((tri_verts.mean(axis=0) * self.img_dim).round().astype(np.int32))
-            tri_centroid_closest_joint_idx: np.int8 = closest_joint_idx[centroid_x, centroid_y]
-            dist_from_tri_centroid_to_bone: np.int32 = shortest_distance[centroid_x, centroid_y]
-            joint_to_tri_v_idx_and_dist[joint_name_to_idx[tri_centroid_closest_joint_idx]].append((tri_v_idx, dist_from_tri_centroid_to_bone))
-
-        joint_to_tri_v_idx: Dict[str, npt.NDArray[np.int32]] = {}
-        for key, val in joint_to_tri_v_idx_and_dist.items():
-            # sort by distance, descending
-            val.sort(key=lambda x: float(x[1]), reverse=True)
-
-            # retain vertex indices, remove distance info
-            val = [v[0] for v in val]
-
-            # convert to np array and save in dictionary
-            joint_to_tri_v_idx[key] = np.array(val).flatten()  # type: ignore
-
-        self.joint_to_tri_v_idx = joint_to_tri_v_idx
-
-    def _load_mask(self) -> npt.NDArray[np.uint8]:
-        """ Load and perform preprocessing upon the mask """
-        mask_p: Path = self.char_cfg.mask_p
-        try:
-            _mask: npt.NDArray[np.uint8] = cv2.imread(str(mask_p), cv2.IMREAD_GRAYSCALE).astype(np.uint8)
-            if _mask.shape[0] != self.char_cfg.img_height:
-                raise AssertionError('height in character config and mask height do not match')
-            if _mask.shape[1] != self.char_cfg.img_width:
-                raise AssertionError('width in character config and mask height do not match')
-        except Exception as e:
-            msg = f'Error loading mask {mask_p}: {str(e)}'
-            logging.critical(msg)
-            assert False, msg
-
-        _mask = np.rot90(_mask, 3, )  # rotate to upright
-
-        # pad to square
-        mask = np.zeros([self.img_dim, self.img_dim], _mask.dtype)
-        mask[0:_mask.shape[0], 0:_mask.shape[1]] = _mask
-
-        return mask
-
-    def _load_txtr(self) -> npt.NDArray[np.uint8]:
-        """ Load and perform preprocessing upon the drawing image """
-        txtr_p: Path = self.char_cfg.txtr_p
-        try:
-            _txtr: npt.NDArray[np.uint8] = cv2.imread(str(txtr_p), cv2.IMREAD_IGNORE_ORIENTATION | cv2.IMREAD_UNCHANGED).astype(np.uint8)
-            _txtr = cv2.cvtColor(_txtr, cv2.COLOR_BGRA2RGBA).astype(np.uint8)
-            if _txtr.shape[-1] != 4:
-                raise AssertionError('texture must be RGBA')
-            if _txtr.shape[0] != self.char_cfg.img_height:
-                raise AssertionError('height in character config and txtr height do not match')
-            if _txtr.shape[1] != self.char_cfg.img_width:
-                raise AssertionError('width in character config and txtr height do not match')
-        except Exception as e:
-            msg = f'Error loading texture {txtr_p}: {str(e)}'
-            logging.critical(msg)
-            assert False, msg
-
-        _txtr = np.rot90(_txtr, 3, )  # rotate to upright
-
-        # pad to square
-        txtr = np.zeros([self.img_dim, self.img_dim, _txtr.shape[-1]], _txtr.dtype)
-        txtr[0:_txtr.shape[0], 0:_txtr.shape[1], :] = _txtr
-
-        txtr[np.where(self.mask == 0)][:, 3] = 0  # make pixels outside mask transparent
-
-        return txtr
-
-    def _generate_mesh(self) -> None:
-        try:
-            contours: List[npt.NDArray[np.float64]] = measure.find_contours(self.mask, 128)
-        except Exception as e:
-            msg = f'Error finding contours for character mesh: {str(e)}'
-            logging.critical(msg)
-            assert False, msg
-
-        # if multiple distinct polygons are in the mask, use largest and discard the rest
-        if len(contours) > 1:
-            msg = f'{len(contours)} separate polygons found in mask. Using largest.'
-            logging.info(msg)
-            contours.sort(key=len, reverse=True)
-
-        outside_vertices: npt.NDArray[np.float64] = measure.approximate_polygon(contours[0], tolerance=0.25)
-        character_outline = geometry.Polygon(contours[0])
-
-        # add some internal vertices to ensure a good mesh is created
-        inside_vertices_xy: List[Tuple[np.float32, np.float32]] = []
-        _x = np.linspace(0, self.img_dim, 40)
-        _y = np.linspace(0, self.img_dim, 40)
-        xv, yv = np.meshgrid(_x, _y)
-        for x, y in zip(xv.flatten(), yv.flatten()):
-            if character_outline.contains(geometry.Point(x, y)):
-                inside_vertices_xy.append((x, y))
-        inside_vertices: npt.NDArray[np.float64] = np.array(inside_vertices_xy)
-
-        vertices: npt.NDArray[np.float32] = np.concatenate([outside_vertices, inside_vertices]).astype(np.float32)
-
-        """
-        Create a convex hull containing the character.
-        Then remove unnecessary edges by discarding triangles whose centroid
-        falls outside the character's outline.
-        """
-        convex_hull_triangles = Delaunay(vertices)
-        triangles: List[npt.NDArray[np.int32]] = []
-        for _triangle in convex_hull_triangles.simplices:
-            tri_vertices = np.array(
-                [vertices[_triangle[0]], vertices[_triangle[1]], vertices[_triangle[2]]])
-            tri_centroid = geometry.Point(np.mean(tri_vertices, 0))
-            if character_outline.contains(tri_centroid):
-                triangles.append(_triangle)
-
-        vertices /= self.img_dim  # scale vertices so they lie between 0-1
-
-        self.mesh = {'vertices': vertices, 'triangles': triangles}
-
     def _initialize_vertices(self) -> None:
         """
         Prepare the ndarray that will be sent to rendering pipeline.
@@ -664,6 +779,14 @@ class AnimatedDrawing(Transform, TimeManager):
         GL.glBindVertexArray(0)
         self._vertex_buffer_dirty_bit = False
 
+    def _release_opengl_resources(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+        GL.glDeleteTextures(1, [self.txtr_id])
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(2, [self.vbo, self.ebo])
+        self._is_opengl_initialized = False
+
     def _draw(self, **kwargs):
 
         if not self._is_opengl_initialized:
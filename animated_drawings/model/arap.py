@@ -4,14 +4,14 @@
 
 import numpy as np
 import numpy.typing as npt
-from collections import defaultdict
 import logging
-from typing import List, Dict, Set, Tuple
+from typing import List, Tuple
 import scipy.sparse.linalg as spla
 import scipy.sparse as sp
 
 
 csr_matrix = sp._csr.csr_matrix  # for typing  # pyright: ignore[reportPrivateUsage]
+csc_matrix = sp._csc.csc_matrix  # for typing  # pyright: ignore[reportPrivateUsage]
 
 
 class ARAP():
@@ -38,7 +38,8 @@ class ARAP():
     between (e' in E') and (e in E). This way, rotation is essentially free, while scaling is not.
     """
 
-    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000):  # noqa: C901
+    def __init__(self, pins_xy: npt.NDArray[np.float32], triangles: List[npt.NDArray[np.int32]], vertices: npt.NDArray[np.float32], w: int = 1000,
+                 rotation_dtype: npt.DTypeLike = np.float64):
         """
         Sets up the matrices needed for later solves.
 
@@ -46,126 +47,135 @@ class ARAP():
         vertices: ndarray [N, 2] containing xy positions of N vertices. A vertex's order within array is it's vertex ID
         triangles: ndarray [N, 3] triplets of vertex IDs that make up triangles comprising the mesh
         w: int the weights to use for control points in solve. Default value should work.
+        rotation_dtype: precision of the per-edge rotation step between the two solves. np.float32 is faster, at the cost of a little accuracy.
+            The solves themselves are always done in float64.
         """
         self.w = w
+        self.rotation_dtype = rotation_dtype
 
         self.vertices = np.copy(vertices)
 
-        # build a deduplicated list of edge->vertex IDS...
-        self.e_v_idxs: List[Tuple[np.int32, np.int32]] = []
-        for v0, v1, v2 in triangles:
-            self.e_v_idxs.append(tuple(sorted((v0, v1))))
-            self.e_v_idxs.append(tuple(sorted((v1, v2))))
-            self.e_v_idxs.append(tuple(sorted((v2, v0))))
-        self.e_v_idxs = list(set(self.e_v_idxs))  # ...and deduplicate it
-
-        # build list of edge vectors
-        _edge_vectors: List[npt.NDArray[np.float32]] = []
-        for vi_idx, vj_idx in self.e_v_idxs:
-            vi = self.vertices[vi_idx]
-            vj = self.vertices[vj_idx]
-            _edge_vectors.append(vj - vi)
-        self.edge_vectors: npt.NDArray[np.float32] = np.array(_edge_vectors)
+        # build a deduplicated array of edge->vertex IDS, [E, 2], smaller vertex ID first
+        tris: npt.NDArray[np.int32] = np.asarray(triangles, dtype=np.int32).reshape([-1, 3])
+        all_edges = np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]], tris[:, [2, 0]]])
+        self.e_v_idxs: npt.NDArray[np.int32] = np.unique(np.sort(all_edges, axis=1), axis=0)
+
+        # build array of edge vectors
+        self.edge_vectors: npt.NDArray[np.float32] = self.vertices[self.e_v_idxs[:, 1]] - self.vertices[self.e_v_idxs[:, 0]]
+        self._edge_vectors_rot: npt.NDArray[np.floating] = self.edge_vectors.astype(self.rotation_dtype)
 
         # get barycentric coordinates of pins, and mask denoting which pins were initially outside the mesh
         pins_bc: List[Tuple[Tuple[np.int32, np.float32], Tuple[np.int32, np.float32], Tuple[np.int32, np.float32]]]
         self.pin_mask = npt.NDArray[np.bool8]
         pins_bc, self.pin_mask = self._xy_to_barycentric_coords(pins_xy, vertices, triangles)
 
-        v_vnbr_idxs: Dict[np.int32, Set[np.int32]] = defaultdict(set)  # build a dict mapping vertex ID -> neighbor vertex IDs
-        for v0, v1, v2 in triangles:
-            v_vnbr_idxs[v0] |= {v1, v2}
-            v_vnbr_idxs[v1] |= {v2, v0}
-            v_vnbr_idxs[v2] |= {v0, v1}
-
         self.edge_num = len(self.e_v_idxs)
         self.vert_num = len(self.vertices)
         self.pin_num = len(pins_xy[self.pin_mask])
 
-        self.A1: npt.NDArray[np.float32] = np.zeros([2 * (self.edge_num + self.pin_num), 2 * self.vert_num], dtype=np.float32)
-        G: npt.NDArray[np.float32] = np.zeros([2 * self.edge_num, 2 * self.vert_num], dtype=np.float32)  # holds edge rotation calculations
-
-        # populate top half of A1, one row per edge
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
-
-            # initialize self.A1 with 1, -1 denoting beginning and end of x and y dims of vector
-            self.A1[2*k:2*(k+1), 2*vi_idx:2*(vi_idx+1)] = -np.identity(2)
-            self.A1[2*k:2*(k+1), 2*vj_idx:2*(vj_idx+1)] = np.identity(2)
-
-            # Find the 'neighbor' vertices for this edge: {v_i, v_j,v_r, v_l}
-            vi_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vi_idx]
-            vj_vnbr_idxs: Set[np.int32] = v_vnbr_idxs[vj_idx]
-            e_vnbr_idxs: List[np.int32] = list(vi_vnbr_idxs.intersection(vj_vnbr_idxs))
-            e_vnbr_idxs.insert(0, vi_idx)
-            e_vnbr_idxs.insert(1, vj_idx)
-
-            e_vnbr_xys: Tuple[np.float32, np.float32] = tuple([self.vertices[v_idx] for v_idx in e_vnbr_idxs])
-
-            _: List[Tuple[float, float]] = []
-            for v in e_vnbr_xys[1:]:
-                vx: float = v[0] - e_vnbr_xys[0][0]
-                vy: float = v[1] - e_vnbr_xys[0][1]
-                _.extend(((vx, vy), (vy, -vx)))
-            G_k: npt.NDArray[np.float32] = np.array(_)
-
-            G_k_star: npt.NDArray[np.float32] = np.linalg.inv(G_k.T @ G_k) @ G_k.T
-
-            e_kx, e_ky = self.edge_vectors[k]
-            e = np.array([
-                [e_kx,  e_ky],
-                [e_ky, -e_kx]
-            ], np.float32)
-
-            edge_matrix = np.hstack([np.tile(-np.identity(2), (len(e_vnbr_idxs)-1, 1)), np.identity(2*(len(e_vnbr_idxs)-1))])
-            g = np.dot(G_k_star, edge_matrix)
-            h = np.dot(e, g)
-
-            for h_offset, v_idx in enumerate(e_vnbr_idxs):
-                self.A1[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] -= h[:, 2*h_offset:2*(h_offset+1)]
-                G[2*k:2*(k+1), 2*v_idx:2*(v_idx+1)] = g[:, 2*h_offset:2*(h_offset+1)]
+        # vertex ID -> neighbor vertex IDs, as a sparse [V, V] adjacency matrix
+        adj: csr_matrix = sp.csr_matrix((np.ones(len(all_edges) * 2), (np.concatenate([all_edges[:, 0], all_edges[:, 1]]), np.concatenate([all_edges[:, 1], all_edges[:, 0]]))),
+                                        shape=(self.vert_num, self.vert_num))
+        adj.data[:] = 1.0
+
+        # for each edge, the vertices neighboring both of its endpoints (row k holds the neighbors of edge k)
+        e_vnbrs: csr_matrix = adj[self.e_v_idxs[:, 0]].multiply(adj[self.e_v_idxs[:, 1]]).tocsr()
+        e_vnbrs.sort_indices()
+        e_vnbr_cnts = np.diff(e_vnbrs.indptr)
+
+        # rows, cols, and values of the nonzero A1 and G entries
+        A1_r: List[npt.NDArray[np.int64]] = []
+        A1_c: List[npt.NDArray[np.int64]] = []
+        A1_v: List[npt.NDArray[np.float64]] = []
+        G_r: List[npt.NDArray[np.int64]] = []
+        G_c: List[npt.NDArray[np.int64]] = []
+        G_v: List[npt.NDArray[np.float64]] = []
+
+        # populate top half of A1, two rows per edge. Edges are processed in batches sharing the same number of neighbor vertices
+        for nbr_cnt in np.unique(e_vnbr_cnts):
+            ks = np.nonzero(e_vnbr_cnts == nbr_cnt)[0]
+            n = len(ks)
+
+            # the 'neighbor' vertices for these edges: {v_i, v_j, v_r, v_l, ...}, [n, nbr_cnt + 2]
+            nbr_idxs = e_vnbrs.indices[e_vnbrs.indptr[ks][:, None] + np.arange(nbr_cnt)]
+            e_vnbr_idxs = np.concatenate([self.e_v_idxs[ks], nbr_idxs], axis=1)
+            blk_cnt = nbr_cnt + 2
+
+            # G_k, [n, 2 * (blk_cnt-1), 2]: for every vertex other than v_i, rows (vx, vy) and (vy, -vx) relative to v_i
+            d = (self.vertices[e_vnbr_idxs[:, 1:]] - self.vertices[e_vnbr_idxs[:, :1]]).astype(np.float64)
+            G_k = np.stack([d, np.stack([d[..., 1], -d[..., 0]], axis=-1)], axis=2).reshape([n, -1, 2])
+            G_k_T = G_k.transpose(0, 2, 1)
+            G_k_star = np.linalg.inv(G_k_T @ G_k) @ G_k_T  # [n, 2, 2 * (blk_cnt-1)]
+
+            # g = G_k_star @ [-I ... | I], split into a 2x2 block per neighbor vertex: [n, blk_cnt, 2, 2]
+            G_k_star_blks = G_k_star.reshape([n, 2, blk_cnt - 1, 2]).transpose(0, 2, 1, 3)
+            g = np.concatenate([-G_k_star_blks.sum(axis=1, keepdims=True), G_k_star_blks], axis=1)
+
+            e_kx, e_ky = self.edge_vectors[ks, 0].astype(np.float64), self.edge_vectors[ks, 1].astype(np.float64)
+            e = np.stack([np.stack([e_kx, e_ky], axis=-1), np.stack([e_ky, -e_kx], axis=-1)], axis=1)  # [n, 2, 2]
+            h = np.einsum('nij,nbjk->nbik', e, g)
+
+            # row and column of every element of every 2x2 block
+            rows = np.broadcast_to((2 * ks)[:, None, None, None] + np.arange(2)[None, None, :, None], g.shape)
+            cols = np.broadcast_to((2 * e_vnbr_idxs)[:, :, None, None] + np.arange(2)[None, None, None, :], g.shape)
+
+            A1_r.append(rows.ravel())
+            A1_c.append(cols.ravel())
+            A1_v.append(-h.ravel())
+            G_r.append(rows.ravel())
+            G_c.append(cols.ravel())
+            G_v.append(g.ravel())
+
+        # -1, 1 denoting beginning and end of x and y dims of each edge vector
+        e_rows = np.concatenate([2 * np.arange(self.edge_num), 2 * np.arange(self.edge_num) + 1])
+        for sign, v_idxs in ((-1.0, self.e_v_idxs[:, 0]), (1.0, self.e_v_idxs[:, 1])):
+            A1_r.append(e_rows)
+            A1_c.append(np.concatenate([2 * v_idxs, 2 * v_idxs + 1]))
+            A1_v.append(np.full(2 * self.edge_num, sign))
 
         # populate bottom row of A1, one row per constraint-dimension
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                self.A1[2*self.edge_num + 2*pin_idx  , 2*v_idx]     = self.w * v_w  # x component
-                self.A1[2*self.edge_num + 2*pin_idx+1, 2*v_idx + 1] = self.w * v_w  # y component
-
-        A2_top: npt.NDArray[np.float32] = np.zeros([self.edge_num, self.vert_num], dtype=np.float32)
-        for k, (vi_idx, vj_idx) in enumerate(self.e_v_idxs):
-            A2_top[k, vi_idx] = -1
-            A2_top[k, vj_idx] = 1
-
-        A2_bot: npt.NDArray[np.float32] = np.zeros([self.pin_num, self.vert_num], dtype=np.float32)
-        for pin_idx, pin_bc in enumerate(pins_bc):
-            for v_idx, v_w in pin_bc:
-                A2_bot[pin_idx, v_idx] = self.w * v_w
-
-        self.A2: npt.NDArray[np.float32] = np.vstack([A2_top, A2_bot])
-
-        # for speed, convert to sparse matrices and cache for later
-        self.tA1: csr_matrix = sp.csr_matrix(self.A1.transpose())
-        self.tA2: csr_matrix = sp.csr_matrix(self.A2.transpose())
-        self.G: csr_matrix = sp.csr_matrix(G)
-
-        # perturbing singular matrix and calling det can trigger overflow warning- ignore it
-        old_settings = np.seterr(over='ignore')
-
-        # ensure tA1xA1 matrix isn't singular and cache sparse repsentation
-        tA1xA1_dense: npt.NDArray[np.float32] = self.tA1 @ self.A1
-        while np.linalg.det(tA1xA1_dense) == 0.0:
-            logging.info('tA1xA1 is singular. perturbing...')
-            tA1xA1_dense += 0.00000001 * np.identity(tA1xA1_dense.shape[0])
-        self.tA1xA1: csr_matrix = sp.csr_matrix(tA1xA1_dense)
-
-        # ensure tA2xA2 matrix isn't singular and cache sparse repsentation
-        tA2xA2_dense: npt.NDArray[np.float32] = self.tA2 @ self.A2
-        while np.linalg.det(tA2xA2_dense) == 0.0:
-            logging.info('tA2xA2 is singular. perturbing...')
-            tA2xA2_dense += 0.00000001 * np.identity(tA2xA2_dense.shape[0])
-        self.tA2xA2: csr_matrix = sp.csr_matrix(tA2xA2_dense)
-
-        # revert np overflow warnings behavior
-        np.seterr(**old_settings)
+        pin_v_idxs = np.array([[v_idx for v_idx, _ in pin_bc] for pin_bc in pins_bc], dtype=np.int64).reshape([-1, 3])
+        pin_v_ws = np.array([[v_w for _, v_w in pin_bc] for pin_bc in pins_bc], dtype=np.float64).reshape([-1, 3])
+        pin_rows = np.broadcast_to(np.arange(self.pin_num)[:, None], pin_v_idxs.shape).ravel()
+        A1_r.extend([2 * self.edge_num + 2 * pin_rows, 2 * self.edge_num + 2 * pin_rows + 1])  # x, y components
+        A1_c.extend([2 * pin_v_idxs.ravel(), 2 * pin_v_idxs.ravel() + 1])
+        A1_v.extend([self.w * pin_v_ws.ravel()] * 2)
+
+        self.A1: csr_matrix = sp.csr_matrix((np.concatenate(A1_v), (np.concatenate(A1_r), np.concatenate(A1_c))),
+                                            shape=(2 * (self.edge_num + self.pin_num), 2 * self.vert_num))
+        self.G: csr_matrix = sp.csr_matrix((np.concatenate(G_v), (np.concatenate(G_r), np.concatenate(G_c))),
+                                           shape=(2 * self.edge_num, 2 * self.vert_num))  # holds edge rotation calculations
+
+        # A2 top: one row per edge. A2 bottom: one row per pin
+        A2_r = np.concatenate([np.arange(self.edge_num), np.arange(self.edge_num), self.edge_num + pin_rows])
+        A2_c = np.concatenate([self.e_v_idxs[:, 0], self.e_v_idxs[:, 1], pin_v_idxs.ravel()])
+        A2_v = np.concatenate([np.full(self.edge_num, -1.0), np.full(self.edge_num, 1.0), self.w * pin_v_ws.ravel()])
+        self.A2: csr_matrix = sp.csr_matrix((A2_v, (A2_r, A2_c)), shape=(self.edge_num + self.pin_num, self.vert_num))
+
+        self.tA1: csr_matrix = self.A1.transpose().tocsr()
+        self.tA2: csr_matrix = self.A2.transpose().tocsr()
+
+        # only the right hand sides change between solves, so factorize the normal matrices once and reuse the factors every frame
+        self.tA1xA1: csc_matrix = (self.tA1 @ self.A1).tocsc()
+        self.tA1xA1_lu: spla.SuperLU
+        self.tA1xA1, self.tA1xA1_lu = self._factorize(self.tA1xA1, 'tA1xA1')
+
+        self.tA2xA2: csc_matrix = (self.tA2 @ self.A2).tocsc()
+        self.tA2xA2_lu: spla.SuperLU
+        self.tA2xA2, self.tA2xA2_lu = self._factorize(self.tA2xA2, 'tA2xA2')
+
+    @staticmethod
+    def _factorize(M: csc_matrix, name: str) -> Tuple[csc_matrix, spla.SuperLU]:
+        """
+        LU-factorize M. If M is singular, regularize it by adding a tiny value along its diagonal and try again.
+        Returns the (possibly regularized) matrix and its factorization.
+        """
+        try:
+            return M, spla.splu(M)
+        except RuntimeError:  # raised by splu if M is exactly singular
+            logging.info(f'{name} is singular. regularizing...')
+            M = (M + 0.00000001 * sp.identity(M.shape[0], format='csc')).tocsc()
+            return M, spla.splu(M)
 
     def solve(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
         """
@@ -175,34 +185,47 @@ class ARAP():
         pins_xy: ndarray [N, 2] with new pin xy positions
         return: ndarray [N, 2], the updated xy locations of each vertex in the mesh
         """
+        return self.solve_batch(np.expand_dims(pins_xy_, axis=0))[0]
+
+    def solve_batch(self, pins_xy_: npt.NDArray[np.float32]) -> npt.NDArray[np.float64]:
+        """
+        Same as solve(), but for many sets of pin positions (e.g. one per frame of an animation) at once.
+        Each solve step is done for all sets together, as a single multi-column right hand side.
+
+        pins_xy: ndarray [F, N, 2] with F sets of new pin xy positions
+        return: ndarray [F, N, 2], the updated xy locations of each vertex in the mesh, for each set of pins
+        """
 
         # remove any pins that were orgininally outside the mesh
-        pins_xy: npt.NDArray[np.float32] = pins_xy_[self.pin_mask]  # pyright: ignore[reportGeneralTypeIssues]
+        pins_xy: npt.NDArray[np.float32] = pins_xy_[:, self.pin_mask]  # pyright: ignore[reportGeneralTypeIssues]
+
+        assert pins_xy.shape[1] == self.pin_num
 
-        assert len(pins_xy) == self.pin_num
+        frame_num = len(pins_xy)
 
-        self.b1: npt.NDArray[np.float64] = np.hstack([np.zeros([2 * self.edge_num], dtype=np.float64), self.w * pins_xy.reshape([-1, ])])
-        v1: npt.NDArray[np.float64] = spla.spsolve(self.tA1xA1, self.tA1 @ self.b1.T)
+        # one column per set of pins
+        b1: npt.NDArray[np.float64] = np.vstack([np.zeros([2 * self.edge_num, frame_num], dtype=np.float64), self.w * pins_xy.reshape([frame_num, -1]).T])
+        v1: npt.NDArray[np.float64] = self.tA1xA1_lu.solve(self.tA1 @ b1)
 
         T1: npt.NDArray[np.float64] = self.G @ v1
-        b2_top = np.empty([self.edge_num, 2], dtype=np.float64)
-        for idx, e0 in enumerate(self.edge_vectors):
-            c: np.float64 = T1[2*idx]
-            s: np.float64 = T1[2*idx + 1]
-            scale = 1.0 / np.sqrt(c * c + s * s)
-            c *= scale
-            s *= scale
-            T2 = np.asarray(((c, s), (-s, c)))  # create rotation matrix
-            e1 = np.dot(T2, e0)                 # and rotate old vector to get new
-            b2_top[idx] = e1
-        b2 = np.vstack([b2_top, self.w * pins_xy])
-        b2x = b2[:, 0]
-        b2y = b2[:, 1]
-
-        v2x: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2x)
-        v2y: npt.NDArray[np.float64] = spla.spsolve(self.tA2xA2, self.tA2 @ b2y)
-
-        return np.vstack((v2x, v2y)).T
+        b2_top = self._rotate_edge_vectors(T1)  # [E, 2, F]
+        b2 = np.vstack([b2_top, self.w * pins_xy.transpose(1, 2, 0)])
+
+        # solve for x and y of every set of pins together, as a single right hand side with two columns per set
+        v2: npt.NDArray[np.float64] = self.tA2xA2_lu.solve(self.tA2 @ b2.reshape([-1, 2 * frame_num]))
+
+        return v2.reshape([self.vert_num, 2, frame_num]).transpose(2, 0, 1)
+
+    def _rotate_edge_vectors(self, T1: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        """
+        T1: ndarray [2E, F] holding the (c, s) rotation found for each edge by the first solve, for each of F sets of pins
+        return: ndarray [E, 2, F], each original edge vector rotated by its normalized (c, s) rotation, ((c, s), (-s, c))
+        """
+        cs = T1.reshape([self.edge_num, 2, -1]).astype(self.rotation_dtype, copy=False)
+        cs = cs / np.sqrt((cs * cs).sum(axis=1, keepdims=True))
+        c, s = cs[:, 0], cs[:, 1]
+        e0x, e0y = self._edge_vectors_rot[:, 0:1], self._edge_vectors_rot[:, 1:2]
+        return np.stack([c * e0x + s * e0y, c * e0y - s * e0x], axis=1).astype(np.float64, copy=False)
 
     def _xy_to_barycentric_coords(self,
                                   points: npt.NDArray[np.float32],
@@ -130,6 +130,13 @@ class Box(Transform):
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
         GL.glBufferData(GL.GL_ARRAY_BUFFER, self.points, GL.GL_STATIC_DRAW)
 
+    def _release_opengl_resources(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(2, [self.vbo, self.ebo])
+        self._is_opengl_initialized = False
+
     def _draw(self, **kwargs) -> None:
 
         if not self._is_opengl_initialized:
@@ -325,6 +325,10 @@ class Retargeter():
             - joint_depths, dictionary mapping from BVH skeleton's joint names to distance from joint to projection plane
             - root_positions, the position of the character's root at this frame.
         """
+        return self.get_retargeted_frame_data_by_idx(self.get_frame_idx(time))
+
+    def get_frame_idx(self, time: float) -> int:
+        """ Input: time, in seconds. Returns the index of the BVH frame to use at that time, clamped to the range of valid frames. """
         frame_idx = int(round(time / self.bvh.frame_time, 0))
 
         if frame_idx < 0:
@@ -335,6 +339,10 @@ class Retargeter():
             logging.info(f'invalid frame_idx ({frame_idx}), replacing with last frame {self.bvh.frame_max_num-1}')
             frame_idx = self.bvh.frame_max_num-1
 
+        return frame_idx
+
+    def get_retargeted_frame_data_by_idx(self, frame_idx: int) -> Tuple[Dict[str, float], Dict[str, float], npt.NDArray[np.float32]]:
+        """ Same as get_retargeted_frame_data(), but takes a valid BVH frame index instead of a time. """
         orientations = {key: val[frame_idx] for (key, val) in self.char_joint_to_orientation.items()}
 
         joint_depths = {key: val[frame_idx] for (key, val) in self.bvh_joint_to_projection_depth.items()}
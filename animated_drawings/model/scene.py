@@ -2,11 +2,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+from typing import Dict, Optional
 from animated_drawings.model.transform import Transform
 from animated_drawings.model.time_manager import TimeManager
 from animated_drawings.config import SceneConfig
 from animated_drawings.model.floor import Floor
-from animated_drawings.model.animated_drawing import AnimatedDrawing
+from animated_drawings.model.animated_drawing import AnimatedDrawing, AnimatedDrawingCharacter
 
 
 class Scene(Transform, TimeManager):
@@ -16,18 +17,30 @@ class Scene(Transform, TimeManager):
     It keeps track of global time.
     """
 
-    def __init__(self, cfg: SceneConfig) -> None:
-        """ Takes in the scene dictionary from an mvc config file and prepares the scene. """
+    def __init__(self, cfg: SceneConfig, characters: Optional[Dict[str, AnimatedDrawingCharacter]] = None) -> None:
+        """
+        Takes in the scene dictionary from an mvc config file and prepares the scene.
+        characters, if provided, maps character cfg filepaths to already prepared AnimatedDrawingCharacters.
+        They are reused instead of being prepared again, and any newly prepared characters are added to it.
+        Pass the same dictionary to several scenes to share character preparation between them.
+        """
         super().__init__()
 
+        if characters is None:
+            characters = {}
+
         # add floor if required
         if cfg.add_floor:
             self.add_child(Floor())
 
         # Add the Animated Drawings
-        for each in cfg.animated_characters:
+        for char_cfg, retarget_cfg, motion_cfg in cfg.animated_characters:
+
+            char_key = str(char_cfg.char_cfg_p)
+            if char_key not in characters:
+                characters[char_key] = AnimatedDrawingCharacter(char_cfg)
 
-            ad = AnimatedDrawing(*each)
+            ad = AnimatedDrawing(char_cfg, retarget_cfg, motion_cfg, characters[char_key])
             self.add_child(ad)
 
             # add bvh to the scene if we're going to visualize it
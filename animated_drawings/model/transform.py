@@ -231,3 +231,17 @@ class Transform():
 
     def _draw(self, **kwargs) -> None:
         """Transforms default to not being drawn. Subclasses must implement how they appear"""
+
+    def release_opengl_resources(self, recurse: bool = True) -> None:
+        """
+        Delete the OpenGL objects of this transform and recurse on children.
+        Only needed if the OpenGL context is kept alive after the scene is finished with, otherwise destroying the context frees them.
+        """
+        self._release_opengl_resources()
+
+        if recurse:
+            for child in self.get_children():
+                child.release_opengl_resources()
+
+    def _release_opengl_resources(self) -> None:
+        """Transforms default to having no OpenGL objects. Subclasses that create them must delete them"""
@@ -57,6 +57,13 @@ class TransformWidget(Transform):
 
         self._is_opengl_initialized = True
 
+    def _release_opengl_resources(self) -> None:
+        if not self._is_opengl_initialized:
+            return
+        GL.glDeleteVertexArrays(1, [self.vao])
+        GL.glDeleteBuffers(1, [self.vbo])
+        self._is_opengl_initialized = False
+
     def _draw(self, **kwargs):
 
         if not self._is_opengl_initialized:
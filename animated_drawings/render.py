@@ -4,13 +4,15 @@
 
 import logging
 import sys
+from typing import Callable, Dict, List, Optional, Union
 
 
-def start(user_mvc_cfg_fn: str):
+def start(user_mvc_cfg: Union[str, dict]):
+    """ Renders the scene described by user_mvc_cfg, either an mvc config filepath or an in-memory mvc config dictionary. """
 
     # build cfg
     from animated_drawings.config import Config
-    cfg: Config = Config(user_mvc_cfg_fn)
+    cfg: Config = Config(user_mvc_cfg)
 
     # create view
     from animated_drawings.view.view import View
@@ -28,6 +30,67 @@ def start(user_mvc_cfg_fn: str):
     controller.run()
 
 
+def start_many(user_mvc_cfgs: List[Union[str, dict]]):
+    """
+    Renders each of the scenes described by user_mvc_cfgs, one after another.
+    Characters used by more than one scene (i.e. the same character cfg driven by different motions)
+    only have their mask, texture, mesh, and ARAP solver prepared once.
+    """
+    from animated_drawings.config import Config
+    from animated_drawings.view.view import View
+    from animated_drawings.model.scene import Scene
+    from animated_drawings.model.animated_drawing import AnimatedDrawingCharacter
+    from animated_drawings.controller.controller import Controller
+
+    characters: Dict[str, AnimatedDrawingCharacter] = {}
+    for user_mvc_cfg in user_mvc_cfgs:
+        cfg: Config = Config(user_mvc_cfg)
+        view = View.create_view(cfg.view)
+        scene = Scene(cfg.scene, characters)
+        controller = Controller.create_controller(cfg.controller, scene, view)
+        controller.run()
+
+
+def start_atlas(user_mvc_cfgs: List[Union[str, dict]], on_video_written: Optional[Callable[[str], None]] = None):
+    """
+    Renders all of the scenes described by user_mvc_cfgs in a single run loop, each into its own tile of one framebuffer.
+    Each scene is still written to the output video file of its own controller config. Like start_many, characters used by
+    more than one scene are only prepared once.
+    If given, on_video_written is called with each output video path as soon as that file is written. Shorter scenes finish
+    first, before the rest of the run loop.
+    All configs must render video headlessly (MODE: video_render, USE_MESA: True) at the same WINDOW_DIMENSIONS.
+    The view (camera, background image, etc.) is taken from the first config and used for every scene.
+    """
+    from animated_drawings.config import Config
+    from animated_drawings.view.view import View
+    from animated_drawings.model.scene import Scene
+    from animated_drawings.model.animated_drawing import AnimatedDrawingCharacter
+    from animated_drawings.controller.atlas_render_controller import AtlasRenderController
+
+    cfgs: List[Config] = [Config(user_mvc_cfg) for user_mvc_cfg in user_mvc_cfgs]
+
+    tile_width, tile_height = cfgs[0].view.window_dimensions
+    for cfg in cfgs:
+        if cfg.controller.mode != 'video_render' or not cfg.view.use_mesa:
+            msg = 'start_atlas can only render video headlessly. Set MODE: video_render and USE_MESA: True'
+            logging.critical(msg)
+            assert False, msg
+        if tuple(cfg.view.window_dimensions) != (tile_width, tile_height):
+            msg = f'start_atlas requires all WINDOW_DIMENSIONS to match. Found {cfg.view.window_dimensions} and {[tile_width, tile_height]}'
+            logging.critical(msg)
+            assert False, msg
+
+    # the view's framebuffer holds every tile
+    cfgs[0].view.window_dimensions = AtlasRenderController.get_atlas_size(len(cfgs), tile_width, tile_height)
+    view = View.create_view(cfgs[0].view)
+
+    characters: Dict[str, AnimatedDrawingCharacter] = {}
+    scenes = [Scene(cfg.scene, characters) for cfg in cfgs]
+
+    controller = AtlasRenderController([cfg.controller for cfg in cfgs], scenes, view, on_video_written)  # type: ignore
+    controller.run()
+
+
 if __name__ == '__main__':
     logging.basicConfig(filename='log.txt', level=logging.DEBUG)
 
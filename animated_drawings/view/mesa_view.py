@@ -17,7 +17,7 @@ from animated_drawings.view.shaders.shader import Shader
 from animated_drawings.config import ViewConfig
 
 import logging
-from typing import Tuple, Dict
+from typing import Any, Tuple, Dict, Optional
 import numpy as np
 import numpy.typing as npt
 from pathlib import Path
@@ -25,7 +25,17 @@ from pkg_resources import resource_filename
 
 
 class MesaView(View):
-    """ Mesa View for Headless Rendering """
+    """
+    Mesa View for Headless Rendering.
+    Scenes are drawn upside down in OpenGL's window coordinates, so that the framebuffer's first row is the top of the image.
+    Frames read back from it with glReadPixels are then already in the row order video writers expect, and don't need to be flipped.
+    """
+
+    # flips the projected y, which turns the image upside down in the framebuffer. No face culling is done, so the reversed winding doesn't matter
+    FLIP_Y: npt.NDArray[np.float32] = np.diag([1.0, -1.0, 1.0, 1.0]).astype(np.float32)
+
+    # context, shaders, and background image left behind by a view with KEEP_CONTEXT set, for the next MesaView in this process
+    _kept_context: Optional[Dict[str, Any]] = None
 
     def __init__(self, cfg: ViewConfig) -> None:
         super().__init__(cfg)
@@ -34,19 +44,35 @@ class MesaView(View):
 
         self.ctx: osmesa.OSMesaContext
         self.buffer: npt.NDArray[np.uint8]
-        self._initialize_mesa()
-
         self.shaders: Dict[str, Shader] = {}
         self.shader_ids: Dict[str, int] = {}
-        self._prep_shaders()
+        self.background_image: Optional[str] = None  # background image currently loaded into txtr_id and fboId
+
+        kept_context, MesaView._kept_context = MesaView._kept_context, None
+        if kept_context is not None:
+            self._reuse_mesa(kept_context)
+        else:
+            self._initialize_mesa()
+            self._prep_shaders()
 
         self._prep_background_image()
 
-        self._set_shader_projections(get_projection_matrix(*self.get_framebuffer_size()))
+        self._projection_size: Tuple[int, int] = self.get_framebuffer_size()  # (width, height) the shader projections were set for
+        self._set_shader_projections(self.FLIP_Y @ get_projection_matrix(*self._projection_size))
 
     def _prep_background_image(self) -> None:
         """ Initialize framebuffer object for background image, if specified. """
 
+        # reusing a context that already has this background image loaded
+        if self.background_image == self.cfg.background_image:
+            return
+
+        # a different background image was loaded by the previous view
+        if self.background_image:
+            GL.glDeleteFramebuffers(1, [self.fboId])
+            GL.glDeleteTextures(1, [self.txtr_id])
+            self.background_image = None
+
         # if nothing specified, return
         if not self.cfg.background_image:
             return
@@ -65,6 +91,8 @@ class MesaView(View):
         GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fboId)
         GL.glFramebufferTexture2D(GL.GL_READ_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, self.txtr_id, 0)
 
+        self.background_image = self.cfg.background_image
+
     def _prep_shaders(self) -> None:
         BVH_VERT = Path(resource_filename(__name__, "shaders/bvh.vert"))
         BVH_FRAG = Path(resource_filename(__name__, "shaders/bvh.frag"))
@@ -115,18 +143,47 @@ class MesaView(View):
 
         GL.glClearColor(*self.cfg.clear_color)
 
+    def _reuse_mesa(self, kept_context: Dict[str, Any]) -> None:
+        """ Make the context kept by a previous view current again. Only the buffer is replaced, and only if the window dimensions changed. """
+
+        self.ctx = kept_context['ctx']
+        self.shaders = kept_context['shaders']
+        self.shader_ids = kept_context['shader_ids']
+
+        self.background_image = kept_context['background_image']
+        if self.background_image:
+            self.txtr_id, self.fboId = kept_context['txtr_id'], kept_context['fboId']
+            self.txtr_w, self.txtr_h = kept_context['txtr_w'], kept_context['txtr_h']
+
+        width, height = self.cfg.window_dimensions
+        self.buffer = kept_context['buffer']
+        if self.buffer.shape[:2] != (height, width):
+            self.buffer = GL.arrays.GLubyteArray.zeros((height, width, 4))  # type: ignore
+        osmesa.OSMesaMakeCurrent(self.ctx, self.buffer, GL.GL_UNSIGNED_BYTE, width, height)
+
+        GL.glClearColor(*self.cfg.clear_color)
+
     def set_scene(self, scene: Scene) -> None:
         self.scene = scene
 
-    def render(self, scene: Transform) -> None:
-        GL.glViewport(0, 0, *self.get_framebuffer_size())
+    def render(self, scene: Transform, viewport: Optional[Tuple[int, int, int, int]] = None) -> None:
+        """
+        Render the scene into viewport, (x, y, width, height) in pixels from the top left of the image read back from the framebuffer.
+        If viewport is not specified, the scene fills the framebuffer.
+        """
+        x, y, width, height = viewport if viewport is not None else (0, 0, *self.get_framebuffer_size())
+        GL.glViewport(x, y, width, height)
+
+        # only recompute the projections when the viewport's size changes
+        if self._projection_size != (width, height):
+            self._projection_size = (width, height)
+            self._set_shader_projections(self.FLIP_Y @ get_projection_matrix(width, height))
 
-        # Draw the background
+        # Draw the background, upside down like the scene
         if self.cfg.background_image:
             GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, 0)
             GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fboId)
-            win_w, win_h = self.get_framebuffer_size()
-            GL.glBlitFramebuffer(0, 0, self.txtr_w, self.txtr_h, 0, 0, win_w, win_h, GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+            GL.glBlitFramebuffer(0, 0, self.txtr_w, self.txtr_h, x, y + height, x + width, y, GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
 
         self._update_shaders_view_transform(self.camera)
 
@@ -140,5 +197,19 @@ class MesaView(View):
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)  # type: ignore
 
     def cleanup(self) -> None:
-        """ Destroy the context when it is finished. """
+        """ Destroy the context when it is finished. If KEEP_CONTEXT is set, keep it, and its shaders and background image, for the next view instead. """
+        if self.cfg.keep_context and MesaView._kept_context is None:
+            MesaView._kept_context = {
+                'ctx': self.ctx,
+                'buffer': self.buffer,
+                'shaders': self.shaders,
+                'shader_ids': self.shader_ids,
+                'background_image': self.background_image,
+                'txtr_id': getattr(self, 'txtr_id', None),
+                'fboId': getattr(self, 'fboId', None),
+                'txtr_w': getattr(self, 'txtr_w', None),
+                'txtr_h': getattr(self, 'txtr_h', None),
+            }
+            return
+
         osmesa.OSMesaDestroyContext(self.ctx)
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 import httpx
 from app.database import get_db
 from app.schemas.ChatDto import ChatRequestDto, ChatRequestTestDto
 from app.schemas.EmotionDto import MakeEmotionReportRequest, MakeEmotionReportResponse, EmotionsRequest, EmotionsResponse, WordCloudRequest, WordCloudResponse
 from app.services.emotion_service import save_emotion_report
-from app.services.voice_service import chat_with_openai_service, chat_with_openai_test_service
+from app.services.chat_stream_service import stream_chat_with_openai_service
+from app.services.voice_service import chat_with_openai_service, chat_with_openai_test_service, tts_cache
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
@@ -33,6 +35,19 @@ async def chat_with_openai(chat_request: ChatRequestDto, db: AsyncSession = Depe
 
     return {"chat_response": response}
 
+
+@router.post("/chat/stream")
+async def chat_with_openai_stream(chat_request: ChatRequestDto, db: AsyncSession = Depends(get_db)):
+    # 답변 텍스트는 token 이벤트로, 문장별 음성은 audio 이벤트로 만들어지는 대로 보낸다 (Server-Sent Events)
+    events = await stream_chat_with_openai_service(db, chat_request)
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/tts-cache/stats")
+async def get_tts_cache_stats():
+    # 이 서버 프로세스의 TTS 캐시 적중률. 프로세스가 다시 뜨면 0부터 센다
+    return tts_cache.stats()
+
 @router.post("/make-emotion-report/{gree_id}", response_model=MakeEmotionReportResponse)
 async def make_emotion_report_api(gree_id: int, request: MakeEmotionReportRequest, db: AsyncSession = Depends(get_db)):
     async with httpx.AsyncClient() as client:
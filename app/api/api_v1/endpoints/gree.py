@@ -1,13 +1,12 @@
 import asyncio
 import os
 import shutil
-from typing import List
-from animated_drawings import render
+import tempfile
+from typing import Dict, List
 
 from fastapi import Depends, HTTPException, APIRouter, File, UploadFile, Body, Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from concurrent.futures import ProcessPoolExecutor
 
 from pydantic import BaseModel
 
@@ -15,20 +14,27 @@ import aiohttp
 import aiofiles
 import uuid
 
+from app.core.config import settings
 from app.schemas.greeFileDto import GreeFileSchema
+from app.schemas.jobDto import JobSchema
 from app.services.gree_update_service import update_gree_voice_type
 from app.services.image_service import create_image, check_image_status, upload_images_to_azure
+from app.services.job_service import job_runner, JobQueueFullError
+from app.services.render_service import render_pool, render_cache, render_cache_key, gif_blob_name, create_gifs
+from app.services.voice_service import gree_persona_cache
 from app.services.upload_service import upload_file_to_azure, upload_greefile_to_azure, \
     upload_yaml_to_azure_blob, upload_gif_to_azure_blob
 from app.api.api_v1.endpoints.user import get_current_user
 from app.schemas.greeDto import GreeUpdate, Gree
 from app.segmentation import segmentImage
+from app.models.enums import JobTypeEnum, JobStatusEnum
 from app.models.models import Member, GreeFile
 from app.models.models import Gree as SQLAlchemyGree
-from app.crud.crud_gree import crud_get_grees, crud_update_gree, crud_get_gree_by_id, crud_update_gree_status
+from app.crud.crud_gree import crud_get_grees, crud_update_gree, crud_get_gree_by_id, crud_update_gree_status, \
+    crud_get_gree_by_id_only, crud_get_grees_by_ids
+from app.crud.crud_job import crud_get_job
 from app.crud.crud_user import get_user as crud_get_user
 from app.database import get_db
-from animated_drawings import render
 
 router = APIRouter()
 
@@ -63,7 +69,7 @@ class ImageRequest(BaseModel):
     promptSelect: int
 
 
-@router.post("/generate-and-upload-image/{gree_id}")
+@router.post("/generate-and-upload-image/{gree_id}", status_code=202)
 async def generate_and_upload_image(
         gree_id: int,
         image_request: ImageRequest = Body(...),
@@ -75,8 +81,14 @@ async def generate_and_upload_image(
     if not gree:
         raise HTTPException(status_code=404, detail="Gree not found")
 
+    # 이미지 생성은 수십 초 이상 걸리므로 백그라운드 작업으로 실행하고, 결과는 /jobs/{job_id} 로 조회한다
+    job_id = await submit_job(gree_id, JobTypeEnum.GENERATE_IMAGE, generate_and_upload_image_job, promptSelect, gree.raw_img)
+    return {"job_id": job_id, "status": JobStatusEnum.PENDING, "message": "Image generation started."}
+
+
+async def generate_and_upload_image_job(db: AsyncSession, promptSelect: int, raw_img_url: str) -> dict:
     try:
-        creation_response = await create_image(promptSelect, gree.raw_img)
+        creation_response = await create_image(promptSelect, raw_img_url)
         if 'data' not in creation_response or 'id' not in creation_response['data']:
             raise HTTPException(status_code=500, detail="Failed to initiate image creation.")
     except Exception as e:
@@ -85,18 +97,34 @@ async def generate_and_upload_image(
 
     image_data = await check_image_status(creation_response['data']['id'])
 
-    local_original_image_path_list = []
-    for image_url in image_data:
-        unique_filename = f"{uuid.uuid4()}.png"
-        local_path = f"temp/{unique_filename}"
-        await download_image_async(image_url, local_path)
-        local_original_image_path_list.append(local_path)
-
-    uploaded_urls = await upload_images_to_azure(local_original_image_path_list)
+    # 생성된 이미지를 디스크에 쓰지 않고 메모리로 받아서 바로 업로드한다
+    images = await asyncio.gather(*[download_image_bytes_async(image_url) for image_url in image_data])
+    uploaded_urls = await upload_images_to_azure(list(images))
 
     return {"uploaded_image_urls": uploaded_urls, "message": "Images uploaded successfully."}
 
 
+async def submit_job(gree_id: int, job_type: JobTypeEnum, fn, *args) -> str:
+    try:
+        return await job_runner.submit(gree_id, job_type, fn, *args)
+    except JobQueueFullError:
+        raise HTTPException(status_code=503, detail="Job queue is full. Please try again later.")
+
+
+@router.get('/jobs/{job_id}', response_model=JobSchema)
+async def read_job(job_id: str, current_user: Member = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    job = await crud_get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # 다른 사용자의 그리에 대한 작업은 없는 작업처럼 취급한다
+    gree = await crud_get_gree_by_id_only(db, job.gree_id)
+    if not gree or gree.member_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
+
+
 @router.put('/update/{gree_id}', response_model=SuccessMessage)
 async def update_gree(gree_id: int, gree_update: GreeUpdate, current_user: Member = Depends(get_current_user),
                       db: AsyncSession = Depends(get_db)):
@@ -111,6 +139,9 @@ async def update_gree(gree_id: int, gree_update: GreeUpdate, current_user: Membe
     await update_gree_voice_type(db, gree_id, gree_update)
 
     updated_gree = await crud_update_gree(db, gree_id, gree_update)
+
+    # 이름, 성격, 목소리가 바뀌었을 수 있으므로 채팅용 성격 캐시를 비운다
+    gree_persona_cache.invalidate(gree_id)
     return {"message": "Gree updated successfully"}
 
 
@@ -145,13 +176,11 @@ async def disable_gree(gree_id: int, current_user: Member = Depends(get_current_
     return {"message": "Gree disabled successfully"}
 
 
-async def download_image_async(image_url: str, local_file_path: str):
+async def download_image_bytes_async(image_url: str) -> bytes:
     async with aiohttp.ClientSession() as session:
         async with session.get(image_url) as response:
             if response.status == 200:
-                f = await aiofiles.open(local_file_path, mode='wb')
-                await f.write(await response.read())
-                await f.close()
+                return await response.read()
             else:
                 raise Exception(f"Failed to download image. Status code: {response.status}")
 
@@ -177,38 +206,85 @@ async def upload_gree_file(
     if not gree:
         raise HTTPException(status_code=404, detail="Gree not found")
 
-    # 원본 이미지 URL 추출
-    original_image_url = gree.raw_img
+    try:
+        uploaded_url = await segment_and_upload_mask(gree.raw_img)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
-    # 원본 이미지 다운로드 경로 설정
-    local_original_image_path = f"temp/{uuid.uuid4()}.png"
+    # 결과 URL을 GreeFile에 저장
+    db.add(new_mask_gree_file(gree_id, uploaded_url))
+    await db.commit()
 
-    # 원본 이미지 다운로드
-    await download_image_async(original_image_url, local_original_image_path)
+    return {"message": "Files uploaded successfully", "urls": [uploaded_url]}
 
-    processed_image_path = segmentImage(local_original_image_path, 'temp/')
 
-    # 처리된 이미지를 Azure에 업로드하고, 결과 URL을 GreeFile에 저장
-    uploaded_urls = []
-    for image_path in processed_image_path:
-        file_name = f"{uuid.uuid4()}.png"
-        uploaded_url = await upload_greefile_to_azure(image_path)
-        uploaded_urls.append(uploaded_url)
+class BatchSegmentRequest(BaseModel):
+    gree_ids: List[int]
 
-        new_gree_file = GreeFile(
-            gree_id=gree_id,
-            file_type="img",
-            file_name=file_name,
-            real_name=uploaded_url
-        )
-        db.add(new_gree_file)
-        await db.commit()
-        await db.refresh(new_gree_file)
 
-    # 임시 파일 삭제
-    os.remove(local_original_image_path)
+@router.post("/greefile/upload-batch")
+async def upload_gree_files_batch(
+        batch_request: BatchSegmentRequest = Body(...),
+        current_user: Member = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    # 같은 id가 여러 번 들어와도 한 번만 처리한다
+    gree_ids = list(dict.fromkeys(batch_request.gree_ids))
+    if not gree_ids:
+        raise HTTPException(status_code=422, detail="gree_ids is empty")
+    if len(gree_ids) > settings.SEGMENT_BATCH_MAX:
+        raise HTTPException(status_code=422, detail=f"Too many grees. Up to {settings.SEGMENT_BATCH_MAX} per request.")
+
+    grees = {gree.id: gree for gree in await crud_get_grees_by_ids(db, gree_ids, user_id=current_user.id)}
+    failed: Dict[int, str] = {gree_id: "Gree not found" for gree_id in gree_ids if gree_id not in grees}
+
+    # 그리마다 다운로드 -> 세그멘테이션 -> 업로드를 동시에 진행한다. 하나가 실패해도 나머지는 계속한다
+    found_ids = [gree_id for gree_id in gree_ids if gree_id in grees]
+    results = await asyncio.gather(*[segment_and_upload_mask(grees[gree_id].raw_img) for gree_id in found_ids],
+                                   return_exceptions=True)
+
+    uploaded_urls: Dict[int, str] = {}
+    for gree_id, result in zip(found_ids, results):
+        if isinstance(result, HTTPException):
+            failed[gree_id] = str(result.detail)
+        elif isinstance(result, Exception):
+            failed[gree_id] = str(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            uploaded_urls[gree_id] = result
+
+    # 성공한 그리의 GreeFile은 한 트랜잭션으로 저장한다
+    db.add_all([new_mask_gree_file(gree_id, url) for gree_id, url in uploaded_urls.items()])
+    await db.commit()
+
+    return {"message": f"{len(uploaded_urls)} of {len(gree_ids)} files uploaded", "urls": uploaded_urls, "failed": failed}
+
+
+# 동시에 메모리에 올라가는 원본 그림과 세그멘테이션 스레드 수를 제한한다
+segment_semaphore = asyncio.Semaphore(settings.SEGMENT_CONCURRENCY)
+
+
+async def segment_and_upload_mask(raw_img_url: str) -> str:
+    # 원본 이미지를 메모리로 받아 세그멘테이션한 마스크를 Azure에 업로드하고 URL을 반환한다. 디스크는 쓰지 않는다
+    async with segment_semaphore:
+        raw_img = await download_image_bytes_async(raw_img_url)
+
+        # 세그멘테이션은 CPU 작업이므로 이벤트 루프를 막지 않도록 스레드에서 실행하고, 마스크는 PNG 바이트로 받는다
+        # OpenCV는 연산 중에 GIL을 놓기 때문에 여러 그림을 스레드로 동시에 처리해도 코어를 나눠 쓴다
+        mask_png = await asyncio.to_thread(segmentImage, raw_img)
+        del raw_img
+
+    return await upload_greefile_to_azure(mask_png)
+
 
-    return {"message": "Files uploaded successfully", "urls": uploaded_urls}
+def new_mask_gree_file(gree_id: int, uploaded_url: str) -> GreeFile:
+    return GreeFile(
+        gree_id=gree_id,
+        file_type="img",
+        file_name=f"{uuid.uuid4()}.png",
+        real_name=uploaded_url
+    )
 
 
 @router.post("/greefile/upload_yaml/{gree_id}")
@@ -245,29 +321,51 @@ async def upload_yaml(
     return {"message": "YAML file uploaded successfully", "url": file_url}
 
 
-def create_gif_wrapper(options):
-    results = []
-    for option in options:
-        result = create_gif(option)
-        results.append(result)
-    return results
-
+# 앱 전체에서 공유하는 렌더 워커 풀을 사용하여 GIF 생성
+async def render_and_upload_gifs(job_dir: str, options: Dict[str, str], gif_urls: Dict[str, asyncio.Future]) -> None:
+    # options: 렌더 캐시 키 -> 동작. 한 캐릭터의 동작들을 하나의 렌더 작업으로 렌더링한다. 캐릭터 준비(메쉬, ARAP 등)는 한 번만 하고,
+    # 동작마다 한 프레임버퍼의 타일에 그려서 매 프레임의 clear와 픽셀 읽기도 한 번에 한다
+    # 렌더 작업은 GIF가 하나 써질 때마다 알려주므로, 짧은 동작의 GIF는 긴 동작이 렌더링되는 동안 업로드된다
+    key_by_option = {option: cache_key for cache_key, option in options.items()}
 
-def create_gif(option):
-    render.start(f'AnimatedDrawings/examples/config/mvc/gree_{option}.yaml')
-    return f'./temp/{option}.gif'
+    async def upload(cache_key: str, gif_path: str) -> None:
+        try:
+            gif_urls[cache_key].set_result(await upload_gif_to_azure_blob(gif_path, blob_name=gif_blob_name(cache_key)))
+        except Exception as e:
+            gif_urls[cache_key].set_exception(e)
 
-
-# 멀티프로세싱을 사용하여 GIF 생성
-async def run_create_gif(options):
+    uploads: Dict[str, asyncio.Future] = {}
+    error = None
+    try:
+        progress = render_pool.create_progress_queue()
+        render = asyncio.ensure_future(render_pool.submit(create_gifs, job_dir, list(options.values()), progress))
+        async for option, gif_path in render_pool.iter_progress(progress, render):
+            cache_key = key_by_option[option]
+            uploads[cache_key] = asyncio.ensure_future(upload(cache_key, gif_path))
+        await render
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        # 렌더링이 실패하면 이미 나온 GIF는 업로드를 마치고, 나오지 못한 동작만 실패로 알린다
+        for cache_key, gif_url in gif_urls.items():
+            if cache_key not in uploads:
+                gif_url.set_exception(error if isinstance(error, Exception)
+                                      else RuntimeError(f'GIF rendering stopped before {options[cache_key]} was written'))
+        await asyncio.gather(*uploads.values(), return_exceptions=True)
+
+
+def start_gif_renders(job_dir: str, options: Dict[str, str]) -> Dict[str, asyncio.Future]:
+    # options: 렌더 캐시 키 -> 동작. 모든 동작을 한 작업으로 렌더링, 업로드하고, 키마다 그 GIF URL을 기다릴 수 있게 한다
     loop = asyncio.get_running_loop()
-    with ProcessPoolExecutor() as executor:
-        futures = [loop.run_in_executor(executor, create_gif, option) for option in options]
-        results = await asyncio.gather(*futures)
-    return results
+    gif_urls = {cache_key: loop.create_future() for cache_key in options}
+    batch = asyncio.ensure_future(render_and_upload_gifs(job_dir, options, gif_urls))
+    # 실패는 키마다의 future로 전달되므로, 작업 자체의 예외는 여기서 확인만 한다
+    batch.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return gif_urls
 
 
-@router.post("/create-and-upload-assets/{gree_id}")
+@router.post("/create-and-upload-assets/{gree_id}", status_code=202)
 async def create_and_upload_assets(
         gree_id: int,
         current_user: Member = Depends(get_current_user),
@@ -293,37 +391,63 @@ async def create_and_upload_assets(
     if not gree_img_file:
         raise HTTPException(status_code=404, detail="Image file not found")
 
-    base_path = 'AnimatedDrawings/examples/characters/GreeChar'
-    os.makedirs(base_path, exist_ok=True)
+    # GIF 렌더링과 업로드는 백그라운드 작업으로 실행하고, 결과는 /jobs/{job_id} 로 조회한다
+    job_id = await submit_job(gree_id, JobTypeEnum.CREATE_ASSETS, create_and_upload_assets_job,
+                              gree_id, gree.raw_img, gree_yaml_file.real_name, gree_img_file.real_name)
+    return {"job_id": job_id, "status": JobStatusEnum.PENDING, "message": "Asset creation started."}
 
-    yaml_file_path = os.path.join(base_path, 'char_cfg.yaml')
-    await download_and_save_file(gree_yaml_file.real_name, yaml_file_path)
 
-    img_file_path = os.path.join(base_path, 'mask.png')
-    await download_and_save_file(gree_img_file.real_name, img_file_path)
+async def create_and_upload_assets_job(db: AsyncSession, gree_id: int, raw_img_url: str, yaml_url: str,
+                                       img_url: str) -> dict:
+    # 요청마다 별도의 작업 디렉토리를 만들어 동시에 들어온 요청끼리 캐릭터 파일과 GIF가 섞이지 않게 한다
+    os.makedirs('temp', exist_ok=True)
+    job_dir = os.path.abspath(tempfile.mkdtemp(prefix=f'gree_{gree_id}_', dir='temp'))
 
-    texture_file_path = os.path.join(base_path, 'texture.png')
-    await download_and_save_file(gree.raw_img, texture_file_path)
+    try:
+        yaml_file_path = os.path.join(job_dir, 'char_cfg.yaml')
+        await download_and_save_file(yaml_url, yaml_file_path)
 
-    gif_list = ['walk', 'dab', 'hello']
+        img_file_path = os.path.join(job_dir, 'mask.png')
+        await download_and_save_file(img_url, img_file_path)
 
-    gif_paths = await run_create_gif(gif_list)
+        texture_file_path = os.path.join(job_dir, 'texture.png')
+        await download_and_save_file(raw_img_url, texture_file_path)
 
-    gif_url_list = []
-    for idx, i in enumerate(gif_paths):
-        uploaded_gif_url = await upload_gif_to_azure_blob(i)
+        gif_list = ['walk', 'dab', 'hello']
 
-        gif_url_list.append(uploaded_gif_url)
+        # 렌더 캐시 키를 만들고, 메모리에 없는 키는 이미 업로드된 GIF가 있는지 DB에서 찾아둔다
+        cache_keys = [await asyncio.to_thread(render_cache_key, job_dir, option) for option in gif_list]
+        for cache_key in cache_keys:
+            await render_cache.load_from_db(db, cache_key)
 
-        gree_file = GreeFile(
-            gree_id=gree_id,
-            file_type='GIF',
-            file_name=gif_list[idx],
-            real_name=uploaded_gif_url,
+        # 같은 캐릭터 파일과 동작으로 렌더링한 GIF가 이미 있으면 그 URL을 쓰고, 없는 동작만 모아서 한 번에 렌더링한다
+        # 하나가 실패해도 나머지 작업이 끝날 때까지 기다린 뒤에 작업 디렉토리를 지운다
+        # 렌더 대기열이 가득 찬 경우(RenderQueueFullError)도 그대로 올려서 작업 실패로 기록되게 한다
+        option_by_key = dict(zip(cache_keys, gif_list))
+        gif_url_list = await render_cache.get_or_create_many(
+            cache_keys, lambda keys: start_gif_renders(job_dir, {key: option_by_key[key] for key in keys})
         )
-        db.add(gree_file)
 
-    await db.commit()
+        # 재시도한 요청이면 이미 저장된 GIF 정보가 있으므로, 없는 것만 한 번에 추가하고 한 번만 커밋한다
+        existing_result = await db.execute(
+            select(GreeFile.file_name, GreeFile.real_name)
+            .where(GreeFile.gree_id == gree_id, GreeFile.file_type == 'GIF')
+        )
+        existing_files = {(row.file_name, row.real_name) for row in existing_result}
+        db.add_all([
+            GreeFile(
+                gree_id=gree_id,
+                file_type='GIF',
+                file_name=option,
+                real_name=gif_url,
+            )
+            for option, gif_url in zip(gif_list, gif_url_list)
+            if (option, gif_url) not in existing_files
+        ])
+        await db.commit()
+    finally:
+        # 작업 디렉토리 삭제
+        shutil.rmtree(job_dir, ignore_errors=True)
 
     return {"message": "Assets and GIF uploaded successfully", "gif_url": gif_url_list}
 
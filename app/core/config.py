@@ -1,6 +1,7 @@
 from pydantic.v1 import BaseSettings
 import secrets
 import os
+from typing import Optional
 
 class Settings(BaseSettings):
     API_v1_STR: str = "/api/v1"
@@ -8,6 +9,34 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # GIF 렌더 워커 풀 설정
+    RENDER_WORKERS: int = os.cpu_count() or 1
+    RENDER_QUEUE_SIZE: int = 16
+    RENDER_CACHE_SIZE: int = 1024  # 메모리에 들고 있는 렌더 캐시 항목 수
+
+    # 백그라운드 작업(에셋 생성, 이미지 생성) 설정
+    JOB_CONCURRENCY: int = 4
+    JOB_QUEUE_SIZE: int = 32
+
+    # 그림 세그멘테이션 설정
+    SEGMENT_CONCURRENCY: int = os.cpu_count() or 1  # 동시에 다운로드, 세그멘테이션하는 그림 수
+    SEGMENT_BATCH_MAX: int = 64  # 배치 요청 하나에 넣을 수 있는 그리 수
+
+    # Azure Blob 저장소 설정
+    # 연결 문자열을 지정하면 AZURE_ACCOUNT_KEY 대신 그 저장소를 쓴다. 테스트에서는 Azurite 연결 문자열을 넣는다
+    AZURE_STORAGE_CONNECTION_STRING: Optional[str] = None
+    AZURE_STORAGE_CONTAINER: str = "greefile"
+
+    # OpenAI 채팅 설정
+    OPENAI_TIMEOUT: float = 30  # 채팅 요청 하나의 제한 시간(초)
+    OPENAI_MAX_CONCURRENCY: int = 32  # 동시에 OpenAI로 보내는 채팅 요청 수
+    OPENAI_API_BASE: Optional[str] = None  # 지정하면 이 주소로 요청한다. 부하 테스트에서는 로컬 가짜 LLM 서버 주소를 넣는다
+    CHAT_HISTORY_SIZE: int = 10  # 채팅 문맥으로 모델에 같이 보내는 최근 대화 로그 수
+    GREE_PERSONA_CACHE_SIZE: int = 1024  # 메모리에 들고 있는 그리 성격(시스템 프롬프트) 수
+
+    # TTS 캐시 설정
+    TTS_CACHE_SIZE: int = 4096  # 메모리에 들고 있는 TTS 캐시 항목(음성 URL) 수
+
 settings = Settings()
 
 AWS_RDS_ID = os.getenv("AWS_RDS_ID")
@@ -35,6 +35,14 @@ async def crud_get_gree_by_id(db: AsyncSession, gree_id: int, user_id: int) -> G
         return gree
 
 
+async def crud_get_grees_by_ids(db: AsyncSession, gree_ids: List[int], user_id: int) -> List[GreeModel]:
+    async with db as session:
+        query = select(GreeModel).filter(GreeModel.id.in_(gree_ids), GreeModel.member_id == user_id, GreeModel.status == "activate")
+        result = await session.execute(query)
+        grees = result.scalars().all()
+        return grees
+
+
 async def crud_update_gree_status(db: AsyncSession, gree_id: int, user_id: int, new_status: str) -> None:
     async with db as session:
         query = select(GreeModel).filter(GreeModel.id == gree_id, GreeModel.member_id == user_id)
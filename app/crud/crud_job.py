@@ -0,0 +1,52 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.enums import JobTypeEnum, JobStatusEnum
+from app.models.models import Job
+
+
+async def crud_create_job(db: AsyncSession, gree_id: int, job_type: JobTypeEnum) -> Job:
+    job = Job(
+        id=str(uuid.uuid4()),
+        gree_id=gree_id,
+        job_type=job_type,
+        status=JobStatusEnum.PENDING,
+        register_at=datetime.now(),
+        updated_at=datetime.now()
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def crud_get_job(db: AsyncSession, job_id: str) -> Optional[Job]:
+    result = await db.execute(select(Job).filter(Job.id == job_id))
+    return result.scalars().first()
+
+
+async def crud_update_job(db: AsyncSession, job_id: str, status: JobStatusEnum,
+                          result: Optional[dict] = None, error: Optional[str] = None) -> None:
+    query_result = await db.execute(select(Job).filter(Job.id == job_id))
+    job = query_result.scalars().first()
+    if job is None:
+        return
+    job.status = status
+    job.result = result
+    job.error = error[:1000] if error else None
+    job.updated_at = datetime.now()
+    await db.commit()
+
+
+async def crud_fail_unfinished_jobs(db: AsyncSession, error: str) -> int:
+    result = await db.execute(
+        update(Job)
+        .where(Job.status.in_([JobStatusEnum.PENDING, JobStatusEnum.RUNNING]))
+        .values(status=JobStatusEnum.FAILED, error=error, updated_at=datetime.now())
+    )
+    await db.commit()
+    return result.rowcount
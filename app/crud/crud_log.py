@@ -1,16 +1,18 @@
+from typing import Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 from sqlalchemy.future import select
-from app.models.models import Log  # 모델 파일 경로에 따라 수정해야 할 수 있음
+from app.models.models import Log, LogVoice  # 모델 파일 경로에 따라 수정해야 할 수 있음
 
 # 로그 생성
-async def create_log(db: AsyncSession, gree_id: int, log_type, content: str, voice_url: str):
+async def create_log(db: AsyncSession, gree_id: int, log_type, content: str, voice_url: str, voice_urls: Sequence[str] = ()):
     db_log = Log(
         gree_id=gree_id,
         log_type=log_type,
         content=content,
         voice_url=voice_url,
-        register_at=datetime.now()
+        register_at=datetime.now(),
+        voices=[LogVoice(seq=seq, voice_url=url) for seq, url in enumerate(voice_urls)]
     )
     db.add(db_log)
     await db.commit()
@@ -27,6 +29,16 @@ async def get_logs(db: AsyncSession, skip: int = 0, limit: int = 100):
     result = await db.execute(select(Log).offset(skip).limit(limit))
     return result.scalars().all()
 
+# 그리의 최근 대화 로그 (최신순으로 limit개). (gree_id, log_id) 인덱스로 필요한 행만 읽는다
+async def get_recent_talk_logs(db: AsyncSession, gree_id: int, limit: int):
+    result = await db.execute(
+        select(Log)
+        .filter(Log.gree_id == gree_id, Log.log_type.in_(['USER_TALK', 'GREE_TALK']))
+        .order_by(Log.id.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
 # 로그 업데이트
 async def update_log(db: AsyncSession, log_id: int, gree_id: int, log_type, content: str):
     result = await db.execute(select(Log).filter(Log.id == log_id))
@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import RenderedGif
+
+
+async def crud_get_rendered_gif_url(db: AsyncSession, cache_key: str) -> Optional[str]:
+    result = await db.execute(select(RenderedGif.gif_url).filter(RenderedGif.cache_key == cache_key))
+    return result.scalars().first()
+
+
+async def crud_create_rendered_gif(db: AsyncSession, cache_key: str, gif_url: str) -> None:
+    db.add(RenderedGif(
+        cache_key=cache_key,
+        gif_url=gif_url,
+        register_at=datetime.now()
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 같은 키를 먼저 기록한 렌더링이 있다. blob 이름이 키로 정해지므로 URL도 같다
+        await db.rollback()
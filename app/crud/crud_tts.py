@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.enums import VoiceTypeEnum
+from app.models.models import TtsAudio
+
+
+async def crud_get_tts_audio_url(db: AsyncSession, cache_key: str) -> Optional[str]:
+    result = await db.execute(select(TtsAudio.voice_url).filter(TtsAudio.cache_key == cache_key))
+    return result.scalars().first()
+
+
+async def crud_create_tts_audio(db: AsyncSession, cache_key: str, voice_type: VoiceTypeEnum, text: str, voice_url: str) -> None:
+    db.add(TtsAudio(
+        cache_key=cache_key,
+        voice_type=voice_type,
+        text=text[:1000],
+        voice_url=voice_url,
+        register_at=datetime.now()
+    ))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 다른 서버가 같은 문장을 먼저 기록했다. blob 이름이 키로 정해지므로 URL도 같다
+        await db.rollback()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 
 # main.py를 기준으로 하는게 아닌, 프로젝트 루트 경로를 베이스로 한다.
 from app.models.models import Base
@@ -9,8 +9,20 @@ def init_db():
     engine = create_engine(DATABASE_URI)
     # Base.metadata.create_all을 호출하여 모든 상속된 테이블을 생성합니다.
     Base.metadata.create_all(engine)
+    create_missing_indexes(engine)
     print("모든 테이블이 생성되었습니다.")
 
 
+def create_missing_indexes(engine):
+    # create_all은 이미 있는 테이블에 나중에 추가된 인덱스를 만들지 않으므로, 모델에 있는데 DB에 없는 인덱스를 만든다
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                print(f"{table.name} 테이블에 {index.name} 인덱스를 추가했습니다.")
+
+
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
@@ -34,6 +34,20 @@ class FileTypeEnum(PyEnum):
     IMG = 'IMG'
 
 
+@unique
+class JobTypeEnum(PyEnum):
+    CREATE_ASSETS = "CREATE_ASSETS"
+    GENERATE_IMAGE = "GENERATE_IMAGE"
+
+
+@unique
+class JobStatusEnum(PyEnum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+
 @unique
 class EmotionTypeEnum(PyEnum):
     HAPPY = "HAPPY"
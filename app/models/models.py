@@ -1,8 +1,9 @@
 # app/models/models.py
-from sqlalchemy import JSON, Column, Integer, String, DateTime, Enum, ForeignKey, Boolean
+from sqlalchemy import JSON, Column, Integer, String, DateTime, Enum, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from app.models.enums import RoleEnum, StatusEnum, GradeEnum, LogTypeEnum, FileTypeEnum, VoiceTypeEnum
+from app.models.enums import RoleEnum, StatusEnum, GradeEnum, LogTypeEnum, FileTypeEnum, VoiceTypeEnum, JobTypeEnum, \
+    JobStatusEnum
 from datetime import datetime
 
 Base = declarative_base()
@@ -42,6 +43,7 @@ class Gree(Base):
     log = relationship("Log", back_populates="gree")
     greefile = relationship("GreeFile", back_populates="gree")
     emotion_report = relationship("EmotionReport", back_populates="gree")
+    job = relationship("Job", back_populates="gree")
 
 
 class GreeFile(Base):
@@ -57,6 +59,31 @@ class GreeFile(Base):
     gree = relationship("Gree", back_populates="greefile")
 
 
+class Job(Base):
+    __tablename__ = 'job'
+
+    # 렌더링, 이미지 생성처럼 오래 걸리는 작업은 백그라운드에서 실행하고 상태를 여기에 기록한다
+    id = Column('job_id', String(36), primary_key=True)
+    gree_id = Column(Integer, ForeignKey('gree.gree_id'), nullable=False)
+    job_type = Column(Enum(JobTypeEnum), nullable=False)
+    status = Column(Enum(JobStatusEnum), nullable=False)
+    result = Column(JSON)  # 성공 시 작업 결과 (업로드된 URL 등)
+    error = Column(String(1000))  # 실패 시 에러 메시지
+    register_at = Column(DateTime, nullable=False, default=datetime.now())
+    updated_at = Column(DateTime)
+
+    gree = relationship("Gree", back_populates="job")
+
+
+class RenderedGif(Base):
+    __tablename__ = 'rendered_gif'
+
+    # 렌더 캐시의 영구 색인. 렌더 캐시 키(캐릭터 파일과 동작 설정의 해시)마다 이미 업로드된 GIF URL을 기록한다
+    cache_key = Column(String(64), primary_key=True)
+    gif_url = Column(String(255), nullable=False)
+    register_at = Column(DateTime, nullable=False, default=datetime.now())
+
+
 class Log(Base):
     __tablename__ = 'log'
 
@@ -69,6 +96,34 @@ class Log(Base):
     register_at = Column(DateTime, nullable=False, default=datetime.now())
 
     gree = relationship("Gree", back_populates="log")
+    # 스트리밍 답변은 문장별 음성 파일로 나뉘어 있으므로, voice_url 하나 대신 재생 순서대로 기록한다
+    voices = relationship("LogVoice", back_populates="log", order_by="LogVoice.seq",
+                          cascade="all, delete-orphan", passive_deletes=True)
+
+    # 채팅마다 그리의 최근 대화 로그를 읽으므로, gree_id 안에서 log_id 순서로 바로 찾을 수 있게 한다
+    __table_args__ = (Index('ix_log_gree_id_log_id', 'gree_id', 'log_id'),)
+
+
+class LogVoice(Base):
+    __tablename__ = 'log_voice'
+
+    # 답변의 seq번째 문장 음성. TTS 캐시에 이미 업로드된 파일의 URL이다
+    log_id = Column(Integer, ForeignKey('log.log_id', ondelete='CASCADE'), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    voice_url = Column(String(255), nullable=False)
+
+    log = relationship("Log", back_populates="voices")
+
+
+class TtsAudio(Base):
+    __tablename__ = 'tts_audio'
+
+    # TTS 캐시의 영구 색인. (목소리, 정규화한 문장, 속도, 높낮이)로 만든 캐시 키마다 이미 업로드된 음성 URL을 기록한다
+    cache_key = Column(String(64), primary_key=True)
+    voice_type = Column(Enum(VoiceTypeEnum), nullable=False)
+    text = Column(String(1000), nullable=False)
+    voice_url = Column(String(255), nullable=False)
+    register_at = Column(DateTime, nullable=False, default=datetime.now())
 
 
 class EmotionReport(Base):
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from app.models.enums import LogTypeEnum
 
@@ -14,6 +14,7 @@ class CreateGreeTalkLogDto(BaseModel):
     log_type: LogTypeEnum
     content: str
     voice_url: str # azure
+    voice_urls: List[str] = []  # 문장별 음성 URL (스트리밍 답변)
 
 # 응답을 위한 DTO
 class LogResponseDto(BaseModel):
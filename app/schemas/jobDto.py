@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from app.models.enums import JobTypeEnum, JobStatusEnum
+
+
+class JobSchema(BaseModel):
+    id: str
+    gree_id: int
+    job_type: JobTypeEnum
+    status: JobStatusEnum
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    register_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -1,88 +1,61 @@
 import cv2
 import numpy as np
-import os
 
-#이미지랑 경로 넣으면 해당 경로에 마스크랑 리사이즈된 이미지 저장된 return값은 무시해도됨 디버그용
-def segmentImage(image_path, output_path = "./"):
-    image = cv2.imread(image_path)
+# 논문값
+ADAPTIVE_THRESHOLD_C = 0
+ADAPTIVE_THRESHOLD_FILTER_W = 7
 
-    imageList = []
-    saved_paths = []
+SEGMENT_SIZE = (400, 400)  # (width, height). 마스크는 업로드되는 리사이즈 이미지와 같은 크기로 만든다
 
-    new_width = 400
-    new_height = 400
+_KERNEL = np.ones((3, 3), np.uint8)
 
-    # 이미지 리사이즈
-    resized_image = cv2.resize(image, (new_width, new_height))
-    imageList.append(('Resized Image', resized_image))
 
-    # Assuming you have the bounding box coordinates (x, y, width, height)
-    height, width = resized_image.shape[:2]
-    x, y, w, h = 0, 0, width, height  # Replace with your bounding box coordinates
-    roi = resized_image[y:y+h, x:x+w]
+def segmentMask(image: np.ndarray) -> np.ndarray:
+    """
+    BGR 그림 이미지에서 캐릭터 영역(가장 큰 윤곽선 내부)을 255, 나머지를 0으로 채운 SEGMENT_SIZE 크기의 마스크를 만든다.
+    중간 결과는 필요한 버퍼 몇 개만 만들고, 나머지 단계는 그 버퍼 위에서 바로 계산한다.
+    """
+    resized_image = cv2.resize(image, SEGMENT_SIZE)
+    gray = cv2.cvtColor(resized_image, cv2.COLOR_BGR2GRAY)
+    del resized_image
 
-    # Convert to grayscale
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    imageList.append(('Grayscale Image', gray))
-
-    # Apply adaptive thresholding
-    # 논문값
-    C = 0
-    filterW = 7
-    thresh = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, filterW, C
+    # 선(어두운 부분)이 0, 종이가 255가 되도록 이진화한 뒤 끊어진 선을 잇는다
+    dilated = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, ADAPTIVE_THRESHOLD_FILTER_W, ADAPTIVE_THRESHOLD_C
     )
-    imageList.append(('Thresholded Image', thresh))
-
-    # Perform morphological closing
-    kernel = np.ones((3, 3), np.uint8)
-    closing = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-    imageList.append(('Morphological Closing', closing))
-
-    # Dilate the image
-    dilated = cv2.dilate(closing, kernel, iterations=1)
-    imageList.append(('Dilated Image', dilated))
-
-    # Add 10 pixels of padding around the image
-    dilated_padded = cv2.copyMakeBorder(dilated, 100, 100, 100, 100, cv2.BORDER_CONSTANT, value=0)
-    imageList.append(('Dilated Image with Padding', dilated_padded))
-
-    # Flood filling
-    flood_fill = dilated_padded.copy()
-    h, w = flood_fill.shape[:2]
-    mask = np.zeros((h+2, w+2), np.uint8)
-    cv2.floodFill(flood_fill, mask, (0, 0), 255)
-    imageList.append(('Flood Fill Image', flood_fill))
+    cv2.morphologyEx(dilated, cv2.MORPH_CLOSE, _KERNEL, dst=dilated)
+    cv2.dilate(dilated, _KERNEL, dst=dilated, iterations=1)
 
-    # Remove the 10-pixel padding
-    flood_fill = flood_fill[100:-100, 100:-100]
-    imageList.append(('Flood Fill Image without Padding', flood_fill))
+    # 바깥 배경을 모서리에서 flood fill 한다. 그림이 가장자리에 닿아도 배경이 한 덩어리로 이어지도록 1px 테두리를 두른다
+    flood_fill = cv2.copyMakeBorder(dilated, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    cv2.floodFill(flood_fill, None, (0, 0), 255)
 
-    # Invert flood filled image
-    flood_fill_inv = cv2.bitwise_not(flood_fill)
-    imageList.append(('Inverted Flood Fill Image', flood_fill_inv))
+    # 채워지지 않은 영역(닫힌 선의 안쪽)과 선을 합쳐 전경을 만든다
+    foreground = cv2.bitwise_not(flood_fill[1:-1, 1:-1])
+    cv2.bitwise_or(foreground, dilated, dst=foreground)
 
-    # Combine the two images to get the foreground
-    out = dilated | flood_fill_inv
-    imageList.append(('Combined Image', out))
-
-    # Find and retain only the largest polygon
-    contours, _ = cv2.findContours(out, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # 가장 큰 윤곽선 하나만 남긴다
+    contours, _ = cv2.findContours(foreground, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        raise ValueError('No drawing found in image')
     largest_contour = max(contours, key=cv2.contourArea)
-    mask = np.zeros_like(out)
+    mask = foreground  # 윤곽선을 찾은 뒤에는 foreground 버퍼를 마스크로 다시 쓴다
+    mask.fill(0)
     cv2.drawContours(mask, [largest_contour], -1, 255, thickness=cv2.FILLED)
-    imageList.append(('Largest Contour Mask', mask))
-
-    # Apply the mask to the original ROI
-    result = cv2.bitwise_and(roi, roi, mask=mask)
-    imageList.append(('Result', result))
-
-    # Save the 'Largest Contour Mask' and 'Resized Image' to the specified output path
-    for name, img in imageList:
-        if name in ('Largest Contour Mask'):
-            file_path = os.path.join(output_path, f"{name.replace(' ', '_')}.png")
-            cv2.imwrite(file_path, img)
-            saved_paths.append(file_path)  # 저장된 각 파일의 경로를 리스트에 추가
-
-    return saved_paths
-
+    return mask
+
+
+def segmentImage(image_bytes: bytes) -> bytes:
+    """
+    인코딩된 그림(PNG, JPEG 등)의 바이트에서 캐릭터 마스크를 만들어 PNG 바이트로 반환한다.
+    디스크를 거치지 않으므로 여러 요청이 동시에 호출해도 서로의 결과를 덮어쓰지 않는다.
+    OpenCV 연산이 대부분이라 이벤트 루프에서는 asyncio.to_thread 로 호출한다.
+    """
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR) if image_bytes else None
+    if image is None:
+        raise ValueError('Failed to decode image')
+
+    ok, buffer = cv2.imencode('.png', segmentMask(image))
+    if not ok:
+        raise ValueError('Failed to encode mask')
+    return buffer.tobytes()
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import re
+from typing import AsyncIterator, List, Optional, Tuple
+
+import openai
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.enums import VoiceTypeEnum
+from app.schemas.ChatDto import ChatRequestDto
+from app.schemas.LogDto import CreateGreeTalkLogDto, CreateUserTalkLogDto
+from app.services.log_service import create_greetalk_log_service, create_usertalk_log_service
+from app.services.voice_service import openai_semaphore, tts_cache, gree_persona_cache, build_gree_chat_messages, \
+    GREE_CHAT_PARAMS
+
+# 문장 끝: 마침표, 물음표, 느낌표 등이 이어진 뒤 공백이나 줄바꿈이 오는 곳. "3.5" 처럼 바로 글자가 이어지면 문장 끝이 아니다
+_SENTENCE_END = re.compile(r'[.!?~。…]+["\')\]]*\s+|\n+')
+
+
+def split_sentences(text: str) -> Tuple[List[str], str]:
+    """ text에서 끝난 문장들과, 아직 끝나지 않은 나머지를 나눈다. 스트림으로 받는 중인 텍스트에 계속 호출한다. """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, text[start:]
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _speak(voice_type: VoiceTypeEnum, sentence: str) -> str:
+    """ 문장 하나의 음성 URL을 반환한다. TTS 캐시에 없는 문장만 합성하고 업로드한다. """
+    return await tts_cache.get_url(voice_type, sentence)
+
+
+async def stream_chat_with_openai_service(db: AsyncSession, chat_request: ChatRequestDto) -> AsyncIterator[str]:
+    """
+    chat_with_openai_service의 스트리밍 버전. 사용자 메시지를 USER_TALK 로그로 남기고, 그리의 답변을 SSE 이벤트로 내보내는 이터레이터를 반환한다.
+    스트리밍은 요청의 DB 세션이 닫힌 뒤에도 계속되므로, 답변 로그는 새 세션으로 저장한다.
+    """
+    persona = await gree_persona_cache.get(db, chat_request.gree_id)
+    if persona is None:
+        raise HTTPException(status_code=404, detail="Gree not found")
+
+    messages = await build_gree_chat_messages(db, persona, chat_request.message)
+
+    await create_usertalk_log_service(db, CreateUserTalkLogDto(
+        gree_id=persona.gree_id,
+        log_type='USER_TALK',
+        content=chat_request.message
+    ))
+
+    return stream_gree_talk(persona.gree_id, persona.voice_type, messages)
+
+
+async def stream_gree_talk(gree_id: int, voice_type: VoiceTypeEnum, messages: List[dict]) -> AsyncIterator[str]:
+    """
+    그리의 답변을 SSE 이벤트로 스트리밍한다.
+    - token: 모델이 만든 텍스트 조각이 도착하는 대로 보낸다.
+    - audio: 문장이 끝날 때마다 바로 TTS 합성, 업로드를 시작하고, 끝나면 문장 순서대로 음성 URL을 보낸다.
+      첫 음성은 답변 전체가 아니라 첫 문장만 기다리면 된다.
+    - done: 답변 전체를 GREE_TALK 로그로 저장한 뒤 보낸다. 음성은 다시 합치거나 올리지 않고, 이미 업로드된 문장별 URL을 순서대로 남긴다.
+    - error: 도중에 실패하면 보내고 스트림을 끝낸다.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    speeches: asyncio.Queue = asyncio.Queue()  # 문장 순서대로 쌓이는 (문장, TTS 작업). 끝나면 None
+
+    async def generate() -> str:
+        # 모델 응답을 받아 token 이벤트를 보내고, 끝난 문장마다 TTS 작업을 시작한다. 답변 전체를 반환한다
+        parts, pending = [], ''
+        try:
+            async with openai_semaphore:
+                response = await openai.ChatCompletion.acreate(
+                    api_base=settings.OPENAI_API_BASE,
+                    request_timeout=settings.OPENAI_TIMEOUT,
+                    messages=messages,
+                    stream=True,
+                    **GREE_CHAT_PARAMS
+                )
+                async for chunk in response:
+                    delta = chunk.choices[0].delta.get('content') if chunk.choices else None
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    await events.put(sse_event('token', {'text': delta}))
+
+                    sentences, pending = split_sentences(pending + delta)
+                    for sentence in sentences:
+                        speeches.put_nowait((sentence, asyncio.create_task(_speak(voice_type, sentence))))
+
+            if pending.strip():
+                speeches.put_nowait((pending.strip(), asyncio.create_task(_speak(voice_type, pending.strip()))))
+            return ''.join(parts)
+        finally:
+            speeches.put_nowait(None)
+
+    async def speak() -> List[str]:
+        # TTS 작업을 문장 순서대로 기다려서 audio 이벤트를 보낸다. 문장별 음성 URL을 반환한다
+        voice_urls = []
+        while True:
+            item = await speeches.get()
+            if item is None:
+                return voice_urls
+            sentence, task = item
+            url = await task
+            await events.put(sse_event('audio', {'index': len(voice_urls), 'text': sentence, 'voice_url': url}))
+            voice_urls.append(url)
+
+    async def run() -> None:
+        try:
+            generator = asyncio.create_task(generate())
+            speaker = asyncio.create_task(speak())
+            try:
+                gree_talk, voice_urls = await asyncio.gather(generator, speaker)
+            except BaseException:
+                generator.cancel()
+                speaker.cancel()
+                _cancel_speeches(speeches)
+                raise
+
+            # 한 문장짜리 답변은 그 문장의 음성이 곧 답변 전체의 음성이다
+            voice_url: Optional[str] = voice_urls[0] if len(voice_urls) == 1 else None
+
+            async with AsyncSessionLocal() as db:
+                gpt_talk = await create_greetalk_log_service(db, CreateGreeTalkLogDto(
+                    gree_id=gree_id,
+                    log_type='GREE_TALK',
+                    content=gree_talk,
+                    voice_url=voice_url or '',
+                    voice_urls=voice_urls
+                ))
+            await events.put(sse_event('done', {'log_id': gpt_talk.id, 'content': gree_talk, 'voice_url': voice_url,
+                                                'voice_urls': voice_urls}))
+        except asyncio.CancelledError:
+            raise
+        except openai.error.Timeout:
+            await events.put(sse_event('error', {'detail': "The chat model did not respond in time."}))
+        except HTTPException as e:
+            await events.put(sse_event('error', {'detail': str(e.detail)}))
+        except Exception:
+            logging.exception(f'Streaming chat for gree {gree_id} failed')
+            await events.put(sse_event('error', {'detail': "An error occurred while processing your request."}))
+        finally:
+            events.put_nowait(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # 클라이언트가 연결을 끊으면 남은 모델 응답, TTS 작업을 모두 취소한다
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+
+def _cancel_speeches(speeches: asyncio.Queue) -> None:
+    while not speeches.empty():
+        item = speeches.get_nowait()
+        if item is not None:
+            item[1].cancel()
@@ -1,20 +1,16 @@
 import uuid
 
-import aiofiles
 import httpx
 import asyncio
 
-from azure.storage.blob import ContentSettings
-from azure.storage.blob.aio import BlobServiceClient
 from typing import List
 import os
 
 from fastapi import HTTPException
 
+from app.services.upload_service import blob_storage
+
 MID_API_KEY = os.getenv('MID_API_KEY')
-container_name = "greefile"
-AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
-connection_string = f'DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net'
 promptDict = {
     1: """
     **normal**
@@ -98,18 +94,9 @@ async def check_image_status(image_id: str) -> list:
             await asyncio.sleep(5)  # Polling interval
 
 
-async def upload_images_to_azure(image_paths: List[str]) -> List[str]:
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    uploaded_urls = []
-    async with blob_service_client:
-        for image_path in image_paths:
-            filename = os.path.basename(image_path) or str(uuid.uuid4())
-            blob_name = f"upload/{filename}.png"
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-
-            async with aiofiles.open(image_path, 'rb') as file:
-                data = await file.read()
-
-            await blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type='image/png'))
-            uploaded_urls.append(blob_client.url)
-    return uploaded_urls
+async def upload_images_to_azure(images: List[bytes]) -> List[str]:
+    # 메모리에 있는 PNG 이미지들을 공유 클라이언트로 동시에 업로드한다. URL은 images 순서대로 반환한다
+    return list(await asyncio.gather(*[
+        blob_storage.upload(f"upload/{uuid.uuid4()}.png", image, 'image/png')
+        for image in images
+    ]))
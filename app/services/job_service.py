@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Set
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.crud.crud_job import crud_create_job, crud_update_job, crud_fail_unfinished_jobs
+from app.database import AsyncSessionLocal
+from app.models.enums import JobTypeEnum, JobStatusEnum
+
+
+class JobQueueFullError(Exception):
+    """ 백그라운드 작업 대기열이 가득 차서 작업을 더 받을 수 없을 때 발생한다. """
+
+
+class JobRunner:
+    """
+    GIF 렌더링, 이미지 생성처럼 수십 초 이상 걸리는 작업을 HTTP 요청과 분리해서 백그라운드에서 실행한다.
+    작업은 job 테이블에 PENDING -> RUNNING -> SUCCEEDED / FAILED 상태로 기록되고, 클라이언트는 job_id로 상태와 결과를 조회한다.
+    동시에 실행되는 작업 수는 max_concurrency, 대기까지 포함한 작업 수는 max_concurrency + queue_size 로 제한된다.
+    """
+
+    def __init__(self, max_concurrency: int, queue_size: int):
+        self.max_pending = max_concurrency + queue_size
+        self._pending = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, gree_id: int, job_type: JobTypeEnum, fn, *args) -> str:
+        """
+        작업을 job 테이블에 등록하고 백그라운드에서 실행한 뒤, 바로 job_id를 반환한다.
+        fn은 새 DB 세션을 첫 인자로 받아 실행되고, 반환한 dict가 작업 결과로 저장된다.
+        """
+        if self._pending >= self.max_pending:
+            raise JobQueueFullError(f'job queue is full ({self.max_pending} jobs pending)')
+
+        # job을 등록하는 동안 들어온 다른 요청이 같은 자리를 쓰지 않도록, await 전에 자리를 잡아둔다
+        self._pending += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await crud_create_job(db, gree_id, job_type)
+        except BaseException:
+            self._pending -= 1
+            raise
+
+        task = asyncio.create_task(self._run(job.id, fn, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return job.id
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._pending -= 1
+
+    async def _run(self, job_id: str, fn, *args) -> None:
+        try:
+            async with self._semaphore:
+                # 요청에서 쓰던 세션은 응답과 함께 닫히므로, 작업마다 새 세션을 연다
+                async with AsyncSessionLocal() as db:
+                    await crud_update_job(db, job_id, JobStatusEnum.RUNNING)
+                    result = await fn(db, *args)
+                    await crud_update_job(db, job_id, JobStatusEnum.SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            await self._mark_failed(job_id, 'server shut down before the job finished')
+            raise
+        except HTTPException as e:
+            await self._mark_failed(job_id, str(e.detail))
+        except Exception as e:
+            logging.exception(f'Job {job_id} failed')
+            await self._mark_failed(job_id, str(e))
+
+    async def _mark_failed(self, job_id: str, error: str) -> None:
+        # 실패한 작업의 세션은 상태를 알 수 없으므로, 새 세션으로 기록한다
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud_update_job(db, job_id, JobStatusEnum.FAILED, error=error)
+        except Exception:
+            logging.exception(f'Failed to record failure of job {job_id}')
+
+    async def fail_interrupted_jobs(self) -> None:
+        """
+        앱이 시작될 때 호출한다. 이전 프로세스가 끝나기 전에 마치지 못한 PENDING, RUNNING 작업은 다시 실행되지 않으므로 FAILED로 기록한다.
+        작업은 그 작업을 받은 프로세스 안에서만 실행되므로, 서버 프로세스가 하나일 때를 전제로 한다.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                count = await crud_fail_unfinished_jobs(db, 'server restarted before the job finished')
+        except Exception:
+            logging.exception('Failed to mark interrupted jobs as failed')
+            return
+        if count:
+            logging.info(f'Marked {count} interrupted jobs as failed')
+
+    async def shutdown(self) -> None:
+        """ 실행 중이거나 대기 중인 작업을 취소한다. 취소된 작업은 FAILED로 기록된다. """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            logging.info(f'Job runner shut down: {len(tasks)} jobs cancelled')
+
+
+job_runner = JobRunner(settings.JOB_CONCURRENCY, settings.JOB_QUEUE_SIZE)
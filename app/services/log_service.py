@@ -16,7 +16,7 @@ async def create_usertalk_log_service(db: AsyncSession, log_dto: CreateUserTalkL
     return db_log
 
 async def create_greetalk_log_service(db: AsyncSession, log_dto: CreateGreeTalkLogDto) -> Log:
-    db_log = await crud_create_log(db, log_dto.gree_id, log_dto.log_type, log_dto.content, log_dto.voice_url)
+    db_log = await crud_create_log(db, log_dto.gree_id, log_dto.log_type, log_dto.content, log_dto.voice_url, log_dto.voice_urls)
     return db_log
 
 async def get_log_service(db: AsyncSession, log_id: int) -> Optional[Log]:
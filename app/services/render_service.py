@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import SyncManager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import yaml
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.crud_rendered_gif import crud_get_rendered_gif_url, crud_create_rendered_gif
+from app.database import AsyncSessionLocal
+
+# 렌더러 출력이 바뀌면(GIF 인코딩 방식 등) 값을 올려서 예전에 렌더링된 GIF를 캐시에서 쓰지 않게 한다
+RENDER_CACHE_VERSION = 1
+
+# 워커가 작업 중간에 보내는 진행 상황(다 써진 GIF 등)을 확인하는 간격(초)
+PROGRESS_POLL_INTERVAL = 0.1
+
+
+class RenderQueueFullError(Exception):
+    """ 렌더 대기열이 가득 차서 작업을 더 받을 수 없을 때 발생한다. """
+
+
+def _init_render_worker() -> None:
+    """
+    워커 프로세스가 처음 뜰 때 한 번만 실행된다.
+    OpenGL(OSMesa), scipy, skimage 등 무거운 모듈을 미리 import 해두어
+    이후 작업에서는 import 비용 없이 바로 렌더링을 시작한다.
+    """
+    os.environ['PYOPENGL_PLATFORM'] = "osmesa"
+
+    import scipy.sparse.linalg  # noqa: F401
+    import skimage.measure  # noqa: F401
+    import animated_drawings.render  # noqa: F401
+    import animated_drawings.config  # noqa: F401
+    import animated_drawings.model.scene  # noqa: F401
+    import animated_drawings.view.mesa_view  # noqa: F401
+    import animated_drawings.controller.video_render_controller  # noqa: F401
+    import animated_drawings.controller.atlas_render_controller  # noqa: F401
+
+
+def _warm_up() -> int:
+    """ 워커가 initializer까지 끝냈는지 확인하기 위한 빈 작업 """
+    return os.getpid()
+
+
+def build_job_mvc_cfg(option: str, job_dir: str) -> dict:
+    """
+    gree_{option}.yaml 설정을 읽어서, 캐릭터 파일과 출력 GIF 경로만 작업 전용 디렉토리로 바꾼 메모리상의 mvc 설정을 만든다.
+    작업마다 경로가 분리되므로 여러 그리를 동시에 렌더링해도 서로의 파일을 덮어쓰지 않는다.
+    """
+    with open(f'AnimatedDrawings/examples/config/mvc/gree_{option}.yaml', 'r') as f:
+        mvc_cfg = yaml.safe_load(f)
+
+    char_cfg_path = os.path.join(job_dir, 'char_cfg.yaml')
+    for character in mvc_cfg['scene']['ANIMATED_CHARACTERS']:
+        character['character_cfg'] = char_cfg_path
+
+    mvc_cfg['controller']['OUTPUT_VIDEO_PATH'] = os.path.join(job_dir, f'{option}.gif')
+    # 클라이언트가 내려받는 GIF이므로 전역 팔레트 + 변경 영역만 담는 최적화 모드로 저장한다
+    mvc_cfg['controller']['OUTPUT_GIF_OPTIMIZE'] = True
+    # 워커 프로세스는 창 없이 OSMesa로 렌더링한다(PYOPENGL_PLATFORM=osmesa). 타일 렌더링(start_atlas)도 이 모드에서만 된다
+    mvc_cfg.setdefault('view', {})['USE_MESA'] = True
+    # 워커 프로세스는 GIF를 계속 렌더링하므로, OSMesa 컨텍스트와 셰이더를 다음 렌더링에서 재사용한다
+    mvc_cfg['view']['KEEP_CONTEXT'] = True
+    return mvc_cfg
+
+
+def render_cache_key(job_dir: str, option: str) -> str:
+    """
+    job_dir의 캐릭터 파일(char_cfg.yaml, mask.png, texture.png)과 option 동작의 mvc/motion/retarget 설정, BVH 파일 내용으로 만든 sha256.
+    같은 그리를 같은 동작으로 다시 렌더링하면 같은 키가 나온다. 파일을 읽고 해시하므로 이벤트 루프 밖에서 호출한다.
+    """
+    from animated_drawings.utils import resolve_ad_filepath
+
+    digest = hashlib.sha256(f'render-cache-v{RENDER_CACHE_VERSION}'.encode())
+
+    def add(name: str, data: bytes) -> None:
+        digest.update(name.encode())
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+
+    for file_name in ('char_cfg.yaml', 'mask.png', 'texture.png'):
+        with open(os.path.join(job_dir, file_name), 'rb') as f:
+            add(file_name, f.read())
+
+    # 작업 디렉토리 경로가 키에 들어가지 않도록 빈 경로로 설정을 만든다
+    mvc_cfg = build_job_mvc_cfg(option, '')
+    add('mvc_cfg', yaml.safe_dump(mvc_cfg, sort_keys=True).encode())
+    for character in mvc_cfg['scene']['ANIMATED_CHARACTERS']:
+        motion_cfg_bytes = resolve_ad_filepath(character['motion_cfg'], 'motion cfg').read_bytes()
+        add('motion_cfg', motion_cfg_bytes)
+        add('retarget_cfg', resolve_ad_filepath(character['retarget_cfg'], 'retarget cfg').read_bytes())
+        add('bvh', resolve_ad_filepath(yaml.safe_load(motion_cfg_bytes)['filepath'], 'bvh filepath').read_bytes())
+
+    return digest.hexdigest()
+
+
+def gif_blob_name(cache_key: str) -> str:
+    """ 렌더 캐시 키로 정해지는 GIF의 blob 이름. 같은 결과는 항상 같은 blob에 올라간다. """
+    return f'gif/{cache_key}.gif'
+
+
+def create_gifs(job_dir: str, options: List[str], progress: Optional[Any] = None) -> List[str]:
+    """
+    워커 프로세스에서 실행되는 GIF 렌더링 작업. 한 캐릭터의 여러 동작(options)을 한 번에 렌더링한다.
+    마스크/텍스처/메쉬/ARAP 준비는 캐릭터당 한 번만 하고 모든 동작에서 재사용한다.
+    동작마다 큰 프레임버퍼의 타일 하나에 그려서, 매 프레임의 clear와 픽셀 읽기를 모든 동작이 한 번에 나눠 쓴다.
+    progress(RenderWorkerPool.create_progress_queue)가 있으면 GIF 하나가 다 써질 때마다 (동작, GIF 경로)를 넣는다.
+    짧은 동작의 GIF는 긴 동작의 렌더링이 끝나기 전에 나온다. GIF 경로 목록을 options 순서대로 반환한다.
+    """
+    from animated_drawings import render
+    mvc_cfgs = [build_job_mvc_cfg(option, job_dir) for option in options]
+    gif_paths = [mvc_cfg['controller']['OUTPUT_VIDEO_PATH'] for mvc_cfg in mvc_cfgs]
+
+    on_video_written = None
+    if progress is not None:
+        option_by_path = dict(zip(gif_paths, options))
+
+        def on_video_written(gif_path: str) -> None:
+            progress.put((option_by_path[gif_path], gif_path))
+
+    render.start_atlas(mvc_cfgs, on_video_written)
+    return gif_paths
+
+
+class RenderWorkerPool:
+    """
+    앱 전체에서 공유하는 렌더 워커 풀.
+    요청마다 ProcessPoolExecutor를 새로 만들지 않고, 앱 시작 시 미리 띄워둔 워커를 재사용한다.
+    동시에 대기할 수 있는 작업 수는 max_workers + queue_size 로 제한된다.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int):
+        self.max_workers = max_workers
+        self.max_pending = max_workers + queue_size
+        self._pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager: Optional[SyncManager] = None
+
+    async def start(self) -> None:
+        if self._executor is not None:
+            return
+
+        self._executor = self._create_executor()
+
+        # 워커 수만큼 빈 작업을 던져서 모든 워커가 import를 마친 상태로 만든다
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self._executor, _warm_up) for _ in range(self.max_workers)])
+        logging.info(f'Render worker pool started: {len(set(pids))} workers')
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_render_worker)
+
+    async def submit(self, fn, *args):
+        if self._pending >= self.max_pending:
+            raise RenderQueueFullError(f'render queue is full ({self.max_pending} jobs pending)')
+
+        self._pending += 1
+        try:
+            # lifespan 없이 앱이 뜬 경우(테스트 등)에는 처음 사용할 때 시작한다
+            if self._executor is None:
+                await self.start()
+
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # 다른 작업 때문에 이미 깨진 풀이면 새 풀에 넣는다
+                executor = self._replace_broken_executor(executor)
+                future = executor.submit(fn, *args)
+        except BaseException:
+            self._pending -= 1
+            raise
+
+        # 기다리던 요청이 취소되어도 워커의 작업은 계속 돌므로, 자리는 작업이 실제로 끝났을 때 돌려준다
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # 워커 하나가 죽으면(OSMesa 등 네이티브 코드의 segfault) 그 풀은 다시 쓸 수 없다.
+            # 그때 풀에 있던 작업만 실패시키고, 이후 작업은 새 풀에서 실행한다
+            self._replace_broken_executor(executor)
+            raise
+
+    def _release(self) -> None:
+        self._pending -= 1
+
+    def create_progress_queue(self) -> Any:
+        """ 워커에서 실행되는 작업이 끝나기 전에 중간 결과를 보낼 큐. submit하는 작업의 인자로 넘기고 iter_progress로 읽는다. """
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Queue()
+
+    @staticmethod
+    async def iter_progress(progress: Any, job: Awaitable) -> AsyncIterator[Any]:
+        """ job(submit으로 시작한 작업)이 끝날 때까지 progress 큐에 들어오는 값을 차례로 내준다. job의 결과나 예외는 따로 기다린다. """
+        job = asyncio.ensure_future(job)
+        while True:
+            # 워커는 작업을 끝내기 전에 큐에 넣으므로, 끝난 것을 확인한 뒤에 한 번 더 비우면 빠지는 값이 없다
+            done = job.done()
+            while True:
+                try:
+                    item = progress.get_nowait()
+                except queue.Empty:
+                    break
+                yield item
+            if done:
+                return
+            await asyncio.wait([job], timeout=PROGRESS_POLL_INTERVAL)
+
+    def _replace_broken_executor(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        # 같은 풀에서 실패한 작업들이 각자 호출하므로, 아직 그 풀을 쓰고 있을 때만 바꾼다
+        if self._executor is broken:
+            logging.error('Render worker pool is broken (a worker died). Starting a new pool')
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create_executor()
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logging.info('Render worker pool shut down')
+
+        # 워커가 모두 끝난 뒤에 진행 상황 큐를 정리한다
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+class RenderCache:
+    """
+    렌더 캐시 키로 이미 업로드된 GIF의 URL을 찾는 캐시.
+    최근에 쓴 키는 로컬 LRU(max_entries개)에, 나머지는 rendered_gif 테이블에서 키로 찾는다.
+    같은 키의 렌더링이 이미 진행 중이면(더블 클릭, 재시도) 새로 렌더링하지 않고 그 결과를 같이 기다린다.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._urls: OrderedDict[str, str] = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def get(self, cache_key: str) -> Optional[str]:
+        url = self._urls.get(cache_key)
+        if url is not None:
+            self._urls.move_to_end(cache_key)
+        return url
+
+    def put(self, cache_key: str, url: str) -> None:
+        self._urls[cache_key] = url
+        self._urls.move_to_end(cache_key)
+        while len(self._urls) > self.max_entries:
+            self._urls.popitem(last=False)
+
+    async def load_from_db(self, db: AsyncSession, cache_key: str) -> Optional[str]:
+        """ 로컬 캐시에 없으면 rendered_gif 테이블에서 찾아서 로컬 캐시에 채운다. """
+        url = self.get(cache_key)
+        if url is not None:
+            return url
+
+        url = await crud_get_rendered_gif_url(db, cache_key)
+        if url is not None:
+            self.put(cache_key, url)
+        return url
+
+    async def get_or_create(self, cache_key: str, create: Callable[[], Awaitable[str]]) -> str:
+        """ 로컬 캐시에 있으면 바로 반환하고, 없으면 create()로 렌더링, 업로드한 URL을 캐시에 넣고 반환한다. """
+        url = self.get(cache_key)
+        if url is not None:
+            return url
+
+        task = self._in_flight.get(cache_key)
+        if task is None:
+            task = self._start(cache_key, create())
+
+        # 기다리던 요청 하나가 취소되어도 같은 키를 기다리는 다른 요청을 위해 렌더링은 계속한다
+        return await asyncio.shield(task)
+
+    async def get_or_create_many(self, cache_keys: List[str],
+                                 create_many: Callable[[List[str]], Dict[str, Awaitable[str]]]) -> List[str]:
+        """
+        get_or_create의 여러 키 버전. 로컬 캐시에 없고 진행 중이지도 않은 키들만 모아서 create_many를 한 번 호출한다.
+        create_many(keys)는 키마다 그 URL을 기다릴 수 있는 awaitable을 담은 dict를 반환한다.
+        하나가 실패해도 나머지가 모두 끝날 때까지 기다린 뒤에 그 예외를 올린다. URL 목록을 cache_keys 순서대로 반환한다.
+        """
+        urls = {cache_key: self.get(cache_key) for cache_key in cache_keys}
+        missing = [cache_key for cache_key, url in urls.items() if url is None and cache_key not in self._in_flight]
+        if missing:
+            created = create_many(missing)
+            for cache_key in missing:
+                self._start(cache_key, created[cache_key])
+
+        waiting = [cache_key for cache_key, url in urls.items() if url is None]
+        results = await asyncio.gather(*[asyncio.shield(self._in_flight[cache_key]) for cache_key in waiting],
+                                       return_exceptions=True)
+        for cache_key, result in zip(waiting, results):
+            if isinstance(result, BaseException):
+                raise result
+            urls[cache_key] = result
+        return [urls[cache_key] for cache_key in cache_keys]
+
+    def _start(self, cache_key: str, create: Awaitable[str]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._create(cache_key, create))
+        self._in_flight[cache_key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        return task
+
+    async def _create(self, cache_key: str, create: Awaitable[str]) -> str:
+        url = await create
+        # 렌더링을 기다리던 요청의 DB 세션은 먼저 닫힐 수 있으므로 새 세션으로 기록한다
+        async with AsyncSessionLocal() as db:
+            await crud_create_rendered_gif(db, cache_key, url)
+        self.put(cache_key, url)
+        return url
+
+
+render_pool = RenderWorkerPool(settings.RENDER_WORKERS, settings.RENDER_QUEUE_SIZE)
+render_cache = RenderCache(settings.RENDER_CACHE_SIZE)
@@ -1,104 +1,134 @@
+import asyncio
+import aiofiles
 import cv2
+import logging
 import uuid
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
 from fastapi import UploadFile, HTTPException
-from io import BytesIO
 import yaml
 import os
+from typing import Optional, Union
 
 from select import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.models.models import Gree, GreeFile
+import numpy as np
 
-from tempfile import NamedTemporaryFile
 
-async def upload_file_to_azure(file: UploadFile) -> str:
-    container_name = "greefile"
+def get_storage_connection_string() -> Optional[str]:
+    """ AZURE_STORAGE_CONNECTION_STRING이 있으면 그 값을, 없으면 AZURE_ACCOUNT_KEY로 만든 연결 문자열을 반환한다. 둘 다 없으면 None """
+    if settings.AZURE_STORAGE_CONNECTION_STRING:
+        return settings.AZURE_STORAGE_CONNECTION_STRING
+
     AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
-    connection_string = f'DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net'
+    if not AZURE_ACCOUNT_KEY:
+        return None
+    return f"DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
 
-    # 파일 내용을 임시 파일에 저장
-    with NamedTemporaryFile(delete=False) as temp_file:
-        contents = await file.read()
-        temp_file.write(contents)
-        temp_file.seek(0)  # 파일 읽기 위치를 시작 위치로 이동
 
-        # OpenCV를 사용하여 이미지 읽기
-        image = cv2.imread(temp_file.name)
+class BlobStorage:
+    """
+    앱 전체에서 공유하는 비동기 Azure Blob 클라이언트.
+    업로드마다 클라이언트를 새로 만들지 않고, 하나의 HTTP 세션(커넥션 풀)을 앱이 떠 있는 동안 재사용한다.
+    업로드는 이벤트 루프를 막지 않으므로 여러 파일을 asyncio.gather 로 동시에 올릴 수 있다.
+    """
 
-    # 리사이즈할 새로운 너비, 비율에 따라 높이 계산
-    new_width = 400
-    new_height = 400
+    def __init__(self, container_name: str):
+        self.container_name = container_name
+        self._client: Optional[BlobServiceClient] = None
 
-    # 이미지 리사이즈
-    resized_image = cv2.resize(image, (new_width, new_height))
+    async def start(self) -> None:
+        if self._client is not None:
+            return
 
-    # 리사이즈된 이미지를 메모리에 인코딩
-    _, buffer = cv2.imencode('.png', resized_image)
+        connection_string = get_storage_connection_string()
+        if connection_string is None:
+            # 저장소 설정이 없어도 앱은 뜨게 하고, 업로드할 때 에러를 낸다
+            logging.warning('Azure storage is not configured. Set AZURE_ACCOUNT_KEY or AZURE_STORAGE_CONNECTION_STRING')
+            return
 
-    # Blob Service 클라이언트 생성 및 Blob 업로드
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=f"upload/{uuid.uuid4()}.png")
+        self._client = BlobServiceClient.from_connection_string(connection_string)
+        await self._client.__aenter__()
 
-    # 인코딩된 이미지 데이터로부터 Blob에 업로드
-    blob_client.upload_blob(BytesIO(buffer.tobytes()), overwrite=True, content_settings=ContentSettings(content_type='image/png'))
-
-    return blob_client.url
+    async def _get_client(self) -> BlobServiceClient:
+        # lifespan 없이 앱이 뜬 경우(테스트 등)에는 처음 사용할 때 시작한다
+        if self._client is None:
+            await self.start()
+        if self._client is None:
+            raise HTTPException(status_code=500, detail="Azure account key is not set in environment variables.")
+        return self._client
 
+    async def upload(self, blob_name: str, data: Union[bytes, str], content_type: str) -> str:
+        """ data를 blob_name으로 업로드하고(같은 이름이 있으면 덮어쓴다) blob URL을 반환한다. """
+        client = await self._get_client()
+        blob_client = client.get_blob_client(container=self.container_name, blob=blob_name)
+        await blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type=content_type))
+        return blob_client.url
 
-async def upload_greefile_to_azure(local_file_path: str) -> str:
-    container_name = "greefile"
-    AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
-    connection_string = f"DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
+    async def upload_local_file(self, blob_name: str, local_file_path: str, content_type: str) -> str:
+        async with aiofiles.open(local_file_path, 'rb') as f:
+            data = await f.read()
+        return await self.upload(blob_name, data, content_type)
 
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-    # 파일 이름은 로컬 파일 경로에서 추출
-    file_name = os.path.basename(local_file_path)
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=f"upload/{uuid.uuid4()}")
+    async def close(self) -> None:
+        if self._client is None:
+            return
 
-    # 로컬 파일을 읽어서 Azure에 업로드
-    with open(local_file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type='image/png'))
+        await self._client.close()
+        self._client = None
 
-    return blob_client.url
 
+blob_storage = BlobStorage(settings.AZURE_STORAGE_CONTAINER)
 
-async def upload_yaml_to_azure_blob(local_file_path: str) -> str:
-    container_name: str = "greefile"
-    AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
+async def upload_file_to_azure(file: UploadFile) -> str:
+    # 요청 본문을 디스크에 쓰지 않고 메모리에서 바로 디코딩, 리사이즈, 인코딩한다
+    contents = await file.read()
+    png = await asyncio.to_thread(_resize_to_png, contents)
+    if png is None:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid image.")
 
-    connection_string = f"DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
+    # 인코딩된 이미지 데이터로부터 Blob에 업로드
+    return await blob_storage.upload(f"upload/{uuid.uuid4()}.png", png, 'image/png')
 
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
 
-    file_name = os.path.basename(local_file_path)
-    unique_file_name = f"{uuid.uuid4()}_{file_name}"
+def _resize_to_png(contents: bytes) -> Optional[bytes]:
+    """ 인코딩된 이미지 바이트를 400x400으로 리사이즈한 PNG 바이트로 바꾼다. 이미지가 아니면 None """
+    # OpenCV를 사용하여 메모리에서 이미지 읽기
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR) if contents else None
+    if image is None:
+        return None
 
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=unique_file_name)
+    # 리사이즈할 새로운 너비, 높이
+    new_width = 400
+    new_height = 400
 
-    with open(local_file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True,
-                                content_settings=ContentSettings(content_type='application/x-yaml'))
+    # 이미지 리사이즈
+    resized_image = cv2.resize(image, (new_width, new_height))
 
-    # 업로드된 파일의 URL 반환
-    blob_url = blob_client.url
-    return blob_url
+    # 리사이즈된 이미지를 메모리에 인코딩
+    _, buffer = cv2.imencode('.png', resized_image)
+    return buffer.tobytes()
 
 
-async def upload_gif_to_azure_blob(local_file_path: str) -> str:
-    container_name = "greefile"
-    AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
+async def upload_greefile_to_azure(data: bytes) -> str:
+    """ 메모리에 있는 PNG(세그멘테이션 마스크 등)를 업로드하고 URL을 반환한다. """
+    return await blob_storage.upload(f"upload/{uuid.uuid4()}", data, 'image/png')
 
-    connection_string = f"DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
-    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
 
+async def upload_yaml_to_azure_blob(local_file_path: str) -> str:
     file_name = os.path.basename(local_file_path)
     unique_file_name = f"{uuid.uuid4()}_{file_name}"
 
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=unique_file_name)
+    # 업로드된 파일의 URL 반환
+    return await blob_storage.upload_local_file(unique_file_name, local_file_path, 'application/x-yaml')
+
 
-    with open(local_file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type='image/gif'))
+async def upload_gif_to_azure_blob(local_file_path: str, blob_name: Optional[str] = None) -> str:
+    # blob 이름을 지정하지 않으면 겹치지 않는 이름을 만든다
+    if blob_name is None:
+        file_name = os.path.basename(local_file_path)
+        blob_name = f"{uuid.uuid4()}_{file_name}"
 
-    blob_url = blob_client.url
-    return blob_url
\ No newline at end of file
+    return await blob_storage.upload_local_file(blob_name, local_file_path, 'image/gif')
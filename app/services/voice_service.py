@@ -1,19 +1,42 @@
+import asyncio
+import hashlib
+import unicodedata
 import urllib.request
 import os
-import uuid
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
 import aiohttp
 import openai
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from sqlalchemy.future import select
 
+from app.core.config import settings
 from app.crud.crud_gree import crud_get_gree_by_id_only
-from app.models.enums import VoiceTypeEnum
-from app.models.models import Log
+from app.crud.crud_log import get_recent_talk_logs
+from app.crud.crud_tts import crud_get_tts_audio_url, crud_create_tts_audio
+from app.database import AsyncSessionLocal
+from app.models.enums import LogTypeEnum, VoiceTypeEnum
 from app.schemas.ChatDto import ChatRequestDto
 from app.schemas.LogDto import CreateGreeTalkLogDto, CreateUserTalkLogDto
 from app.services.log_service import create_greetalk_log_service, create_usertalk_log_service
+from app.services.upload_service import blob_storage
+
+# 동시에 OpenAI로 보내는 채팅 요청 수를 제한한다. 나머지는 자리가 날 때까지 기다린다
+openai_semaphore = asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY)
+
+
+async def create_chat_completion(**params) -> str:
+    """
+    OpenAI 채팅 응답을 비동기로 받아 내용만 반환한다. 응답을 기다리는 동안 이벤트 루프를 막지 않는다.
+    요청마다 OPENAI_TIMEOUT 제한 시간이 걸리고, 넘으면 openai.error.Timeout 이 발생한다.
+    """
+    async with openai_semaphore:
+        completion = await openai.ChatCompletion.acreate(
+            api_base=settings.OPENAI_API_BASE,
+            request_timeout=settings.OPENAI_TIMEOUT,
+            **params
+        )
+    return completion.choices[0].message.content
 
 # chat 테스트를 위한 서비스이다.
 async def chat_with_openai_test_service(chat_request):
@@ -33,7 +56,7 @@ async def chat_with_openai_test_service(chat_request):
     )
 
     try:
-        completion = openai.ChatCompletion.create(
+        return await create_chat_completion(
             model="gpt-3.5-turbo",
             temperature=1.5,
             top_p=0.7,
@@ -44,7 +67,8 @@ async def chat_with_openai_test_service(chat_request):
                 {"role": "user", "content": chat_request.message}
             ]
         )
-        return completion.choices[0].message.content
+    except openai.error.Timeout:
+        raise HTTPException(status_code=504, detail="The chat model did not respond in time.")
     except Exception as exc:
         print(f"An error occurred: {exc}")
         raise HTTPException(status_code=500, detail="An error occurred while processing your request.")
@@ -62,29 +86,15 @@ async def chat_with_openai_test_service(chat_request):
 # 8. Azure에 저장된 URL은 Log에 저장되어야한다. ✅
 # 9. GREE의 성격을 지정할때(Update Gree) Gree객체의 VoiceTypeEnum이 지정되어야한다. ✅
 async def chat_with_openai_service(db: AsyncSession, chat_request: ChatRequestDto):
-    gree = await crud_get_gree_by_id_only(db, chat_request.gree_id)
-
-    result = await db.execute(select(Log).filter(Log.gree_id == chat_request.gree_id))
-    contents = [log_entry.content for log_entry in result.scalars().all()]
-
-    system_message = (
-        "이 대화는 한국어로 진행됩니다. 모든 응답은 한국어로 제공되어야 합니다. \n"
-        "당신은 미취학 아동과 대화하는 5~7세의 친구입니다. 반말로 답변해주세요 \n"
-        "사용자가 말하는 것에 공감하고 친구처럼 대화합니다. \n"
-        "하지만 당신은 자신의 의견을 가지고 있으며, \n"
-        "항상 동의하기만 하는 것이 아니라 때로는 자신의 생각을 분명히 표현합니다. \n"
-        "또한, 대화가 힘들 때는 감정을 살짝 드러내기도 합니다. \n"
-        "어린 아이들과 대화할 때 사용하는 단순하고 이해하기 쉬운 언어를 사용해주세요.\n"
-        "당신은 간결하고 단순하고 친근하게 반말로 말하는 어린아이입니다.때로는 약간 재수 없게 대답도 합니다. \n"
-        "길어져도 5문장 안으로 답변하도록 해주세요. 웬만하면 2~3문장으로 간결하게 답변해주세요\n" 
-        "때로는 상대방의 말이 없어도 먼저 질문해줍니다\n"
-    )
-    system_message += f"당신은 {gree.prompt_gender}, {gree.prompt_age}살, 이름은 {gree.gree_name}, MBTI는 각각의 성향이 강하게 나타나는 {gree.prompt_mbti}입니다.\n\n"
+    persona = await gree_persona_cache.get(db, chat_request.gree_id)
+    if persona is None:
+        raise HTTPException(status_code=404, detail="Gree not found")
 
-    print(f'system_message = {system_message}')
+    # 사용자 메시지를 로그로 남기기 전에 문맥을 만들어야 이번 메시지가 문맥에 두 번 들어가지 않는다
+    messages = await build_gree_chat_messages(db, persona, chat_request.message)
 
     createUserLogDto = CreateUserTalkLogDto(
-        gree_id=gree.id,
+        gree_id=persona.gree_id,
         log_type='USER_TALK',
         content=chat_request.message
     )
@@ -92,26 +102,14 @@ async def chat_with_openai_service(db: AsyncSession, chat_request: ChatRequestDt
     user_talk = await create_usertalk_log_service(db ,createUserLogDto)
 
     try:
-        completion = openai.ChatCompletion.create(
-            model="ft:gpt-3.5-turbo-0613:personal::8sn4jyEw",
-            temperature=1.5,
-            top_p=0.7,
-            frequency_penalty=0.3,
-            presence_penalty=0.1,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": chat_request.message}
-            ]
-        )
-        gree_talk= completion.choices[0].message.content
+        gree_talk = await create_chat_completion(messages=messages, **GREE_CHAT_PARAMS)
 
         print(f'gree_talk = {gree_talk}')
 
-        mp3_path = await text_to_speech_naver(gree.voice_type, gree_talk)
-        voice_url_azure= await upload_mp3_azure(mp3_path)
+        voice_url_azure = await tts_cache.get_url(persona.voice_type, gree_talk)
 
         createGptLogDto = CreateGreeTalkLogDto(
-            gree_id=gree.id,
+            gree_id=persona.gree_id,
             log_type='GREE_TALK',
             content=gree_talk,
             voice_url=voice_url_azure
@@ -120,49 +118,99 @@ async def chat_with_openai_service(db: AsyncSession, chat_request: ChatRequestDt
         gpt_talk = await create_greetalk_log_service(db ,createGptLogDto)
 
         return {"user_talk": user_talk, "gpt_talk": gpt_talk}
+    except openai.error.Timeout:
+        raise HTTPException(status_code=504, detail="The chat model did not respond in time.")
     except Exception as exc:
         print(f"An error occurred: {exc}")
         raise HTTPException(status_code=500, detail="An error occurred while processing your request.")
 
 
-async def text_to_speech(voice_type: VoiceTypeEnum, gree_talk: str) -> str:
-    url = "https://api.openai.com/v1/audio/speech"
-    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') # 환경변수에서 API 키를 가져옵니다.
+# 그리 채팅에 쓰는 파인튜닝 모델과 샘플링 설정
+GREE_CHAT_PARAMS = dict(
+    model="ft:gpt-3.5-turbo-0613:personal::8sn4jyEw",
+    temperature=1.5,
+    top_p=0.7,
+    frequency_penalty=0.3,
+    presence_penalty=0.1,
+)
 
-    payload = {
-        "model": "tts-1",
-        "input": gree_talk,
-        "voice": voice_type.value
-    }
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload, headers=headers) as response:
-            if response.status == 200:
-                content = await response.read()
-                
-                # 지정된 경로에 디렉토리가 없으면 생성
-                dir_path = '/temp/voice_temp/'
-                if not os.path.exists(dir_path):
-                    os.makedirs(dir_path)
-                
-                # 파일 저장 경로 변경
-                mp3_path = os.path.join(dir_path, f'{voice_type.value}_speech.mp3')
-                
-                with open(mp3_path, 'wb') as f:
-                    f.write(content)
-                return mp3_path
-            else:
-                return "Error: 응답 상태가 200이 아닙니다."
-
-async def text_to_speech_naver(voice_type: VoiceTypeEnum, text: str) -> str:
+def build_gree_system_message(gree) -> str:
+    system_message = (
+        "이 대화는 한국어로 진행됩니다. 모든 응답은 한국어로 제공되어야 합니다. \n"
+        "당신은 미취학 아동과 대화하는 5~7세의 친구입니다. 반말로 답변해주세요 \n"
+        "사용자가 말하는 것에 공감하고 친구처럼 대화합니다. \n"
+        "하지만 당신은 자신의 의견을 가지고 있으며, \n"
+        "항상 동의하기만 하는 것이 아니라 때로는 자신의 생각을 분명히 표현합니다. \n"
+        "또한, 대화가 힘들 때는 감정을 살짝 드러내기도 합니다. \n"
+        "어린 아이들과 대화할 때 사용하는 단순하고 이해하기 쉬운 언어를 사용해주세요.\n"
+        "당신은 간결하고 단순하고 친근하게 반말로 말하는 어린아이입니다.때로는 약간 재수 없게 대답도 합니다. \n"
+        "길어져도 5문장 안으로 답변하도록 해주세요. 웬만하면 2~3문장으로 간결하게 답변해주세요\n" 
+        "때로는 상대방의 말이 없어도 먼저 질문해줍니다\n"
+    )
+    system_message += f"당신은 {gree.prompt_gender}, {gree.prompt_age}살, 이름은 {gree.gree_name}, MBTI는 각각의 성향이 강하게 나타나는 {gree.prompt_mbti}입니다.\n\n"
+    return system_message
+
+
+class GreePersona(NamedTuple):
+    gree_id: int
+    voice_type: VoiceTypeEnum
+    system_message: str
+
+
+class GreePersonaCache:
+    """
+    그리별 성격(시스템 프롬프트)과 목소리 캐시. 채팅할 때마다 그리를 다시 조회해서 같은 프롬프트를 만들지 않는다.
+    그리 정보가 바뀌면(/gree/update) invalidate 해야 한다. 최근에 쓴 max_entries개만 들고 있는다.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._personas: OrderedDict[int, GreePersona] = OrderedDict()
+
+    async def get(self, db: AsyncSession, gree_id: int) -> Optional[GreePersona]:
+        """ 캐시에 없으면 그리를 조회해서 채운다. 그리가 없으면 None """
+        persona = self._personas.get(gree_id)
+        if persona is not None:
+            self._personas.move_to_end(gree_id)
+            return persona
+
+        gree = await crud_get_gree_by_id_only(db, gree_id)
+        if gree is None:
+            return None
+
+        persona = GreePersona(gree.id, gree.voice_type, build_gree_system_message(gree))
+        self._personas[gree_id] = persona
+        while len(self._personas) > self.max_entries:
+            self._personas.popitem(last=False)
+        return persona
+
+    def invalidate(self, gree_id: int) -> None:
+        self._personas.pop(gree_id, None)
+
+
+gree_persona_cache = GreePersonaCache(settings.GREE_PERSONA_CACHE_SIZE)
+
+
+async def build_gree_chat_messages(db: AsyncSession, persona: GreePersona, message: str) -> List[dict]:
+    """ 시스템 프롬프트, 최근 대화 CHAT_HISTORY_SIZE개, 이번 사용자 메시지 순서로 모델에 보낼 메시지를 만든다. """
+    recent_logs = await get_recent_talk_logs(db, persona.gree_id, settings.CHAT_HISTORY_SIZE)
+
+    messages = [{"role": "system", "content": persona.system_message}]
+    for log in reversed(recent_logs):
+        if log.content:
+            role = "user" if log.log_type == LogTypeEnum.USER_TALK else "assistant"
+            messages.append({"role": role, "content": log.content})
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+async def synthesize_speech_naver(voice_type: VoiceTypeEnum, text: str, speed: int = 0, pitch: int = 0) -> bytes:
+    """ Naver TTS로 text를 합성한 MP3 바이트를 반환한다. 파일을 쓰지 않으므로 동시에 여러 문장을 합성해도 된다. """
     client_id = os.getenv('NAVER_CLIENT_ID')  # 환경변수에서 클라이언트 ID를 가져옵니다.
     client_secret = os.getenv('NAVER_CLIENT_SECRET')  # 환경변수에서 클라이언트 비밀을 가져옵니다.
     encText = urllib.parse.quote(text)
-    data = f"speaker={voice_type.value}&volume=0&speed=0&pitch=0&format=mp3&text=" + encText
+    data = f"speaker={voice_type.value}&volume=0&speed={speed}&pitch={pitch}&format=mp3&text=" + encText
     url = "https://naveropenapi.apigw.ntruss.com/tts-premium/v1/tts"
 
 
@@ -174,45 +222,105 @@ async def text_to_speech_naver(voice_type: VoiceTypeEnum, text: str) -> str:
 
     async with aiohttp.ClientSession() as session:
         async with session.post(url, data=data.encode('utf-8'), headers=headers) as response:
-            if response.status == 200:
-                content = await response.read()
-                
-                # 지정된 경로에 디렉토리가 없으면 생성
-                dir_path = '/temp/voice_temp/'
-                if not os.path.exists(dir_path):
-                    os.makedirs(dir_path)
-                
-                # 파일 저장 경로 변경
-                mp3_path = os.path.join(dir_path, f'{voice_type.value}_speech.mp3')
-                
-                with open(mp3_path, 'wb') as f:
-                    f.write(content)
-                return mp3_path
-            else:
-                return "Error: 응답 상태가 200이 아닙니다."
-
-async def upload_mp3_azure(mp3_path: str) -> str:
-    try:
-        container_name = "greefile"
-        AZURE_ACCOUNT_KEY = os.getenv("AZURE_ACCOUNT_KEY")
-        if not AZURE_ACCOUNT_KEY:
-            raise HTTPException(status_code=500, detail="Azure account key is not set in environment variables.")
+            if response.status != 200:
+                raise HTTPException(status_code=502, detail=f"Naver TTS failed. Status code: {response.status}")
+            return await response.read()
+
+
+# Naver TTS 설정이나 음성 형식이 바뀌면 값을 올려서 예전에 합성한 음성을 캐시에서 쓰지 않게 한다
+TTS_CACHE_VERSION = 1
+
+
+def normalize_tts_text(text: str) -> str:
+    """ 같은 소리가 나는 문장이 같은 캐시 키를 갖도록 유니코드(NFC)와 공백을 정규화한다. """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def tts_cache_key(voice_type: VoiceTypeEnum, text: str, speed: int = 0, pitch: int = 0) -> str:
+    """ (목소리, 정규화한 문장, 속도, 높낮이)로 만든 sha256. 같은 설정으로 같은 문장을 말하면 같은 키가 나온다. """
+    key = f'tts-cache-v{TTS_CACHE_VERSION}\0{voice_type.value}\0{speed}\0{pitch}\0{normalize_tts_text(text)}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def tts_blob_name(cache_key: str) -> str:
+    """ TTS 캐시 키로 정해지는 음성의 blob 이름. 같은 음성은 항상 같은 blob에 올라간다. """
+    return f'tts/{cache_key}.mp3'
+
+
+class TtsCache:
+    """
+    Naver TTS로 합성해서 업로드한 음성 URL의 캐시. 인사말처럼 여러 그리가 같은 목소리로 똑같이 하는 말은 한 번만 합성한다.
+    최근에 쓴 키는 로컬 LRU(max_entries개)에 URL을 들고 있고, 나머지는 tts_audio 테이블에서 찾는다.
+    둘 다 없을 때만 합성하고 업로드한다. 같은 키의 합성이 이미 진행 중이면 새로 합성하지 않고 그 결과를 같이 기다린다.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._urls: OrderedDict[str, str] = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+        self.local_hits = 0  # 로컬 LRU(또는 진행 중인 같은 합성)로 처리한 요청 수
+        self.index_hits = 0  # tts_audio 테이블에서 URL을 찾은 요청 수
+        self.misses = 0  # 새로 합성한 요청 수
+
+    def get(self, cache_key: str) -> Optional[str]:
+        url = self._urls.get(cache_key)
+        if url is not None:
+            self._urls.move_to_end(cache_key)
+        return url
+
+    def put(self, cache_key: str, url: str) -> None:
+        self._urls[cache_key] = url
+        self._urls.move_to_end(cache_key)
+        while len(self._urls) > self.max_entries:
+            self._urls.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.index_hits + self.misses
+        return {
+            "entries": len(self._urls),
+            "local_hits": self.local_hits,
+            "index_hits": self.index_hits,
+            "misses": self.misses,
+            "hit_rate": (self.local_hits + self.index_hits) / lookups if lookups else 0.0,
+        }
+
+    async def get_url(self, voice_type: VoiceTypeEnum, text: str, speed: int = 0, pitch: int = 0) -> str:
+        """ 업로드된 음성의 URL을 반환한다. 캐시에 있으면 Naver TTS도, 업로드도 하지 않는다. """
+        cache_key = tts_cache_key(voice_type, text, speed, pitch)
+        url = self.get(cache_key)
+        if url is not None:
+            self.local_hits += 1
+            return url
+
+        task = self._in_flight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._load_or_synthesize(cache_key, voice_type, text, speed, pitch))
+            self._in_flight[cache_key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+        else:
+            self.local_hits += 1
 
-        connection_string = f"DefaultEndpointsProtocol=https;AccountName=greedotstorage;AccountKey={AZURE_ACCOUNT_KEY};EndpointSuffix=core.windows.net"
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        # 기다리던 요청 하나가 취소되어도 같은 키를 기다리는 다른 요청을 위해 합성은 계속한다
+        return await asyncio.shield(task)
 
-        # 파일 이름 추출 및 고유한 파일 이름 생성
-        file_name = os.path.basename(mp3_path)
-        unique_file_name = f"logVoices/{uuid.uuid4()}_{file_name}"
+    async def _load_or_synthesize(self, cache_key: str, voice_type: VoiceTypeEnum, text: str,
+                                  speed: int, pitch: int) -> str:
+        # 요청의 DB 세션은 다른 요청과 같이 기다리는 이 작업보다 먼저 닫힐 수 있으므로 새 세션을 쓴다
+        async with AsyncSessionLocal() as db:
+            url = await crud_get_tts_audio_url(db, cache_key)
+        if url is not None:
+            self.index_hits += 1
+            self.put(cache_key, url)
+            return url
 
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=unique_file_name)
+        self.misses += 1
+        audio = await synthesize_speech_naver(voice_type, normalize_tts_text(text), speed, pitch)
+        url = await blob_storage.upload(tts_blob_name(cache_key), audio, 'audio/mpeg')
+        async with AsyncSessionLocal() as db:
+            await crud_create_tts_audio(db, cache_key, voice_type, normalize_tts_text(text), url)
+        self.put(cache_key, url)
+        return url
 
-        # 파일 업로드
-        with open(mp3_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type='audio/mpeg'))
 
-        # 업로드된 파일의 URL 반환
-        return blob_client.url
-    except Exception as e:
-        print(f"An error occurred while uploading MP3 to Azure: {e}")
-        raise HTTPException(status_code=500, detail=f"An error occurred while uploading MP3 to Azure: {e}")
+tts_cache = TtsCache(settings.TTS_CACHE_SIZE)
@@ -1,15 +1,35 @@
 # main.py
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.router import api_router
 from app.core.config import settings
+from app.services.job_service import job_runner
+from app.services.render_service import render_pool
+from app.services.upload_service import blob_storage
 
 
 from app.models import init_db
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 앱 시작 시 렌더 워커와 Blob 클라이언트를 미리 준비해두고, 종료 시 정리한다
+    await render_pool.start()
+    await blob_storage.start()
+    # 이전 프로세스에서 끝나지 못한 작업은 다시 실행되지 않으므로, 조회하는 클라이언트가 계속 기다리지 않게 실패로 기록한다
+    await job_runner.fail_interrupted_jobs()
+    yield
+    # 렌더 워커와 Blob 클라이언트를 정리하기 전에 남은 백그라운드 작업을 취소한다
+    await job_runner.shutdown()
+    render_pool.shutdown()
+    await blob_storage.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS 미들웨어 설정
 app.add_middleware(
@@ -0,0 +1,78 @@
+import types
+
+import numpy as np
+from PIL import Image, ImageSequence
+from animated_drawings.controller.video_render_controller import GIFWriter, OptimizedGIFWriter
+
+
+def make_frames(n=12, size=64):
+    # 투명 배경 위에서 움직이는 사각형 (BGRA)
+    frames = []
+    for i in range(n):
+        frame = np.zeros((size, size, 4), dtype=np.uint8)
+        frame[10 + i:30 + i, 5:25] = (200, 60, 30, 255)
+        frames.append(frame)
+    frames.insert(3, frames[2].copy())  # 같은 프레임이 연속으로 들어오는 경우
+    return frames
+
+
+def write_gif(path, frames):
+    controller = types.SimpleNamespace(cfg=types.SimpleNamespace(output_video_path=str(path)), delta_t=0.04)
+    writer = GIFWriter(controller)
+    for frame in frames:
+        writer.process_frame(frame)
+    writer.cleanup()
+
+
+def test_gif_writer_streams_all_frames(tmp_path):
+    path = tmp_path / 'out.gif'
+    frames = make_frames()
+    write_gif(path, frames)
+
+    im = Image.open(path)
+    decoded = [np.asarray(f.convert('RGBA')).copy() for f in ImageSequence.Iterator(im)]
+
+    # 연속된 중복 프레임은 하나로 합쳐지고, 길이는 두 배가 된다
+    assert len(decoded) == len(frames) - 1
+    im.seek(2)
+    assert im.info['duration'] == 2 * 40
+
+    expected = [f[..., [2, 1, 0, 3]] for f in frames[:3] + frames[4:]]
+    for got, want in zip(decoded, expected):
+        assert np.array_equal(got[..., 3], want[..., 3])
+        assert np.array_equal(got[want[..., 3] > 0], want[want[..., 3] > 0])
+
+
+def test_optimized_gif_writer_matches_frames(tmp_path):
+    path = tmp_path / 'out.gif'
+    frames = make_frames()
+    controller = types.SimpleNamespace(cfg=types.SimpleNamespace(output_video_path=str(path)), delta_t=0.04)
+    writer = OptimizedGIFWriter(controller)
+    for frame in frames:
+        writer.process_frame(frame)
+    writer.cleanup()
+
+    im = Image.open(path)
+    decoded = [np.asarray(f.convert('RGBA')).copy() for f in ImageSequence.Iterator(im)]
+    assert len(decoded) == len(frames) - 1
+
+    # 사각형이 움직이면서 사라지는 픽셀도 투명하게 돌아와야 한다
+    expected = [f[..., [2, 1, 0, 3]] for f in frames[:3] + frames[4:]]
+    for got, want in zip(decoded, expected):
+        assert np.array_equal(got[..., 3], want[..., 3])
+        assert np.array_equal(got[want[..., 3] > 0], want[want[..., 3] > 0])
+
+
+def test_gif_writer_starts_encoder_on_first_frame(tmp_path):
+    path = tmp_path / 'out.gif'
+    controller = types.SimpleNamespace(cfg=types.SimpleNamespace(output_video_path=str(path)), delta_t=0.04)
+    writer = GIFWriter(controller)
+    # 프레임을 받기 전에는 인코더 스레드도, 출력 파일도 없다
+    assert writer._encode_thread is None
+    writer.cleanup()
+    assert not path.exists()
+
+    writer.process_frame(make_frames()[0])
+    writer.cleanup()
+    writer.cleanup()  # 실패한 렌더링을 정리할 때처럼 두 번 불려도 된다
+    assert path.exists()
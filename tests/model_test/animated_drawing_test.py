@@ -0,0 +1,35 @@
+import types
+
+import numpy as np
+from animated_drawings.model.animated_drawing import AnimatedDrawingCharacter
+
+
+def closest_bones(mask, seeds_xy, seed_joint_idxs, joint_num):
+    character = types.SimpleNamespace(img_dim=mask.shape[0], mask=mask)
+    return AnimatedDrawingCharacter._closest_bones_to_mask_pixels(character, np.array(seeds_xy, dtype=np.int32), np.array(seed_joint_idxs), joint_num)
+
+
+def test_closest_bones_follow_paths_through_mask():
+    mask = np.zeros([10, 10], dtype=np.uint8)
+    mask[2:8, 2:8] = 1
+    distance, joint_idx = closest_bones(mask, [[2, 2], [7, 7]], [0, 1], 2)
+
+    # 시드 자신은 마스크에 속하지 않고, 이웃한 픽셀부터 거리를 잰다
+    assert joint_idx[2, 3] == 0 and distance[2, 3] == 1
+    assert joint_idx[7, 6] == 1 and distance[7, 6] == 1
+    assert joint_idx[3, 3] == 0 and distance[3, 3] == 1  # 대각선 1.414는 정수로 잘린다
+    # 마스크 밖의 픽셀은 어느 뼈에도 닿지 않는다
+    assert joint_idx[0, 0] == -1 and distance[0, 0] == 1 << 12
+
+
+def test_closest_bones_off_canvas_seeds():
+    mask = np.ones([10, 10], dtype=np.uint8)
+    # joint 0은 캔버스 밖 멀리, joint 1은 안쪽, joint 2는 캔버스 바로 바깥(x=-1)에 시드가 있다
+    seeds_xy = [[-5, 4], [-3, 12], [15, 5], [5, 5], [-1, 0]]
+    distance, joint_idx = closest_bones(mask, seeds_xy, [0, 0, 0, 1, 2], 3)
+
+    # 멀리 떨어진 시드는 이웃한 픽셀이 이미지 안에 없으므로 아무 픽셀에도 닿지 않는다
+    assert not (joint_idx == 0).any()
+    # 바로 바깥의 시드는 가장자리 픽셀로 들어올 수 있다
+    assert joint_idx[0, 0] == 2 and distance[0, 0] == 1
+    assert joint_idx[5, 4] == 1 and distance[5, 4] == 1
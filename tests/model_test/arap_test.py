@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from animated_drawings.model.arap import ARAP
+
+
+def make_grid_mesh(n=8):
+    # n x n 격자를 삼각형으로 나눈 테스트용 메쉬
+    xs, ys = np.meshgrid(np.linspace(0, 1, n), np.linspace(0, 1, n))
+    vertices = np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32)
+    triangles = []
+    for r in range(n - 1):
+        for c in range(n - 1):
+            v = r * n + c
+            triangles.append(np.array([v, v + 1, v + n], dtype=np.int32))
+            triangles.append(np.array([v + 1, v + n + 1, v + n], dtype=np.int32))
+    pins = np.array([[0.1, 0.1], [0.5, 0.5], [0.9, 0.2], [0.3, 0.8]], dtype=np.float32)
+    return vertices, triangles, pins
+
+
+def rotate_edge_vectors_loop(edge_vectors, T1):
+    # 벡터화 이전의 엣지별 회전 계산
+    b2_top = np.empty([len(edge_vectors), 2], dtype=np.float64)
+    for idx, e0 in enumerate(edge_vectors):
+        c = T1[2*idx]
+        s = T1[2*idx + 1]
+        scale = 1.0 / np.sqrt(c * c + s * s)
+        c *= scale
+        s *= scale
+        T2 = np.asarray(((c, s), (-s, c)))
+        b2_top[idx] = np.dot(T2, e0)
+    return b2_top
+
+
+def test_arap_rest_pose_returns_original_vertices():
+    vertices, triangles, pins = make_grid_mesh()
+    arap = ARAP(pins, triangles, vertices)
+
+    assert np.allclose(arap.solve(pins), vertices, atol=1e-4)
+
+
+def test_rotate_edge_vectors_matches_loop():
+    vertices, triangles, pins = make_grid_mesh()
+    arap = ARAP(pins, triangles, vertices)
+
+    T1 = np.random.default_rng(0).normal(size=2 * arap.edge_num)
+
+    assert np.allclose(arap._rotate_edge_vectors(T1[:, None])[..., 0], rotate_edge_vectors_loop(arap.edge_vectors, T1), atol=1e-12)
+
+
+@pytest.mark.parametrize("rotation_dtype, atol", [(np.float64, 1e-9), (np.float32, 1e-4)])
+def test_solve_matches_loop(rotation_dtype, atol):
+    vertices, triangles, pins = make_grid_mesh()
+    arap = ARAP(pins, triangles, vertices, rotation_dtype=rotation_dtype)
+    new_pins = pins + np.array([[0.0, 0.0], [0.2, -0.1], [0.1, 0.3], [-0.2, 0.0]], dtype=np.float32)
+
+    # 회전 단계만 예전 방식으로 바꿔서 같은 결과가 나오는지 확인
+    reference = ARAP(pins, triangles, vertices)
+    reference._rotate_edge_vectors = lambda T1: rotate_edge_vectors_loop(reference.edge_vectors, T1[:, 0])[..., None]
+
+    assert np.allclose(arap.solve(new_pins), reference.solve(new_pins), atol=atol)
+
+
+def test_solve_batch_matches_per_frame_solve():
+    vertices, triangles, pins = make_grid_mesh()
+    arap = ARAP(pins, triangles, vertices)
+    offsets = np.random.default_rng(0).normal(scale=0.1, size=(5,) + pins.shape)
+    pins_frames = (pins + offsets).astype(np.float32)
+
+    batch = arap.solve_batch(pins_frames)
+
+    assert batch.shape == (5, len(vertices), 2)
+    for frame_pins, frame_vertices in zip(pins_frames, batch):
+        assert np.allclose(frame_vertices, arap.solve(frame_pins), atol=1e-9)
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+from app.segmentation import segmentImage, segmentMask
+
+
+def make_drawing(center=(200, 200), radius=100):
+    # 흰 종이 위에 검은 선으로 그린 원 (BGR)
+    image = np.full((400, 400, 3), 255, dtype=np.uint8)
+    cv2.circle(image, center, radius, (0, 0, 0), thickness=3)
+    return image
+
+
+def test_segment_mask_fills_closed_drawing():
+    mask = segmentMask(make_drawing())
+    assert mask.shape == (400, 400)
+    assert mask[200, 200] == 255  # 선 안쪽은 채워진다
+    assert mask[10, 10] == 0 and mask[390, 390] == 0
+
+
+def test_segment_mask_drawing_touching_edge():
+    # 그림이 이미지 가장자리에 닿아도 바깥 배경은 전경이 되지 않는다
+    mask = segmentMask(make_drawing(center=(150, 200), radius=150))
+    assert mask[200, 150] == 255
+    assert mask[5, 395] == 0
+
+
+def test_segment_image_returns_png_bytes():
+    _, drawing_png = cv2.imencode('.png', make_drawing())
+
+    mask = cv2.imdecode(np.frombuffer(segmentImage(drawing_png.tobytes()), np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(mask, segmentMask(make_drawing()))
+
+
+def test_segment_image_invalid_bytes():
+    with pytest.raises(ValueError):
+        segmentImage(b'not an image')
+
+
+def test_segment_mask_blank_image():
+    with pytest.raises(ValueError):
+        segmentMask(np.full((400, 400, 3), 255, dtype=np.uint8))
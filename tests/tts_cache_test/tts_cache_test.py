@@ -0,0 +1,28 @@
+from app.models.enums import VoiceTypeEnum
+from app.services.voice_service import TtsCache, tts_cache_key
+
+VOICE = list(VoiceTypeEnum)[0]
+
+
+def test_tts_cache_key_normalizes_whitespace():
+    assert tts_cache_key(VOICE, '안녕! 반가워') == tts_cache_key(VOICE, ' 안녕!\n반가워  ')
+
+
+def test_tts_cache_key_depends_on_voice_settings():
+    key = tts_cache_key(VOICE, '안녕!')
+    assert tts_cache_key(VOICE, '안녕!', speed=1) != key
+    assert tts_cache_key(VOICE, '안녕!', pitch=-1) != key
+    assert tts_cache_key(VOICE, '안녕?') != key
+
+
+def test_tts_cache_evicts_least_recently_used_url():
+    cache = TtsCache(max_entries=2)
+    cache.put('a', 'url-a')
+    cache.put('b', 'url-b')
+    assert cache.get('a') == 'url-a'  # a를 쓰면 b가 가장 오래된 항목이 된다
+
+    cache.put('c', 'url-c')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'url-a'
+    assert cache.get('c') == 'url-c'
+    assert cache.stats()['entries'] == 2